@@ -0,0 +1,109 @@
+"""
+Runtime benchmark for the batch rider-to-ride matching job.
+
+Usage:
+    python3 benchmarks/bench_ride_matching.py [--sizes 1000 10000] [--places 12] [--seed 7]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+from matching import solve_assignment
+from services.ride_request_manager import RideRequestManager
+
+PLACES = [
+    "Santa Cruz", "San Jose", "San Francisco", "Oakland", "Berkeley", "Palo Alto",
+    "Monterey", "Sacramento", "Fremont", "Watsonville", "Gilroy", "Los Angeles",
+]
+DATES = [f"2030-01-{day:02d}" for day in range(1, 8)]
+
+
+def departure_time(rng):
+    """
+    Random departure time between 6 AM and 10 PM on a five minute grid.
+    """
+    minutes = rng.randrange(6 * 60, 22 * 60, 5)
+    hour, minute = divmod(minutes, 60)
+    return f"{(hour - 1) % 12 + 1:02d}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
+
+def generate(rider_count, ride_count, rng, place_count=len(PLACES)):
+    """
+    Generate pending requests and open rides over a fixed set of routes and days.
+    Fewer places means more riders competing for the same rides.
+    """
+    places = PLACES[:place_count]
+    routes = [(a, b) for a in places for b in places if a != b]
+
+    rides = []
+    for index in range(ride_count):
+        start, end = rng.choice(routes)
+        rides.append({
+            "id": f"ride{index}",
+            "ownerID": f"driver{index}",
+            "from": start,
+            "to": end,
+            "date": rng.choice(DATES),
+            "departureTime": departure_time(rng),
+            "maxPassengers": rng.randint(1, 4),
+            "currentPassengers": [],
+            "cost": rng.randint(5, 40),
+        })
+
+    requests = []
+    for index in range(rider_count):
+        start, end = rng.choice(routes)
+        requests.append({
+            "id": f"request{index}",
+            "riderID": f"rider{index}",
+            "from": start,
+            "to": end,
+            "date": rng.choice(DATES),
+            "departureTime": departure_time(rng),
+        })
+
+    return requests, rides
+
+
+def run(size, seed, place_count):
+    """
+    Time cost-matrix construction and the assignment solve for a size x size instance.
+    """
+    requests, rides = generate(size, size, random.Random(seed), place_count)
+
+    started = time.perf_counter()
+    candidates, seats = RideRequestManager.build_candidates(requests, rides)
+    built = time.perf_counter()
+    assignment = solve_assignment(candidates, seats)
+    solved = time.perf_counter()
+
+    edges = sum(len(options) for options in candidates)
+    feasible = sum(1 for options in candidates if options)
+    print(
+        f"{size:>6} x {size:<6} edges={edges:<8} feasible={feasible:<6} "
+        f"matched={len(assignment):<6} build={built - started:7.3f}s "
+        f"solve={solved - built:7.3f}s"
+    )
+
+
+def main():
+    """
+    Parse arguments and run the benchmark for every requested size.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--places", type=int, default=len(PLACES))
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.seed, args.places)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Payload size and encode/decode time of JSON and MessagePack response bodies.
+
+Usage:
+    python3 benchmarks/bench_serialization.py [--sizes 100 1000 10000] [--repeat 5] [--seed 7]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+from serialization import json_default, packb, pacific_time
+from streaming import dumps, orjson
+
+PLACES = [
+    "Santa Cruz", "San Jose", "San Francisco", "Oakland", "Berkeley", "Palo Alto",
+    "Monterey", "Sacramento", "Fremont", "Watsonville", "Gilroy", "Los Angeles",
+]
+START = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+
+def generate_rides(count, rng):
+    """
+    Open rides shaped like the documents returned by the available-rides endpoint.
+    """
+    rides = []
+    for index in range(count):
+        start, end = rng.sample(PLACES, 2)
+        created_at = START + timedelta(seconds=rng.randrange(30 * 86400))
+        rides.append({
+            "id": f"ride{index:08d}",
+            "ownerID": f"driver{index}",
+            "ownerName": f"Driver {index}",
+            "from": start,
+            "to": end,
+            "stops": [start, end],
+            "date": (created_at + timedelta(days=3)).strftime("%Y-%m-%d"),
+            "departureTime": "08:30 AM",
+            "maxPassengers": rng.randint(1, 4),
+            "currentPassengers": [f"rider{rng.randrange(count)}" for _ in range(rng.randint(0, 3))],
+            "segmentSeats": [rng.randint(0, 4)],
+            "cost": rng.randint(5, 40),
+            "car": "Toyota Corolla",
+            "licensePlate": "8ABC123",
+            "status": "open",
+            "createdAt": created_at,
+            "updatedAt": created_at,
+        })
+    return {"rides": rides}
+
+
+def generate_messages(count, rng):
+    """
+    Chat messages keyed by position, shaped like the get-messages endpoint.
+    """
+    messages = {}
+    sent_at = START
+    for index in range(1, count + 1):
+        sent_at += timedelta(seconds=rng.randint(1, 600))
+        messages[index] = {
+            "senderId": f"user{rng.randrange(4)}",
+            "senderName": f"User {rng.randrange(4)}",
+            "text": "See you at the station in ten minutes"[:rng.randint(2, 37)],
+            "timestamp": pacific_time(sent_at, "%Y-%m-%d %I:%M %p PT"),
+            "isOwner": rng.random() < 0.5,
+            "id": f"message{index:08d}",
+        }
+    return {"messages": messages}
+
+
+def generate_notifications(count, rng):
+    """
+    Notifications shaped like the get-notifications endpoint.
+    """
+    notifications = []
+    for index in range(count):
+        created_at = START + timedelta(seconds=rng.randrange(30 * 86400))
+        notifications.append({
+            "id": f"notification{index:08d}",
+            "message": "Your ride request has been accepted.",
+            "read": rng.random() < 0.5,
+            "rideId": f"ride{rng.randrange(count):08d}",
+            "createdAt": pacific_time(created_at, "%m-%d-%Y %I:%M %p PT"),
+        })
+    return {"notifications": notifications}
+
+
+def stdlib_dumps(body):
+    """
+    Encode a body the way jsonify does, with the standard library encoder.
+    """
+    return json.dumps(body, default=json_default, separators=(",", ":")).encode()
+
+
+def unpackb(payload):
+    """
+    Decode a MessagePack body, allowing the integer keys of the messages map.
+    """
+    return msgpack.unpackb(payload, strict_map_key=False)
+
+
+def best_time(fn, arg, repeat):
+    """
+    Fastest of ``repeat`` runs of ``fn(arg)``, in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def run(name, body, repeat):
+    """
+    Print size, gzipped size, encode and decode time of one body in every format.
+    """
+    formats = [("json", stdlib_dumps, json.loads)]
+    if orjson is not None:
+        formats.append(("orjson", dumps, orjson.loads))  # pylint: disable=no-member
+    formats.append(("msgpack", packb, unpackb))
+
+    for label, encode, decode in formats:
+        payload = encode(body)
+        print(
+            f"{name:<20} {label:<8} bytes={len(payload):<9} "
+            f"gzip={len(gzip.compress(payload)):<8} "
+            f"encode={best_time(encode, body, repeat):8.2f}ms "
+            f"decode={best_time(decode, payload, repeat):8.2f}ms"
+        )
+
+
+def main():
+    """
+    Parse arguments and run the benchmark for every payload kind and size.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        run(f"rides x{size}", generate_rides(size, rng), args.repeat)
+        run(f"messages x{size}", generate_messages(size, rng), args.repeat)
+        run(f"notifications x{size}", generate_notifications(size, rng), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
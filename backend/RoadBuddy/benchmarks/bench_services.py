@@ -0,0 +1,217 @@
+"""
+Service-layer micro-benchmarks against the in-memory Firestore stand-in.
+
+Times the managers' hot loops on a generated dataset and reports ops/sec and memory
+allocated per call. Results can be written as JSON and compared against a previous run.
+
+Usage:
+    python3 benchmarks/bench_services.py [--scale small|full] [--repeat 5]
+        [--only NAME ...] [--json results.json] [--compare baseline.json]
+        [--max-regression 0.10]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+from datasets import generate
+from fake_firestore import FakeFirestoreClient
+from services.chat_messages_manager import ChatMessagesManager
+from services.notification_manager import NotificationManager
+from services.ride_chat_manager import RideChatManager
+from services.ride_manager import RideManager
+
+SCALES = {
+    "small": {"rides": 10_000, "messages": 100_000, "users": 5_000},
+    "full": {"rides": 100_000, "messages": 1_000_000, "users": 50_000},
+}
+
+
+def benchmark_cases(db, dataset):
+    """
+    Every benchmark as (name, setup, run). ``setup`` restores the data a previous run
+    changed and is not timed.
+    """
+    user_id = dataset.hot_user
+    user_name = f"User {user_id}"
+
+    def no_setup():
+        pass
+
+    def mark_unread():
+        dataset.mark_notifications_unread(user_id)
+
+    return [
+        (
+            "get_avaiable_rides",
+            no_setup,
+            lambda: RideManager(db, user_id, user_name).get_avaiable_rides(
+                set(dataset.hot_user_rides)
+            ),
+        ),
+        (
+            "delete_past_rides",
+            dataset.reload_past_rides,
+            lambda: RideManager(db, "scheduler", "scheduler").delete_past_rides(),
+        ),
+        (
+            "get_messages_sorted_by_timestamp_asc",
+            no_setup,
+            lambda: ChatMessagesManager(
+                db, dataset.hot_chat, user_id, user_name
+            ).get_messages_sorted_by_timestamp_asc(),
+        ),
+        (
+            "get_all_user_ride_chats",
+            no_setup,
+            lambda: RideChatManager(db, user_id, user_name).get_all_user_ride_chats(
+                dataset.hot_user_rides
+            ),
+        ),
+        (
+            "get_all_notifications_for_user",
+            mark_unread,
+            lambda: NotificationManager(db).get_all_notifications_for_user(user_id),
+        ),
+    ]
+
+
+def call(run):
+    """
+    Run a benchmark once and fail loudly if the manager returned an error.
+    """
+    response, status = run()
+    if status != 200:
+        raise RuntimeError(f"Benchmark call failed with {status}: {response}")
+    return response
+
+
+def measure(name, setup, run, repeat):
+    """
+    Time ``repeat`` runs, then measure the memory allocated by one more run.
+    """
+    durations = []
+    for _ in range(repeat):
+        setup()
+        gc.collect()
+        started = time.perf_counter()
+        call(run)
+        durations.append(time.perf_counter() - started)
+
+    setup()
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    response = call(run)
+    del response
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = statistics.fmean(durations)
+    return {
+        "name": name,
+        "iterations": repeat,
+        "ops_per_sec": 1 / mean if mean else float("inf"),
+        "mean_ms": mean * 1000,
+        "median_ms": statistics.median(durations) * 1000,
+        "min_ms": min(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+        "peak_alloc_kib": (peak - baseline) / 1024,
+        "retained_kib": (current - baseline) / 1024,
+    }
+
+
+def compare(results, baseline_path, max_regression):
+    """
+    Print each benchmark's change against a baseline run and return the names of those
+    whose mean time grew by more than ``max_regression``.
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is None:
+            continue
+        change = result["mean_ms"] / previous["mean_ms"] - 1
+        alloc_change = result["peak_alloc_kib"] - previous["peak_alloc_kib"]
+        flag = ""
+        if change > max_regression:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print(
+            f"{result['name']:<38} time={change:+7.1%} "
+            f"peak_alloc={alloc_change:+10.1f}KiB{flag}"
+        )
+    return regressions
+
+
+def main():
+    """
+    Parse arguments, generate the dataset and run every requested benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--rides", type=int)
+    parser.add_argument("--messages", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+")
+    parser.add_argument("--json", dest="json_path")
+    parser.add_argument("--compare")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    db = FakeFirestoreClient()
+    started = time.perf_counter()
+    dataset = generate(db.store, seed=args.seed, **sizes)
+    print(f"Generated {dataset.counts} in {time.perf_counter() - started:.1f}s")
+
+    results = []
+    for name, setup, run in benchmark_cases(db, dataset):
+        if args.only and name not in args.only:
+            continue
+        result = measure(name, setup, run, args.repeat)
+        results.append(result)
+        print(
+            f"{name:<38} {result['ops_per_sec']:9.2f} ops/s "
+            f"mean={result['mean_ms']:9.2f}ms min={result['min_ms']:9.2f}ms "
+            f"peak_alloc={result['peak_alloc_kib']:10.1f}KiB"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump({
+                "meta": {
+                    "createdAt": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "seed": args.seed,
+                    "repeat": args.repeat,
+                    "dataset": dataset.counts,
+                },
+                "results": results,
+            }, json_file, indent=2)
+
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Synthetic RoadBuddy datasets for the in-memory Firestore stand-in.
+
+Documents have the shape the service managers write: users with their posted and
+joined rides, rides spread around today (so some have departed), a chat per ride with
+its messages, and notifications per user. One "hot" user and one "hot" chat carry
+enough data to make the per-user and per-chat endpoints worth timing.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+PLACES = [
+    "Santa Cruz", "San Jose", "San Francisco", "Oakland", "Berkeley", "Palo Alto",
+    "Monterey", "Sacramento", "Fremont", "Watsonville", "Gilroy", "Los Angeles",
+]
+TEXTS = [
+    "Hi!", "See you at the station", "Running five minutes late",
+    "Can you pick me up on Mission St?", "Thanks for the ride", "Where should we meet?",
+    "I have one small bag", "On my way",
+]
+NOTIFICATIONS = [
+    "A rider has booked a ride with you",
+    "Your ride has been cancelled",
+    "A passenger has left your ride",
+]
+
+HOT_USER = "hotuser"
+HOT_USER_RIDES = 50
+HOT_USER_NOTIFICATIONS = 200
+HOT_CHAT_SHARE = 0.01
+
+
+class Dataset:
+    """
+    A generated dataset, loaded into a fake Firestore store, plus the ids the
+    benchmarks need.
+    """
+
+    def __init__(self, store):
+        """
+        Initialize an empty Dataset.
+        """
+        self.store = store
+        self.counts = {}
+        self.hot_user = HOT_USER
+        self.hot_user_rides = []
+        self.hot_chat = None
+        self.past_rides = {}
+
+    def reload_past_rides(self):
+        """
+        Put back the departed rides (and drop the tombstones) removed by a previous
+        delete_past_rides run.
+        """
+        self.store.load("rides", self.past_rides)
+        for path in list(self.store.by_collection.get("tombstones", ())):
+            self.store.delete(path)
+
+    def mark_notifications_unread(self, user_id):
+        """
+        Mark every notification of a user unread again.
+        """
+        for path in self.store.children(f"users/{user_id}/notifications"):
+            self.store.documents[path]["data"]["read"] = False
+
+
+def departure(rng, now_pacific):
+    """
+    A ride date and departure time up to 30 days before or after now.
+    """
+    moment = now_pacific + timedelta(minutes=rng.randrange(-30 * 24 * 60, 30 * 24 * 60, 5))
+    return moment.strftime("%Y-%m-%d"), moment.strftime("%I:%M %p")
+
+
+def generate(store, rides=10_000, messages=100_000, users=5_000, seed=7):
+    """
+    Generate a dataset of the given size into ``store`` and return it.
+    """
+    rng = random.Random(seed)
+    dataset = Dataset(store)
+    now = datetime.now(timezone.utc)
+    now_pacific = datetime.now(pytz.timezone("America/Los_Angeles"))
+
+    user_ids = [HOT_USER] + [f"user{index:06d}" for index in range(users - 1)]
+    user_docs = {
+        user_id: {
+            "name": f"User {user_id}",
+            "email": f"{user_id}@example.com",
+            "ridesPosted": [],
+            "ridesJoined": [],
+            "unread_notification_count": 0,
+        }
+        for user_id in user_ids
+    }
+
+    ride_docs = {}
+    chat_docs = {}
+    for index in range(rides):
+        ride_id = f"ride{index:07d}"
+        owner = HOT_USER if index < HOT_USER_RIDES else rng.choice(user_ids)
+        passengers = rng.sample(user_ids, rng.randint(0, 3))
+        passengers = [passenger for passenger in passengers if passenger != owner]
+        start, end = rng.sample(PLACES, 2)
+        date, departure_time = departure(rng, now_pacific)
+        created_at = now - timedelta(seconds=rng.randrange(60 * 86400))
+
+        ride_docs[ride_id] = {
+            "ownerID": owner,
+            "ownerName": user_docs[owner]["name"],
+            "from": start,
+            "to": end,
+            "date": date,
+            "departureTime": departure_time,
+            "maxPassengers": 4,
+            "cost": rng.randint(5, 40),
+            "currentPassengers": passengers,
+            "stops": [start, end],
+            "segmentSeats": [len(passengers)],
+            "legBookings": {},
+            "car": "Toyota Corolla",
+            "licensePlate": f"{rng.randrange(10**6):06d}",
+            "status": "open",
+            "createdAt": created_at,
+            "updatedAt": created_at,
+        }
+        chat_docs[ride_id] = {
+            "rideId": ride_id,
+            "participants": [owner] + passengers,
+            "lastMessage": "",
+            "from": start,
+            "to": end,
+            "owner": owner,
+            "ownerName": user_docs[owner]["name"],
+            "date": date,
+            "departureTime": departure_time,
+            "lastMessageTimestamp": created_at,
+            "UsernameLastMessage": "",
+            "updatedAt": created_at,
+        }
+        user_docs[owner]["ridesPosted"].append(ride_id)
+        for passenger in passengers:
+            user_docs[passenger]["ridesJoined"].append(ride_id)
+
+    dataset.hot_user_rides = (
+        user_docs[HOT_USER]["ridesPosted"] + user_docs[HOT_USER]["ridesJoined"]
+    )
+
+    chat_ids = list(chat_docs)
+    if chat_ids:
+        dataset.hot_chat = chat_ids[0]
+    hot_messages = int(messages * HOT_CHAT_SHARE) if chat_ids else 0
+    chat_messages = {}
+    for index in range(messages if chat_ids else 0):
+        chat_id = dataset.hot_chat if index < hot_messages else rng.choice(chat_ids)
+        chat = chat_docs[chat_id]
+        sender = rng.choice(chat["participants"])
+        sent_at = chat["lastMessageTimestamp"] + timedelta(seconds=rng.randint(1, 3600))
+        text = rng.choice(TEXTS)
+        chat_messages.setdefault(chat_id, {})[f"msg{index:08d}"] = {
+            "senderId": sender,
+            "senderName": user_docs[sender]["name"],
+            "text": text,
+            "timestamp": sent_at,
+            "isOwner": sender == chat["owner"],
+        }
+        chat.update({
+            "lastMessage": text,
+            "lastMessageTimestamp": sent_at,
+            "UsernameLastMessage": user_docs[sender]["name"],
+        })
+
+    notification_count = 0
+    for user_id in user_ids:
+        count = HOT_USER_NOTIFICATIONS if user_id == HOT_USER else rng.randint(0, 4)
+        notifications = {}
+        for index in range(count):
+            created_at = now - timedelta(seconds=rng.randrange(30 * 86400))
+            notifications[f"note{index:05d}"] = {
+                "message": rng.choice(NOTIFICATIONS),
+                "rideId": rng.choice(chat_ids) if chat_ids else None,
+                "read": False,
+                "createdAt": created_at,
+                "updatedAt": created_at,
+            }
+        if notifications:
+            store.load(f"users/{user_id}/notifications", notifications)
+            user_docs[user_id]["unread_notification_count"] = count
+            notification_count += count
+
+    store.load("users", user_docs)
+    store.load("rides", ride_docs)
+    store.load("ride_chats", chat_docs)
+    for chat_id, documents in chat_messages.items():
+        store.load(f"ride_chats/{chat_id}/messages", documents)
+
+    now_naive = now_pacific.replace(tzinfo=None)
+    dataset.past_rides = {
+        ride_id: ride for ride_id, ride in ride_docs.items()
+        if datetime.strptime(f"{ride['date']} {ride['departureTime']}", "%Y-%m-%d %I:%M %p")
+        < now_naive
+    }
+    dataset.counts = {
+        "users": len(user_docs),
+        "rides": len(ride_docs),
+        "past_rides": len(dataset.past_rides),
+        "ride_chats": len(chat_docs),
+        "messages": messages if chat_ids else 0,
+        "hot_chat_messages": hot_messages,
+        "notifications": notification_count,
+    }
+    return dataset
@@ -0,0 +1,659 @@
+"""
+In-memory stand-in for the subset of the Firestore client used by the service managers.
+
+Documents are indexed by collection, so a query only scans its own collection. Queries
+have no indexes beyond that: every document of the collection is read and filtered,
+which is the work Firestore's indexes save, so only compare timings against other runs
+of this fake.
+"""
+import copy
+import itertools
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1 import transforms
+
+
+def _now():
+    """
+    Current UTC time, used for server timestamps and update times.
+    """
+    return datetime.now(timezone.utc)
+
+
+def _apply_value(current, value, now):
+    """
+    Resolve Firestore sentinels and transforms against the current field value.
+    """
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, transforms.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current or [])
+        for item in value.values:
+            if item not in result:
+                result.append(item)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in (current or []) if item not in value.values]
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        return {
+            key: _apply_value(base.get(key), sub_value, now)
+            for key, sub_value in value.items()
+        }
+    return copy.deepcopy(value)
+
+
+def _set_path(data, field_path, value, now):
+    """
+    Write a dotted field path into a nested dictionary.
+    """
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    if value is firestore.DELETE_FIELD:
+        target.pop(parts[-1], None)
+        return
+    target[parts[-1]] = _apply_value(target.get(parts[-1]), value, now)
+
+
+def _get_path(data, field_path):
+    """
+    Read a dotted field path from a nested dictionary.
+    """
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _matches(value, op, expected):
+    """
+    Evaluate a single where() clause.
+    """
+    if op == "array_contains":
+        return isinstance(value, list) and expected in value
+    if op == "array_contains_any":
+        return isinstance(value, list) and any(item in value for item in expected)
+    if op == "in":
+        return value in expected
+    if op == "not-in":
+        return value is not None and value not in expected
+    if value is None:
+        return False
+    try:
+        return {
+            "==": lambda: value == expected,
+            "!=": lambda: value != expected,
+            "<": lambda: value < expected,
+            "<=": lambda: value <= expected,
+            ">": lambda: value > expected,
+            ">=": lambda: value >= expected,
+        }[op]()
+    except TypeError:
+        return False
+
+
+class FakeDocumentSnapshot:
+    """
+    Read-only view of a document at the time it was fetched.
+    """
+
+    def __init__(self, reference, data, update_time=None, create_time=None):
+        self.reference = reference
+        self._data = data
+        self.update_time = update_time
+        self.create_time = create_time
+
+    @property
+    def id(self):
+        """
+        Document ID.
+        """
+        return self.reference.id
+
+    @property
+    def exists(self):
+        """
+        Whether the document existed when it was read.
+        """
+        return self._data is not None
+
+    def to_dict(self):
+        """
+        Deep copy of the document data, or None if it does not exist.
+        """
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        """
+        Read a single field.
+        """
+        return copy.deepcopy(_get_path(self._data or {}, field_path))
+
+
+class FakeStore:
+    """
+    Shared document storage keyed by full document path.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.by_collection = defaultdict(dict)
+        self.lock = threading.RLock()
+        self.version = itertools.count(1)
+
+    def load(self, collection_path, documents):
+        """
+        Insert ``{document_id: data}`` into a collection without copying the data or
+        resolving sentinels. Used to load generated datasets quickly.
+        """
+        now = _now()
+        with self.lock:
+            children = self.by_collection[collection_path]
+            for document_id, data in documents.items():
+                path = f"{collection_path}/{document_id}"
+                self.documents[path] = {
+                    "data": data,
+                    "update_time": now,
+                    "create_time": now,
+                    "version": next(self.version),
+                }
+                children[path] = None
+
+    def read(self, path, field_paths=None):
+        """
+        Snapshot the document at ``path``.
+        """
+        with self.lock:
+            entry = self.documents.get(path)
+            if entry is None:
+                return None, None, None
+            data = entry["data"]
+            if field_paths is not None:
+                data = {
+                    key: value for key, value in data.items()
+                    if key in field_paths or any(p.startswith(f"{key}.") for p in field_paths)
+                }
+            return data, entry["update_time"], entry["create_time"]
+
+    def write(self, path, data, merge=False, update=False):
+        """
+        Apply a set/update to the document at ``path``.
+        """
+        now = _now()
+        with self.lock:
+            entry = self.documents.get(path)
+            if update and entry is None:
+                raise api_exceptions.NotFound(f"No document to update: {path}")
+            if entry is None or not (merge or update):
+                current = {}
+                create_time = entry["create_time"] if entry else now
+            else:
+                current = copy.deepcopy(entry["data"])
+                create_time = entry["create_time"]
+
+            for key, value in data.items():
+                if update:
+                    _set_path(current, key, value, now)
+                elif value is firestore.DELETE_FIELD:
+                    current.pop(key, None)
+                else:
+                    current[key] = _apply_value(current.get(key), value, now)
+
+            self.documents[path] = {
+                "data": current,
+                "update_time": now,
+                "create_time": create_time,
+                "version": next(self.version),
+            }
+            self.by_collection[path.rsplit("/", 1)[0]][path] = None
+
+    def delete(self, path):
+        """
+        Remove the document at ``path``.
+        """
+        with self.lock:
+            self.documents.pop(path, None)
+            self.by_collection[path.rsplit("/", 1)[0]].pop(path, None)
+
+    def children(self, collection_path):
+        """
+        Paths of documents that live directly inside ``collection_path``.
+        """
+        with self.lock:
+            return list(self.by_collection.get(collection_path, ()))
+
+
+class FakeQuery:
+    """
+    Immutable query over a single collection.
+    """
+
+    def __init__(self, client, collection_path, **options):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(options.get("filters", ()))
+        self._orders = tuple(options.get("orders", ()))
+        self._limit = options.get("limit")
+        self._projection = options.get("projection")
+
+    def _copy(self, **changes):
+        """
+        Return a new query with some attributes replaced.
+        """
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "projection": self._projection,
+        }
+        params.update(changes)
+        return FakeQuery(self._client, self._collection_path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        """
+        Add a field filter.
+        """
+        # pylint: disable=redefined-builtin
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=firestore.Query.ASCENDING):
+        """
+        Add a sort order.
+        """
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        """
+        Cap the number of results.
+        """
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        """
+        Restrict the returned fields.
+        """
+        return self._copy(projection=list(field_paths))
+
+    def stream(self, transaction=None, retry=None, timeout=None):
+        """
+        Yield matching document snapshots.
+        """
+        del transaction, retry, timeout
+        store = self._client.store
+        matched = []
+        for path in store.children(self._collection_path):
+            data, update_time, create_time = store.read(path)
+            if data is None:
+                continue
+            if all(_matches(_get_path(data, f), op, v) for f, op, v in self._filters):
+                matched.append((path, data, update_time, create_time))
+
+        for field_path, direction in reversed(self._orders):
+            matched = [m for m in matched if _get_path(m[1], field_path) is not None]
+            matched.sort(
+                key=lambda m, f=field_path: _get_path(m[1], f),
+                reverse=direction == firestore.Query.DESCENDING,
+            )
+
+        if self._limit is not None:
+            matched = matched[:self._limit]
+
+        for path, data, update_time, create_time in matched:
+            if self._projection is not None:
+                data = {k: v for k, v in data.items() if k in self._projection}
+            yield FakeDocumentSnapshot(
+                self._client.document(path), data, update_time, create_time
+            )
+
+    def get(self, transaction=None, retry=None, timeout=None):
+        """
+        Return all matching snapshots as a list.
+        """
+        return list(self.stream(transaction, retry, timeout))
+
+
+class FakeCollectionReference(FakeQuery):
+    """
+    Reference to a collection.
+    """
+
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.path = path
+
+    @property
+    def id(self):
+        """
+        Collection ID.
+        """
+        return self.path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        """
+        Reference to a document in this collection, with a generated ID if none is given.
+        """
+        document_id = document_id or uuid.uuid4().hex[:20]
+        return self._client.document(f"{self.path}/{document_id}")
+
+    def add(self, data, document_id=None):
+        """
+        Create a document with a generated ID.
+        """
+        ref = self.document(document_id)
+        ref.set(data)
+        return _now(), ref
+
+    def list_documents(self):
+        """
+        References to every document in this collection.
+        """
+        return [self._client.document(p) for p in self._client.store.children(self.path)]
+
+
+class FakeDocumentReference:
+    """
+    Reference to a single document.
+    """
+
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def id(self):
+        """
+        Document ID.
+        """
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        """
+        Collection that contains this document.
+        """
+        return self._client.collection(self.path.rsplit("/", 1)[0])
+
+    def collection(self, collection_id):
+        """
+        Reference to a subcollection.
+        """
+        return self._client.collection(f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None, retry=None, timeout=None):
+        """
+        Read the document.
+        """
+        del retry, timeout
+        if transaction is not None:
+            transaction.remember_read(self.path)
+        data, update_time, create_time = self._client.store.read(self.path, field_paths)
+        return FakeDocumentSnapshot(self, data, update_time, create_time)
+
+    def set(self, document_data, merge=False, retry=None, timeout=None):
+        """
+        Overwrite (or merge into) the document.
+        """
+        del retry, timeout
+        self._client.store.write(self.path, document_data, merge=merge)
+
+    def create(self, document_data, retry=None, timeout=None):
+        """
+        Create the document, failing if it already exists.
+        """
+        del retry, timeout
+        with self._client.store.lock:
+            if self._client.store.read(self.path)[0] is not None:
+                raise api_exceptions.Conflict(f"Document already exists: {self.path}")
+            self._client.store.write(self.path, document_data)
+
+    def update(self, field_updates, option=None, retry=None, timeout=None):
+        """
+        Update fields of an existing document.
+        """
+        del option, retry, timeout
+        self._client.store.write(self.path, field_updates, update=True)
+
+    def delete(self, option=None, retry=None, timeout=None):
+        """
+        Delete the document.
+        """
+        del option, retry, timeout
+        self._client.store.delete(self.path)
+
+
+class FakeWriteOption:
+    """
+    Write precondition created by ``FakeFirestoreClient.write_option``.
+    """
+
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class FakeWriteBatch:
+    """
+    Write batch that applies its queued writes atomically on commit.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        """
+        Queue a set.
+        """
+        self._writes.append(("set", reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        """
+        Queue a create.
+        """
+        self._writes.append(("set", reference, document_data, False))
+
+    def update(self, reference, field_updates, option=None):
+        """
+        Queue an update.
+        """
+        self._writes.append(("update", reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        """
+        Queue a delete.
+        """
+        del option
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self, retry=None, timeout=None):
+        """
+        Apply every queued write under the store lock.
+        """
+        del retry, timeout
+        store = self._client.store
+        with store.lock:
+            for kind, reference, _, option in self._writes:
+                entry = store.documents.get(reference.path)
+                if kind == "update" and entry is None:
+                    raise api_exceptions.NotFound(f"No document to update: {reference.path}")
+                expected = getattr(option, "last_update_time", None)
+                if expected is not None and (entry is None or entry["update_time"] != expected):
+                    raise api_exceptions.FailedPrecondition(
+                        f"Document changed since it was read: {reference.path}"
+                    )
+            for kind, reference, data, merge in self._writes:
+                if kind == "update":
+                    merge = False
+                if kind == "delete":
+                    store.delete(reference.path)
+                else:
+                    store.write(reference.path, data, merge=merge, update=kind == "update")
+        results = [_now()] * len(self._writes)
+        self._writes = []
+        return results
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Transaction compatible with ``firestore.transactional``.
+
+    Reads are served directly; writes are buffered and applied on commit while holding the
+    store lock, and the transaction is retried if a document it read changed in between.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    @property
+    def in_progress(self):
+        """
+        Whether a transaction attempt is active.
+        """
+        return self._id is not None
+
+    @property
+    def id(self):
+        """
+        Current transaction ID.
+        """
+        return self._id
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        del retry_id
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        store = self._client.store
+        with store.lock:
+            for path, version in self._read_versions.items():
+                entry = store.documents.get(path)
+                if (entry["version"] if entry else None) != version:
+                    self._clean_up()
+                    raise api_exceptions.Aborted(f"Contention on {path}")
+            results = FakeWriteBatch.commit(self)
+        self._clean_up()
+        return results
+
+    def get(self, ref_or_query, retry=None, timeout=None):
+        """
+        Read a document or query inside the transaction.
+        """
+        del retry, timeout
+        if isinstance(ref_or_query, FakeDocumentReference):
+            snapshot = ref_or_query.get()
+            self.remember_read(ref_or_query.path)
+            return iter([snapshot])
+        snapshots = list(ref_or_query.stream())
+        for snapshot in snapshots:
+            self.remember_read(snapshot.reference.path)
+        return iter(snapshots)
+
+    def get_all(self, references, retry=None, timeout=None):
+        """
+        Read several documents inside the transaction.
+        """
+        del retry, timeout
+        for reference in references:
+            self.remember_read(reference.path)
+        return self._client.get_all(references)
+
+    def remember_read(self, path):
+        """
+        Record the version of a document read inside the transaction.
+        """
+        entry = self._client.store.documents.get(path)
+        self._read_versions.setdefault(path, entry["version"] if entry else None)
+
+
+class FakeFirestoreClient:
+    """
+    Drop-in replacement for ``firestore.client()`` backed by process memory.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or FakeStore()
+
+    def collection(self, *collection_path):
+        """
+        Reference to a collection.
+        """
+        return FakeCollectionReference(self, "/".join(collection_path))
+
+    def document(self, *document_path):
+        """
+        Reference to a document by full path.
+        """
+        return FakeDocumentReference(self, "/".join(document_path))
+
+    def get_all(self, references, field_paths=None, transaction=None, retry=None,
+                timeout=None):
+        """
+        Read several documents, yielding a snapshot for each (missing ones included).
+        """
+        del retry, timeout
+        seen = set()
+        for reference in references:
+            if reference.path in seen:
+                continue
+            seen.add(reference.path)
+            yield reference.get(field_paths=field_paths, transaction=transaction)
+
+    @staticmethod
+    def write_option(**kwargs):
+        """
+        Precondition for a write, e.g. ``last_update_time``.
+        """
+        return FakeWriteOption(**kwargs)
+
+    def batch(self):
+        """
+        New write batch.
+        """
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        """
+        New transaction.
+        """
+        return FakeTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def collections(self):
+        """
+        Top-level collections that currently hold documents.
+        """
+        names = sorted({path.split("/", 1)[0] for path in self.store.documents})
+        return [self.collection(name) for name in names]
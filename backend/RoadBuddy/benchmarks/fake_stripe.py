@@ -0,0 +1,57 @@
+"""
+Local stand-in for the Stripe calls PaymentManager makes.
+
+``install()`` replaces the Stripe API methods with functions that return objects shaped
+like Stripe's after sleeping for a configurable latency, so payment endpoints can be
+load tested without network access or a Stripe account.
+"""
+import time
+import uuid
+
+import stripe
+
+
+class FakeStripeObject:
+    """
+    Attribute bag standing in for a Stripe API resource.
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def install(latency=0.0):
+    """
+    Patch stripe.Customer, stripe.EphemeralKey and stripe.PaymentIntent. Every call
+    sleeps ``latency`` seconds, like a round trip to Stripe.
+    """
+    customers = {}
+
+    def customer_create(**kwargs):
+        time.sleep(latency)
+        customer_id = f"cus_{uuid.uuid4().hex[:14]}"
+        customers[kwargs.get("metadata", {}).get("user_id")] = customer_id
+        return FakeStripeObject(id=customer_id)
+
+    def customer_search(query, **_kwargs):
+        time.sleep(latency)
+        customer_id = customers.get(query.split(":", 1)[1].strip("'"))
+        return FakeStripeObject(data=[FakeStripeObject(id=customer_id)] if customer_id else [])
+
+    def ephemeral_key_create(**_kwargs):
+        time.sleep(latency)
+        return FakeStripeObject(secret=f"ek_test_{uuid.uuid4().hex}")
+
+    def payment_intent_create(**kwargs):
+        time.sleep(latency)
+        intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        return FakeStripeObject(
+            id=intent_id,
+            amount=kwargs.get("amount"),
+            client_secret=f"{intent_id}_secret_{uuid.uuid4().hex[:24]}",
+        )
+
+    stripe.Customer.create = staticmethod(customer_create)
+    stripe.Customer.search = staticmethod(customer_search)
+    stripe.EphemeralKey.create = staticmethod(ephemeral_key_create)
+    stripe.PaymentIntent.create = staticmethod(payment_intent_create)
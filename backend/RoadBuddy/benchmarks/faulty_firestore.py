@@ -0,0 +1,296 @@
+"""
+Latency and fault injection for a Firestore client, for tail-latency and resilience
+testing against the in-memory Firestore stand-in.
+
+``FaultInjector.wrap(db)`` returns a client that behaves like ``db`` except that every
+call that would be a Firestore RPC first goes through the injector, which can:
+
+- sleep for a latency drawn from a per-operation distribution,
+- raise a Firestore error at a configured rate, or on the next N calls,
+- raise DeadlineExceeded when the latency exceeds the call's ``timeout=`` argument,
+- serialize writes to the same document, like Firestore's sustained write limit on a
+  single document, so hot documents queue up under contention.
+
+Operations are named "kind.method": "document.get", "document.set", "document.create",
+"document.update", "document.delete", "collection.add", "collection.stream",
+"collection.get", "client.get_all", "batch.commit", "transaction.begin",
+"transaction.get", "transaction.get_all", "transaction.commit" and
+"transaction.rollback". Rules match them with shell-style patterns ("document.*",
+"*.commit", "*").
+
+Random draws come from one seeded generator, and sleeping and the write queues go
+through ``sleep`` and ``clock``, so a single-threaded test that passes a fake clock sees
+the same faults on every run.
+
+Usage:
+    injector = FaultInjector(seed=1)
+    injector.add_rule("*", latency=lognormal(0.02, 0.3))
+    injector.add_rule("transaction.commit", error_rate=0.05, error=api_exceptions.Aborted)
+    injector.fail_next("document.get", count=2)
+    db = injector.wrap(FakeFirestoreClient())
+"""
+import fnmatch
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+from firestore_proxy import FirestoreProxy, unwrap, wrap_result
+
+# The calls that reach the Firestore backend, by (kind, method), with the operation
+# name rules match against.
+RPC_CALLS = {
+    ("document", "get"): "document.get",
+    ("document", "set"): "document.set",
+    ("document", "create"): "document.create",
+    ("document", "update"): "document.update",
+    ("document", "delete"): "document.delete",
+    ("collection", "add"): "collection.add",
+    ("collection", "stream"): "collection.stream",
+    ("collection", "get"): "collection.get",
+    ("client", "get_all"): "client.get_all",
+    ("batch", "commit"): "batch.commit",
+    ("transaction", "_begin"): "transaction.begin",
+    ("transaction", "get"): "transaction.get",
+    ("transaction", "get_all"): "transaction.get_all",
+    ("transaction", "_commit"): "transaction.commit",
+    ("transaction", "_rollback"): "transaction.rollback",
+}
+
+WRITE_OPERATIONS = {
+    "document.set", "document.create", "document.update", "document.delete",
+    "batch.commit", "transaction.commit",
+}
+
+# The normal quantile of 0.99, to turn a median and p99 into a lognormal sigma.
+Z_99 = 2.326
+
+
+def fixed(seconds):
+    """
+    Latency distribution that is always ``seconds``.
+    """
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    """
+    Latency distribution uniform between ``low`` and ``high`` seconds.
+    """
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median, p99):
+    """
+    Long-tailed latency distribution with the given median and 99th percentile.
+    """
+    sigma = math.log(p99 / median) / Z_99 if p99 > median else 0.0
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+def spikes(base, spike, probability):
+    """
+    Latency of ``base`` seconds, or ``spike`` seconds with the given probability.
+    """
+    return lambda rng: spike if rng.random() < probability else base
+
+
+class FaultRule:
+    """
+    Latency and errors for the operations matching ``pattern``. Every matching rule
+    applies: latencies add up and any of them can raise.
+    """
+
+    def __init__(self, pattern="*", latency=None, error_rate=0.0,
+                 error=api_exceptions.ServiceUnavailable):
+        """
+        Initialize the FaultRule.
+        """
+        self.pattern = pattern
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error = error
+        self.fail_next = 0
+
+    def matches(self, operation):
+        """
+        True if the rule applies to ``operation``.
+        """
+        return fnmatch.fnmatchcase(operation, self.pattern)
+
+
+class WriteQueue:
+    """
+    Per-document write slots at least ``spacing`` seconds apart. Writes that arrive
+    sooner wait their turn, which is how contention on a hot document shows up as
+    latency.
+    """
+
+    def __init__(self, spacing=0.0, clock=time.monotonic):
+        """
+        Initialize an empty WriteQueue.
+        """
+        self.spacing = spacing
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.next_write = {}
+
+    def reserve(self, paths):
+        """
+        Reserve the next write slot of each document and return how long to wait for
+        the last of them.
+        """
+        if not self.spacing or not paths:
+            return 0.0
+        now = self.clock()
+        start = now
+        with self.lock:
+            for path in paths:
+                start = max(start, self.next_write.get(path, now))
+            for path in paths:
+                self.next_write[path] = start + self.spacing
+        return start - now
+
+
+class FaultInjector:
+    """
+    FaultInjector holds the fault rules and the per-document write queues shared by
+    every client it wraps, and counts what it injected per operation.
+
+    ``write_spacing`` is the minimum time between two writes to the same document.
+    """
+
+    def __init__(self, rules=(), seed=0, write_spacing=0.0, sleep=time.sleep,
+                 clock=time.monotonic):
+        """
+        Initialize the FaultInjector.
+        """
+        self.rules = list(rules)
+        self.rng = random.Random(seed)
+        self.writes = WriteQueue(write_spacing, clock)
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def add_rule(self, pattern="*", latency=None, error_rate=0.0,
+                 error=api_exceptions.ServiceUnavailable):
+        """
+        Add a rule and return it, so a test can change or remove it later.
+        """
+        rule = FaultRule(pattern, latency, error_rate, error)
+        with self.lock:
+            self.rules.append(rule)
+        return rule
+
+    def remove_rule(self, rule):
+        """
+        Stop applying a rule.
+        """
+        with self.lock:
+            self.rules.remove(rule)
+
+    def fail_next(self, pattern, count=1, error=api_exceptions.ServiceUnavailable):
+        """
+        Make the next ``count`` operations matching ``pattern`` fail with ``error``.
+        """
+        rule = self.add_rule(pattern, error=error)
+        rule.fail_next = count
+        return rule
+
+    def reset_stats(self):
+        """
+        Forget the counts of injected faults.
+        """
+        with self.lock:
+            self.stats = {}
+
+    def wrap(self, db):
+        """
+        Wrap a Firestore client so its RPCs go through this injector.
+        """
+        return FirestoreProxy(db, self, "client")
+
+    def plan(self, operation, timeout=None):
+        """
+        Decide the delay and error, if any, of one call of ``operation``.
+        """
+        delay = 0.0
+        error = None
+        with self.lock:
+            stats = self.stats.setdefault(operation, {"calls": 0, "errors": 0, "delay": 0.0})
+            stats["calls"] += 1
+            for rule in self.rules:
+                if not rule.matches(operation):
+                    continue
+                if rule.latency is not None:
+                    delay += max(0.0, rule.latency(self.rng))
+                if error is not None:
+                    continue
+                if rule.fail_next > 0:
+                    rule.fail_next -= 1
+                    error = rule.error(f"Injected failure of {operation}")
+                elif rule.error_rate and self.rng.random() < rule.error_rate:
+                    error = rule.error(f"Injected failure of {operation}")
+
+            if timeout is not None and delay > timeout:
+                delay = timeout
+                error = api_exceptions.DeadlineExceeded(
+                    f"Injected deadline exceeded on {operation} after {timeout}s"
+                )
+            if error is not None:
+                stats["errors"] += 1
+            stats["delay"] += delay
+        return delay, error
+
+    def inject(self, operation, timeout=None, paths=()):
+        """
+        Apply the faults of one call of ``operation``: wait, then raise if it fails.
+        """
+        delay, error = self.plan(operation, timeout)
+        if operation in WRITE_OPERATIONS and error is None:
+            delay += self.writes.reserve(paths)
+        if delay:
+            self.sleep(delay)
+        if error is not None:
+            raise error
+
+    def call(self, kind, name, function, *args, **kwargs):
+        """
+        Call a Firestore method on behalf of a wrapped object, injecting faults first
+        if it is an RPC.
+        """
+        args = [unwrap(arg) for arg in args]
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+
+        operation = RPC_CALLS.get((kind, name))
+        if operation is None:
+            return wrap_result(function(*args, **kwargs), self, name)
+
+        timeout = kwargs.get("timeout")
+        if operation in ("collection.stream", "client.get_all"):
+            return self._lazy(operation, timeout, function, args, kwargs)
+
+        self.inject(operation, timeout, self._written_paths(kind, function))
+        return function(*args, **kwargs)
+
+    def _lazy(self, operation, timeout, function, args, kwargs):
+        # Streams start their RPC when iteration begins, not when they are created.
+        self.inject(operation, timeout)
+        yield from function(*args, **kwargs)
+
+    @staticmethod
+    def _written_paths(kind, function):
+        if kind == "document":
+            return [function.__self__.path]
+        if kind in ("batch", "transaction"):
+            # The in-memory stand-in keeps staged writes as (kind, reference, ...).
+            writes = getattr(function.__self__, "_writes", ())
+            return sorted({write[1].path for write in writes})
+        return []
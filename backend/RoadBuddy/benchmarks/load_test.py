@@ -0,0 +1,507 @@
+"""
+Scenario-based load test of the Flask app with Firebase Auth, Firestore and Stripe
+replaced by local stand-ins.
+
+The app runs in a subprocess on a threaded WSGI server, one worker's worth of capacity,
+over a generated dataset. Virtual users replay the rider journey (sign up, log in, post
+a ride, load the home feed, browse and book a ride, pay, chat and read notifications)
+in a closed loop for each concurrency level. Throughput and per-endpoint latency
+percentiles are reported for every level.
+
+Usage:
+    python3 benchmarks/load_test.py [--concurrency 1 2 4 8 16] [--duration 20]
+        [--warmup 3] [--rides 2000] [--messages 20000] [--users 1000]
+        [--stripe-latency 0.1] [--firestore-latency 0.02 0.3]
+        [--firestore-error-rate 0.01] [--write-spacing 1.0] [--think 0]
+        [--json results.json]
+
+--firestore-latency (median and p99 seconds), --firestore-error-rate and --write-spacing
+inject Firestore latency, errors and hot-document contention with FaultInjector.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+PLACES = [
+    "Santa Cruz", "San Jose", "San Francisco", "Oakland", "Berkeley", "Palo Alto",
+    "Monterey", "Sacramento", "Fremont", "Watsonville", "Gilroy", "Los Angeles",
+]
+PERCENTILES = (50, 90, 99)
+STEPS = (
+    "signup", "auth", "post_ride", "home_feed", "available_rides", "ride_details",
+    "payment_sheet", "request_ride", "send_message", "get_messages", "ride_chats",
+    "unread_count", "notifications",
+)
+
+
+def serve(args):
+    """
+    Run the app with local stand-ins on ``args.port`` until killed.
+    """
+    # pylint: disable=import-outside-toplevel
+    from werkzeug.serving import make_server
+
+    from datasets import generate
+    from fake_firestore import FakeFirestoreClient
+    from faulty_firestore import FaultInjector, lognormal
+    from local_app import load_app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    db = FakeFirestoreClient()
+    dataset = generate(
+        db.store, rides=args.rides, messages=args.messages, users=args.users, seed=args.seed
+    )
+    print(f"Generated {dataset.counts}", flush=True)
+
+    injector = FaultInjector(seed=args.seed, write_spacing=args.write_spacing)
+    if args.firestore_latency:
+        injector.add_rule("*", latency=lognormal(*args.firestore_latency))
+    if args.firestore_error_rate:
+        injector.add_rule("*", error_rate=args.firestore_error_rate)
+
+    app_module = load_app(injector.wrap(db), stripe_latency=args.stripe_latency)
+    make_server("127.0.0.1", args.port, app_module.app, threaded=True).serve_forever()
+
+
+def free_port():
+    """
+    A TCP port nothing is listening on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, log_file):
+    """
+    Start the app in a subprocess and wait until it accepts connections.
+    """
+    port = free_port()
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+        "--rides", str(args.rides), "--messages", str(args.messages),
+        "--users", str(args.users), "--seed", str(args.seed),
+        "--stripe-latency", str(args.stripe_latency),
+        "--firestore-error-rate", str(args.firestore_error_rate),
+        "--write-spacing", str(args.write_spacing),
+    ]
+    if args.firestore_latency:
+        command += ["--firestore-latency", *map(str, args.firestore_latency)]
+    # The server outlives this function; stop_server() ends it.
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        command, stdout=log_file, stderr=subprocess.STDOUT
+    )
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}, see {log_file.name}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError(f"Server did not start within {args.startup_timeout}s")
+
+
+def stop_server(process):
+    """
+    Stop a server started by start_server.
+    """
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Stats:
+    """
+    Latencies and outcomes of every request made while a level is being measured.
+    A request is ok on a 2xx or 304, rejected on any other 4xx, and an error on a 5xx
+    or when it fails to complete.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty Stats.
+        """
+        self.lock = threading.Lock()
+        self.steps = {}
+        self.journeys = 0
+        self.recording = False
+
+    def record(self, step, seconds, status):
+        """
+        Record one request of a journey step.
+        """
+        if status is None or status >= 500:
+            outcome = "errors"
+        elif status < 400 or status == 304:
+            outcome = "ok"
+        else:
+            outcome = "rejected"
+
+        with self.lock:
+            if not self.recording:
+                return
+            entry = self.steps.setdefault(
+                step, {"latencies": [], "ok": 0, "rejected": 0, "errors": 0}
+            )
+            entry["latencies"].append(seconds)
+            entry[outcome] += 1
+
+    def finish_journey(self):
+        """
+        Count a journey that ran to the end while recording.
+        """
+        with self.lock:
+            if self.recording:
+                self.journeys += 1
+
+    def summary(self, elapsed):
+        """
+        Throughput and latency percentiles per step and over all requests.
+        """
+        def describe(latencies, counts):
+            latencies = sorted(latencies)
+            result = {
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed if elapsed else 0.0,
+                **counts,
+            }
+            for percent in PERCENTILES:
+                result[f"p{percent}_ms"] = percentile(latencies, percent) * 1000
+            result["max_ms"] = latencies[-1] * 1000 if latencies else 0.0
+            return result
+
+        steps = {}
+        every_latency = []
+        totals = {"ok": 0, "rejected": 0, "errors": 0}
+        ordered = sorted(self.steps.items(), key=lambda item: STEPS.index(item[0]))
+        for step, entry in ordered:
+            counts = {key: entry[key] for key in totals}
+            steps[step] = describe(entry["latencies"], counts)
+            every_latency.extend(entry["latencies"])
+            for key in totals:
+                totals[key] += entry[key]
+
+        return {
+            "seconds": elapsed,
+            "journeys": self.journeys,
+            "journeys_per_sec": self.journeys / elapsed if elapsed else 0.0,
+            "overall": describe(every_latency, totals),
+            "steps": steps,
+        }
+
+
+class VirtualUser:
+    """
+    One simulated client with its own session cookie.
+    """
+
+    def __init__(self, base_url, stats, rng, think):
+        """
+        Initialize the VirtualUser.
+        """
+        self.base_url = base_url
+        self.stats = stats
+        self.rng = rng
+        self.think = think
+        self.cookie = None
+
+    def request(self, step, method, path, body=None, headers=None):
+        """
+        Make a request, record it under ``step`` and return (status, parsed body).
+        The status is None if the request did not complete.
+        """
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers=headers, method=method
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                status, payload, set_cookie = (
+                    response.status, response.read(), response.headers.get("Set-Cookie")
+                )
+        except urllib.error.HTTPError as e:
+            status, payload, set_cookie = e.code, e.read(), None
+        except (urllib.error.URLError, OSError):
+            self.stats.record(step, time.perf_counter() - started, None)
+            return None, None
+        self.stats.record(step, time.perf_counter() - started, status)
+
+        if set_cookie:
+            self.cookie = set_cookie.split(";", 1)[0]
+        if self.think:
+            time.sleep(self.think)
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+    def new_ride(self):
+        """
+        A ride departing one to fourteen days from now.
+        """
+        start, end = self.rng.sample(PLACES, 2)
+        moment = datetime.now(pytz.timezone("America/Los_Angeles")) + timedelta(
+            days=self.rng.randint(1, 14), minutes=self.rng.randrange(0, 24 * 60, 5)
+        )
+        departure_time = moment.strftime("%I:%M %p")
+        return {
+            "car_select": "Toyota Corolla",
+            "license_plate": f"{self.rng.randrange(10**6):06d}",
+            "from": start,
+            "to": end,
+            "date": moment.strftime("%Y-%m-%d"),
+            "departure_time": departure_time,
+            "departureTime": departure_time,
+            "max_passengers": 4,
+            "cost": self.rng.randint(5, 40),
+        }
+
+    def pick_ride(self, rides):
+        """
+        A random ride from the available rides with a free seat, or None.
+        """
+        rides = [
+            ride for ride in rides or []
+            if len(ride.get("currentPassengers") or []) < (ride.get("maxPassengers") or 0)
+        ]
+        return self.rng.choice(rides) if rides else None
+
+    def journey(self):
+        """
+        Sign up as a new user and go through the app. Steps that depend on an earlier
+        one are skipped when it failed.
+        """
+        self.cookie = None
+        user_id = f"load{uuid.uuid4().hex[:12]}"
+        status, _ = self.request("signup", "POST", "/api/signup", {
+            "name": f"User {user_id}", "email": f"{user_id}@example.com", "password": "secret"
+        })
+        if status != 201:
+            return
+        status, _ = self.request(
+            "auth", "POST", "/auth", headers={"Authorization": f"Bearer {user_id}"}
+        )
+        if status != 200:
+            return
+
+        status, body = self.request("post_ride", "POST", "/api/post-ride", self.new_ride())
+        chat_ride_id = body.get("rideId") if status == 201 and body else None
+
+        self.request("home_feed", "GET", "/api/home-feed")
+        status, body = self.request(
+            "available_rides", "GET",
+            "/api/available-rides?fields=from,to,date,departureTime,cost,maxPassengers,"
+            "currentPassengers"
+        )
+        ride = self.pick_ride(body.get("rides") if status == 200 and body else None)
+
+        if ride:
+            ride_id = ride["id"]
+            self.request("ride_details", "GET", f"/api/rides/{ride_id}")
+            status, _ = self.request("payment_sheet", "POST", "/api/payment-sheet", {
+                "rideId": ride_id, "amount": ride.get("cost") or 10, "refund": "false"
+            })
+            if status == 200:
+                status, _ = self.request(
+                    "request_ride", "POST", "/api/request-ride", {"rideId": ride_id}
+                )
+                if status == 200:
+                    chat_ride_id = ride_id
+
+        if chat_ride_id:
+            self.request("send_message", "POST", "/api/send-message", {
+                "rideId": chat_ride_id, "text": "On my way"
+            })
+            self.request("get_messages", "GET", f"/api/get-messages/{chat_ride_id}")
+        self.request("ride_chats", "GET", "/api/get-all-user-ride-chats")
+        self.request("unread_count", "GET", "/api/unread-notifications-count")
+        self.request("notifications", "GET", "/api/get-notifications")
+        self.stats.finish_journey()
+
+    def run(self, deadline):
+        """
+        Run journeys back to back until ``deadline``.
+        """
+        while time.monotonic() < deadline:
+            self.journey()
+
+
+def run_level(base_url, concurrency, args):
+    """
+    Run ``concurrency`` virtual users for the warmup and the measured duration and
+    return the measured level's summary.
+    """
+    stats = Stats()
+    started = time.monotonic()
+    deadline = started + args.warmup + args.duration
+    threads = [
+        threading.Thread(
+            target=VirtualUser(
+                base_url, stats, random.Random(args.seed * 1000 + index), args.think
+            ).run,
+            args=(deadline,),
+            daemon=True,
+        )
+        for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(args.warmup)
+    with stats.lock:
+        stats.recording = True
+    measured_from = time.monotonic()
+    time.sleep(max(0.0, deadline - measured_from))
+    with stats.lock:
+        stats.recording = False
+    elapsed = time.monotonic() - measured_from
+
+    for thread in threads:
+        thread.join()
+    return {"concurrency": concurrency, **stats.summary(elapsed)}
+
+
+def print_level(result):
+    """
+    Print one concurrency level's throughput and per-step latencies.
+    """
+    overall = result["overall"]
+    print(
+        f"\nconcurrency={result['concurrency']} "
+        f"{overall['rps']:.1f} req/s {result['journeys_per_sec']:.2f} journeys/s "
+        f"requests={overall['requests']} rejected={overall['rejected']} "
+        f"errors={overall['errors']}"
+    )
+    print(
+        f"  {'step':<16} {'count':>6} {'rps':>7} {'p50':>8} {'p90':>8} {'p99':>8} "
+        f"{'max':>8} {'4xx':>5} {'err':>5}"
+    )
+    for step, entry in [("overall", overall), *result["steps"].items()]:
+        print(
+            f"  {step:<16} {entry['requests']:>6} {entry['rps']:>7.1f} "
+            f"{entry['p50_ms']:>6.1f}ms {entry['p90_ms']:>6.1f}ms {entry['p99_ms']:>6.1f}ms "
+            f"{entry['max_ms']:>6.1f}ms {entry['rejected']:>5} {entry['errors']:>5}"
+        )
+
+
+def print_capacity(results):
+    """
+    Print throughput and overall latency for every level side by side.
+    """
+    print(f"\n{'concurrency':>11} {'req/s':>8} {'p50':>8} {'p99':>8} {'error rate':>10}")
+    for result in results:
+        overall = result["overall"]
+        error_rate = overall["errors"] / overall["requests"] if overall["requests"] else 0.0
+        print(
+            f"{result['concurrency']:>11} {overall['rps']:>8.1f} "
+            f"{overall['p50_ms']:>6.1f}ms {overall['p99_ms']:>6.1f}ms {error_rate:>10.2%}"
+        )
+
+
+def main():
+    """
+    Parse arguments, then either serve the app or sweep the concurrency levels.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--think", type=float, default=0.0)
+    parser.add_argument("--rides", type=int, default=2_000)
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--stripe-latency", type=float, default=0.1)
+    parser.add_argument("--firestore-latency", type=float, nargs=2, metavar=("MEDIAN", "P99"))
+    parser.add_argument("--firestore-error-rate", type=float, default=0.0)
+    parser.add_argument("--write-spacing", type=float, default=0.0)
+    parser.add_argument("--reuse-server", action="store_true")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--server-log", default=os.devnull)
+    parser.add_argument("--json", dest="json_path")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    results = []
+    process = base_url = None
+    with open(args.server_log, "a", encoding="utf-8") as log_file:
+        try:
+            for concurrency in args.concurrency:
+                if process is None or not args.reuse_server:
+                    if process is not None:
+                        stop_server(process)
+                    process, base_url = start_server(args, log_file)
+                result = run_level(base_url, concurrency, args)
+                results.append(result)
+                print_level(result)
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    print_capacity(results)
+
+    if args.json_path:
+        meta = {
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "think": args.think,
+            "stripeLatency": args.stripe_latency,
+            "firestoreLatency": args.firestore_latency,
+            "firestoreErrorRate": args.firestore_error_rate,
+            "writeSpacing": args.write_spacing,
+            "dataset": {"rides": args.rides, "messages": args.messages, "users": args.users},
+        }
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump({"meta": meta, "results": results}, json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
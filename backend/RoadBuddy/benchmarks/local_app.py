@@ -0,0 +1,58 @@
+"""
+Boot app.py against local stand-ins: the in-memory Firestore, a Stripe stand-in and
+Firebase Auth stubbed so that an ID token is simply the user's id.
+"""
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import firebase_admin
+from firebase_admin import auth, credentials, firestore
+
+import fake_stripe
+from fake_firestore import FakeFirestoreClient
+
+
+class FakeUserRecord:
+    """
+    The part of firebase_admin.auth.UserRecord the signup endpoint reads.
+    """
+
+    def __init__(self, uid):
+        self.uid = uid
+
+
+def verify_id_token(token):
+    """
+    Accept any token; the token is the user's id.
+    """
+    return {"uid": token, "name": f"User {token}"}
+
+
+def create_user(email, password, display_name):
+    """
+    Create a user whose id is the local part of their email address.
+    """
+    del password, display_name
+    return FakeUserRecord(email.split("@")[0])
+
+
+def load_app(db=None, stripe_latency=0.0):
+    """
+    Import app.py with Firebase and Stripe replaced by local stand-ins and return the
+    module. ``db`` is the fake Firestore client to serve from (a new one by default).
+    """
+    db = db or FakeFirestoreClient()
+    os.environ.setdefault("SECRET_KEY", "load-test")
+
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firestore.client = lambda *args, **kwargs: db
+    auth.verify_id_token = verify_id_token
+    auth.create_user = create_user
+    fake_stripe.install(stripe_latency)
+
+    return importlib.import_module("app")
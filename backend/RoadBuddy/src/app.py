@@ -1,31 +1,44 @@
-from datetime import (
-    timedelta, datetime
-)
-from functools import wraps
+import atexit
+from datetime import timedelta
 import os
-import pytz
 from flask import (
     Flask, request, session, jsonify
 )
 import google.cloud
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import auth
 from firebase_admin.auth import InvalidIdTokenError, EmailAlreadyExistsError
 from firebase_admin.exceptions import FirebaseError
 from flask_cors import CORS
-from apscheduler.schedulers.background import BackgroundScheduler
 from utils import (
-    print_json, check_required_fields,
+    print_json, check_required_fields, parse_fields,
 )
+from clients import db, firestore_metrics
+from background import BackgroundJobs
+from booking import normalize_booking_items, payment_sheet_error
+from chat_routes import chat_routes
+from concurrency import gather
+from request_hooks import install_request_hooks, rate_limit_response
+from serialization import JSONProvider, conditional_json, respond
+from session_auth import auth_required, get_user_id, get_user_name
+from streaming import stream_response
+from routing import DEFAULT_GRAPH_PATH, RoadGraph, RoutePlanner
+from location_index import LocationIndex
+from idempotency import Idempotency
+import single_flight
+import write_coalescer
 from services.car_manager import CarManager
 from services.chat_messages_manager import ChatMessagesManager
+from services.home_feed_manager import HomeFeedManager, HOME_FEED_SECTIONS
 from services.notification_manager import NotificationManager
-from services.payment_manager import PaymentManager
+from services.payment_manager import PaymentManager, SERVICE_FEE_RATE
 from services.ride_chat_manager import RideChatManager
-from services.ride_manager import RideManager
+from services.ride_manager import RideManager, RIDE_FIELDS
+from services.ride_request_manager import RideRequestManager
+from services.sync_manager import SyncManager, SYNC_COLLECTIONS
 from services.user_manager import UserManager
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 CORS(app, supports_credentials=True)
 app.secret_key = os.getenv('SECRET_KEY')
 
@@ -35,33 +48,29 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1)
 app.config['SESSION_REFRESH_EACH_REQUEST'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
-cred = credentials.Certificate("../config/firebase-config.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+route_planner = RoutePlanner(RoadGraph.load(os.getenv('ROAD_GRAPH_PATH', DEFAULT_GRAPH_PATH)))
+location_index = LocationIndex()
+background_jobs = BackgroundJobs(db, location_index)
+outbox = background_jobs.outbox
 
-def get_user_id():
-    """
-    Retrieve user's ID
-    """
-    return session.get('user', {}).get('uid')
+# Decorator making POSTs sent with an Idempotency-Key header safe to retry.
+idempotent = Idempotency(db, get_user_id, admit=rate_limit_response)
 
-def get_user_name():
-    """
-    Retrieve user's name
-    """
-    return session.get('user').get('name')
+install_request_hooks(app)
+app.register_blueprint(chat_routes)
 
-def auth_required(f):
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
     """
-    Decorator to enforce user authentication for a route.
+    Firestore usage, read coalescing and write coalescing metrics in the Prometheus
+    text format.
     """
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user' not in session:
-            return jsonify({"error": "User is not logged in"}), 401
-        return f(*args, **kwargs)
-
-    return decorated_function
+    metrics_text = (
+        firestore_metrics.expose() + single_flight.expose() + write_coalescer.expose()
+    )
+    return metrics_text, 200, {
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'
+    }
 
 @app.route('/auth', methods=['POST'])
 def authorize():
@@ -167,6 +176,7 @@ def api_add_car():
 
 @app.route('/api/post-ride', methods=['POST'])
 @auth_required
+@idempotent
 def api_post_ride():
     """
     API Post a ride.
@@ -207,6 +217,10 @@ def api_post_ride():
     ride_id = post_ride_response_data.get("rideId")
 
     user_manager.add_posted_ride(ride_id)
+    location_index.add_posted_ride(
+        ride_id, post_ride_response_data.get("ride").get("stops")
+    )
+    background_jobs.schedule_expiry(ride_id, post_ride_response_data.get("ride"))
 
     ride_chat_manager = RideChatManager(db, user_id, user_name)
     ride_chat_manager.create_ride_chat(ride_id, data)
@@ -215,6 +229,7 @@ def api_post_ride():
 
 @app.route('/api/request-ride', methods=['POST'])
 @auth_required
+@idempotent
 def api_request_ride():
     """
     API Request a ride.
@@ -244,7 +259,7 @@ def api_request_ride():
         return jsonify(get_ride_response_data), get_ride_repsosne_status_code
 
     add_passenger_response_data, add_passenger_response_status_code = (
-        ride_manager.add_passenger(ride_id)
+        ride_manager.add_passenger(ride_id, data.get('fromStop'), data.get('toStop'))
     )
 
     if add_passenger_response_status_code != 200:
@@ -269,6 +284,37 @@ def api_request_ride():
 
     return jsonify(get_ride_response_data), get_ride_repsosne_status_code
 
+@app.route('/api/ride-requests', methods=['POST'])
+@auth_required
+def api_queue_ride_request():
+    """
+    Queue a ride request to be matched with a posted ride by the matching job.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
+
+    required_fields = [
+      'from',
+      'to',
+      'date',
+      'departure_time'
+    ]
+
+    missing_response = check_required_fields(data, required_fields)
+    if missing_response:
+        return jsonify(missing_response[0]), missing_response[1]
+
+    user_id = get_user_id()
+    user_name = get_user_name()
+
+    ride_request_manager = RideRequestManager(db, user_id, user_name)
+    response_message, response_status_code = (
+        ride_request_manager.create_ride_request(data)
+    )
+
+    return jsonify(response_message), response_status_code
+
 @app.route('/api/payment-sheet', methods=['POST'])
 @auth_required
 def create_payment_sheet():
@@ -294,80 +340,165 @@ def create_payment_sheet():
 
     user_id = get_user_id()
     user_name = get_user_name()
+    amount = data.get("amount")
+    stripe_customer_id = session.get("stripe_customer_id")
 
+    # Nothing is created in Stripe until the ride is known to be bookable. Only the
+    # reads overlap: the ride, and the user's Stripe customer if this session has
+    # none yet.
     ride_manager = RideManager(db, user_id, user_name)
-    get_ride_response_message, get_ride_response_status_code = (
-        ride_manager.get_ride(ride_id)
-    )
+    payment_manager = PaymentManager(user_id)
+    if stripe_customer_id:
+        get_ride_response = ride_manager.get_ride(ride_id)
+    else:
+        get_ride_response, find_customer_response = gather(
+            ride_manager.get_ride_async(ride_id),
+            payment_manager.find_customer_async()
+        )
+        # A failed lookup only means a new customer is created for this payment.
+        stripe_customer_id = find_customer_response[0].get("customer")
 
+    get_ride_response_message, get_ride_response_status_code = get_ride_response
     if get_ride_response_status_code != 200:
         return jsonify(get_ride_response_message), get_ride_response_status_code
 
-    ride_data = get_ride_response_message.get("ride")
-    ride_owner_id = ride_data["ownerID"]
+    error = payment_sheet_error(
+        get_ride_response_message.get("ride"), user_id, refund,
+        data.get('fromStop'), data.get('toStop')
+    )
+    if error:
+        return jsonify({"error": error}), 400
+
+    payment_sheet_response_message, payment_sheet_repsonse_status_code = (
+        payment_manager.create_payment_sheet(ride_id, amount, stripe_customer_id)
+    )
 
-    if ride_owner_id == user_id and not refund:
-        return jsonify({"error": "User cannot book its own ride."}), 400
+    if payment_sheet_repsonse_status_code != 200:
+        return jsonify(payment_sheet_response_message), payment_sheet_repsonse_status_code
 
-    max_passengers = ride_data["maxPassengers"]
-    curr_passengers = ride_data["currentPassengers"] or []
-    if len(curr_passengers) >= max_passengers and not refund:
-        return jsonify({"error": "Ride is full"}), 400
+    session['stripe_customer_id'] = payment_sheet_response_message.get("customer")
 
-    ride_date = ride_data["date"]
-    ride_time = ride_data["departureTime"]
+    return jsonify(payment_sheet_response_message), payment_sheet_repsonse_status_code
 
-    pacific_zone = pytz.timezone("America/Los_Angeles")
-    ride_datetime = datetime.strptime(f"{ride_date} {ride_time}", "%Y-%m-%d %I:%M %p")
-    ride_datetime = pacific_zone.localize(ride_datetime)
+@app.route('/api/batch-payment-sheet', methods=['POST'])
+@auth_required
+def create_batch_payment_sheet():
+    """
+    Stripe payment sheet for seats on several rides, charged as one payment.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
 
-    if ride_datetime <= datetime.now(pacific_zone):
-        return jsonify({"error": "This ride is no longer available."}), 400
+    items, error = normalize_booking_items(data.get('items'))
+    if error:
+        return jsonify({"error": error}), 400
 
-    amount = data.get("amount")
-    stripe_customer_id = session.get("stripe_customer_id")
+    user_id = get_user_id()
+    user_name = get_user_name()
 
-    if user_id in curr_passengers and not refund:
-        return jsonify({"error": "User already a passenger of this ride."}), 400
+    ride_manager = RideManager(db, user_id, user_name)
+    validate_response_message, validate_response_status_code = (
+        ride_manager.validate_booking_items(items)
+    )
+
+    if validate_response_status_code != 200:
+        return jsonify(validate_response_message), validate_response_status_code
+
+    amount = round(validate_response_message.get("total") * SERVICE_FEE_RATE, 2)
+    stripe_customer_id = session.get("stripe_customer_id")
 
     payment_manager = PaymentManager(user_id)
-    payment_sheet_response_message, payment_sheet_repsonse_status_code = (
-        payment_manager.create_payment_sheet(ride_id, amount, stripe_customer_id)
+    payment_sheet_response_message, payment_sheet_response_status_code = (
+        payment_manager.create_batch_payment_sheet(
+            [item["rideId"] for item in items], amount, stripe_customer_id
+        )
     )
 
-    if payment_sheet_repsonse_status_code != 200:
-        return jsonify(payment_sheet_response_message), payment_sheet_repsonse_status_code
+    if payment_sheet_response_status_code != 200:
+        return jsonify(payment_sheet_response_message), payment_sheet_response_status_code
 
     session['stripe_customer_id'] = payment_sheet_response_message.get("customer")
+    payment_sheet_response_message["amount"] = amount
 
-    return jsonify(payment_sheet_response_message), payment_sheet_repsonse_status_code
+    return jsonify(payment_sheet_response_message), payment_sheet_response_status_code
 
-@app.route('/api/available-rides', methods=['GET'])
+@app.route('/api/request-rides', methods=['POST'])
 @auth_required
-def get_available_rides():
-    """Fetch all available rides with status 'open'."""
+def api_request_rides():
+    """
+    API Book seats on several rides at once.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
+
+    items, error = normalize_booking_items(data.get('items'))
+    if error:
+        return jsonify({"error": error}), 400
+
     user_id = get_user_id()
     user_name = get_user_name()
 
-    user_manger = UserManager(db, user_id)
-    user_ride_response_message, user_ride_response_status_code = (
-        user_manger.get_user_ride()
+    ride_manager = RideManager(db, user_id, user_name)
+    book_response_message, book_response_status_code = (
+        ride_manager.add_passenger_to_rides(items)
     )
 
-    if user_ride_response_status_code != 200:
-        return jsonify({"Error": "Failed to fetch rides"}), 400
+    if book_response_status_code != 200:
+        return jsonify(book_response_message), book_response_status_code
+
+    rides = book_response_message.pop("rides")
+    notifications = []
+    for item in items:
+        ride_data = rides[item["rideId"]]
+        message = (
+            f"{user_name} has booked {item['seats']} seat(s) with you\n"
+            f"From: {ride_data['from']}\n"
+            f"To: {ride_data['to']}"
+        )
+        notifications.append((ride_data["ownerID"], item["rideId"], message))
+
+    notification_manager = NotificationManager(db)
+    notification_manager.store_notifications(notifications)
 
-    excluded_rides = user_ride_response_message.get("rides")
+    return jsonify(book_response_message), book_response_status_code
 
+@app.route('/api/available-rides', methods=['GET'])
+@auth_required
+def get_available_rides():
+    """
+    Fetch all available rides with status 'open'. ``fields`` optionally limits each
+    ride to a comma-separated list of fields.
+    """
+    fields, fields_error = parse_fields(request.args.get('fields'), RIDE_FIELDS)
+    if fields_error:
+        return jsonify(fields_error[0]), fields_error[1]
+
+    user_id = get_user_id()
+    user_name = get_user_name()
+
+    # Read the user's rides while the open-rides query starts, then stream the open
+    # rides to the client as they arrive, minus the user's own.
+    user_manger = UserManager(db, user_id)
     ride_manager = RideManager(db, user_id, user_name)
+    user_ride_future = user_manger.get_user_ride_async()
     avaiable_rides_response_message, avaiable_rides_response_status_code = (
-        ride_manager.get_avaiable_rides(excluded_rides)
+        ride_manager.stream_avaiable_rides((), fields)
     )
+    user_ride_response_message, user_ride_response_status_code = user_ride_future.result()
+
+    if user_ride_response_status_code != 200:
+        return jsonify({"Error": "Failed to fetch rides"}), 400
 
     if avaiable_rides_response_status_code != 200:
         return jsonify(avaiable_rides_response_message), avaiable_rides_response_status_code
 
-    return jsonify(avaiable_rides_response_message), avaiable_rides_response_status_code
+    excluded_rides = set(user_ride_response_message.get("rides"))
+    return stream_response("rides", (
+        ride for ride in avaiable_rides_response_message.get("rides")
+        if ride.get("id") not in excluded_rides
+    ))
 
 @app.route('/api/rides/<ride_id>', methods=['GET'])
 @auth_required
@@ -387,12 +518,77 @@ def api_get_ride_details(ride_id):
     ride_data = get_ride_response_message.get("ride")
     ride_data["id"] = ride_id
 
-    return jsonify({"ride": ride_data}), 200
+    return conditional_json(
+        {"ride": ride_data}, f"{ride_id}-{get_ride_response_message.get('version')}"
+    )
+
+@app.route('/api/rides/<ride_id>/seats', methods=['GET'])
+@auth_required
+def api_get_ride_seats(ride_id):
+    """Check whether a seat is free between two stops of a ride"""
+    user_id = get_user_id()
+    user_name = get_user_name()
+
+    ride_manager = RideManager(db, user_id, user_name)
+    response_message, response_status_code = (
+        ride_manager.get_seat_availability(
+            ride_id, request.args.get('fromStop'), request.args.get('toStop')
+        )
+    )
+
+    return jsonify(response_message), response_status_code
+
+@app.route('/api/route-estimate', methods=['GET'])
+@auth_required
+def api_route_estimate():
+    """
+    Estimate travel time, distance and a per-seat fare between two places,
+    and optionally the detour needed to pick someone up on the way.
+    """
+    start = request.args.get('from')
+    destination = request.args.get('to')
+    if not start or not destination:
+        return jsonify({"error": "Missing or empty required field(s): from, to"}), 400
+
+    response_message, response_status_code = (
+        route_planner.estimate(start, destination, request.args.get('pickup'))
+    )
+
+    return jsonify(response_message), response_status_code
+
+@app.route('/api/locations/suggest', methods=['GET'])
+@auth_required
+def api_suggest_locations():
+    """
+    Suggest place names that start with the typed prefix, from the in-memory index.
+    """
+    prefix = request.args.get('q', '')
+    try:
+        limit = min(int(request.args.get('limit', 10)), 50)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+
+    return jsonify({"suggestions": location_index.suggest(prefix, limit)}), 200
+
+@app.route('/api/scheduler/status', methods=['GET'])
+@auth_required
+def api_scheduler_status():
+    """
+    Report whether this process is the scheduler leader and its per-job run metrics.
+    """
+    return jsonify(background_jobs.status()), 200
 
 @app.route('/api/coming-up-rides', methods=['GET'])
 @auth_required
 def api_get_coming_up_rides():
-    """Fetch all the user coming up rides"""
+    """
+    Fetch all the user coming up rides. ``fields`` optionally limits each ride to a
+    comma-separated list of fields.
+    """
+    fields, fields_error = parse_fields(request.args.get('fields'), RIDE_FIELDS)
+    if fields_error:
+        return jsonify(fields_error[0]), fields_error[1]
+
     user_id = get_user_id()
     user_name = get_user_name()
 
@@ -409,13 +605,13 @@ def api_get_coming_up_rides():
     ride_manager = RideManager(db, user_id, user_name)
 
     rides_by_ids_response_message, rides_by_ids_response_status_code = (
-        ride_manager.get_rides_by_ids(user_rides)
+        ride_manager.get_rides_by_ids(user_rides, fields)
     )
 
     if rides_by_ids_response_status_code != 200:
         return jsonify(rides_by_ids_response_message), rides_by_ids_response_status_code
 
-    return jsonify(rides_by_ids_response_message), rides_by_ids_response_status_code
+    return respond(rides_by_ids_response_message)
 
 @app.route('/api/user-id', methods=['GET'])
 @auth_required
@@ -451,34 +647,37 @@ def api_cancel_ride():
     user_name = get_user_name()
     ride_id = data.get("rideId")
 
+    task_ids = []
+
+    def stage_cancel_tasks(transaction, ride_data):
+        """
+        Stage the cleanup and the owner's notification with the seat release. The
+        transaction may run more than once, so only the last attempt's tasks are kept.
+        """
+        message = (
+            f"{user_name} has cancelled a ride with you.\n"
+            f"From: {ride_data.get('from')}\n"
+            f"To: {ride_data.get('to')}"
+        )
+        task_ids[:] = [
+            outbox.stage(transaction, "remove_joined_ride", {"userId": user_id, "rideId": ride_id}),
+            outbox.stage(
+                transaction, "remove_chat_participant", {"userId": user_id, "rideId": ride_id}
+            ),
+            outbox.stage(transaction, "notify_users", {
+                "userIds": [ride_data.get("ownerID")], "rideId": ride_id, "message": message
+            }),
+        ]
+
     ride_manager = RideManager(db, user_id, user_name)
     remove_passenger_response_message, remove_passenger_response_status_code = (
-        ride_manager.remove_passenger(ride_id)
+        ride_manager.remove_passenger(ride_id, stage_cancel_tasks)
     )
 
     if remove_passenger_response_status_code != 200:
         return jsonify(remove_passenger_response_message), remove_passenger_response_status_code
 
-    user_manager = UserManager(db, user_id)
-    user_manager.remove_joined_ride(ride_id)
-
-    ride_chat_mamager = RideChatManager(db, user_id, user_name)
-    ride_chat_mamager.remove_participant(ride_id)
-
-    get_ride_response = ride_manager.get_ride(ride_id)
-    ride_data = get_ride_response[0].get("ride")
-
-    ride_owner_id = ride_data.get("ownerID")
-    start = ride_data.get("from")
-    destination = ride_data.get("to")
-
-    message = (
-        f"{user_name} has cancelled a ride with you.\n"
-        f"From: {start}\n"
-        f"To: {destination}"
-    )
-    notification_manager = NotificationManager(db)
-    notification_manager.store_notification(ride_owner_id, ride_id, message)
+    outbox.dispatch(task_ids)
 
     return jsonify({"message": "Ride successfully cancelled"}), 200
 
@@ -503,47 +702,51 @@ def api_delete_ride():
     user_id = get_user_id()
     user_name = get_user_name()
 
+    task_ids = []
+
+    def stage_delete_tasks(batch, ride_data):
+        """
+        Stage the cascade and the passengers' refund notifications with the deletion.
+        Each passenger is refunded what they paid for their seats, so passengers are
+        notified in one task per refund amount.
+        """
+        passengers = ride_data.get("currentPassengers", [])
+        seat_counts = ride_data.get("seatCounts") or {}
+        passengers_by_refund = {}
+        for passenger in passengers:
+            refund = ride_data.get("cost") * seat_counts.get(passenger, 1) * SERVICE_FEE_RATE
+            passengers_by_refund.setdefault(round(refund, 2), []).append(passenger)
+
+        task_ids.append(
+            outbox.stage(batch, "remove_posted_ride", {"userId": user_id, "rideId": ride_id})
+        )
+        task_ids.extend(
+            outbox.stage(batch, "remove_joined_ride", {"userId": passenger, "rideId": ride_id})
+            for passenger in passengers
+        )
+        task_ids.append(outbox.stage(batch, "delete_ride_chat", {"rideId": ride_id}))
+        for refund, refunded_passengers in passengers_by_refund.items():
+            message = (
+                f"${refund:.2f} has been refunded to you.\n"
+                f"{user_name} (ride's owner) has delete this ride.\n"
+                f"From: {ride_data.get('from')}\n"
+                f"To: {ride_data.get('to')}\n"
+                f"To: {ride_data.get('date')}"
+            )
+            task_ids.append(outbox.stage(batch, "notify_users", {
+                "userIds": refunded_passengers, "rideId": ride_id, "message": message
+            }))
+
     ride_manager = RideManager(db, user_id, user_name)
     delete_ride_response_message, delete_ride_response_status_code = (
-        ride_manager.delete_ride(ride_id)
+        ride_manager.delete_ride(ride_id, stage_delete_tasks)
     )
 
     if delete_ride_response_status_code != 200:
         return jsonify(delete_ride_response_message), delete_ride_response_status_code
 
-    user_manager = UserManager(db, user_id)
-    user_manager.remove_posted_ride(ride_id)
-
-    deleted_ride_data = delete_ride_response_message.get("deletedRide")
-    passengers = deleted_ride_data.get("currentPassengers")
-
-    for passenger in passengers:
-        user_manager = UserManager(db, passenger)
-        user_manager.remove_joined_ride(ride_id)
-
-    chat_messages_manager = ChatMessagesManager(db, ride_id, user_id, user_name)
-    chat_messages_manager.delete_all_messages()
-
-    ride_chat_manager = RideChatManager(db, user_id, user_name)
-    response_message, response_status = ride_chat_manager.delete_ride_chat(ride_id)
-    if response_status != 200:
-        print(response_message.get("details"))
-
-    start = deleted_ride_data.get("from")
-    destination = deleted_ride_data.get("to")
-    date = deleted_ride_data.get("date")
-    cost = deleted_ride_data.get("cost") * 1.20
-
-    message = (
-        f"${cost:.2f} has been refunded to you.\n"
-        f"{user_name} (ride's owner) has delete this ride.\n"
-        f"From: {start}\n"
-        f"To: {destination}\n"
-        f"To: {date}"
-    )
-
-    notification_manager = NotificationManager(db)
-    notification_manager.store_notification_for_users(passengers, ride_id, message)
+    background_jobs.ride_expiry_scheduler.cancel(ride_id)
+    outbox.dispatch(task_ids)
 
     return jsonify(delete_ride_response_message), delete_ride_response_status_code
 
@@ -574,7 +777,10 @@ def api_get_all_notifications():
         notification_manager.get_all_notifications_for_user(user_id)
     )
 
-    return jsonify(response_message), response_status_code
+    if response_status_code != 200:
+        return jsonify(response_message), response_status_code
+
+    return respond(response_message)
 
 @app.route('/api/get-cars', methods=['GET'])
 @auth_required
@@ -591,6 +797,62 @@ def api_get_cars():
 
     return jsonify(response_message), response_status_code
 
+@app.route('/api/home-feed', methods=['GET'])
+@auth_required
+def api_get_home_feed():
+    """
+    Fetch everything the app shows on launch in one call. ``sections`` optionally
+    limits the response to a comma-separated subset of the feed.
+    """
+    sections = request.args.get('sections')
+    if sections:
+        sections = [section.strip() for section in sections.split(',') if section.strip()]
+        unknown = [section for section in sections if section not in HOME_FEED_SECTIONS]
+        if unknown:
+            return jsonify({"error": f"Unknown section(s): {', '.join(unknown)}"}), 400
+    else:
+        sections = HOME_FEED_SECTIONS
+
+    user_id = get_user_id()
+
+    home_feed_manager = HomeFeedManager(db, user_id)
+    response_message, response_status_code = home_feed_manager.get_home_feed(sections)
+
+    if response_status_code != 200:
+        return jsonify(response_message), response_status_code
+
+    return respond(response_message)
+
+@app.route('/api/sync', methods=['GET'])
+@auth_required
+def api_sync():
+    """
+    Fetch the rides, ride chats and notifications that changed since the client's
+    last sync. Each collection takes the token returned for it by the previous sync;
+    an empty token asks for a full sync. ``collections`` optionally limits the
+    response to a comma-separated subset.
+    """
+    collections = request.args.get('collections')
+    if collections:
+        collections = [c.strip() for c in collections.split(',') if c.strip()]
+        unknown = [c for c in collections if c not in SYNC_COLLECTIONS]
+        if unknown:
+            return jsonify({"error": f"Unknown collection(s): {', '.join(unknown)}"}), 400
+    else:
+        collections = SYNC_COLLECTIONS
+
+    user_id = get_user_id()
+
+    sync_manager = SyncManager(db, user_id)
+    response_message, response_status_code = sync_manager.sync(
+        {collection: request.args.get(collection) for collection in collections}
+    )
+
+    if response_status_code != 200:
+        return jsonify(response_message), response_status_code
+
+    return respond(response_message)
+
 @app.route('/api/home', methods=['GET'])
 @auth_required
 def api_home():
@@ -605,6 +867,7 @@ def api_home():
 
 @app.route('/api/send-message', methods=['POST'])
 @auth_required
+@idempotent
 def api_send_message():
     """
     Send a message.
@@ -641,15 +904,6 @@ def api_send_message():
     owner_id = ride_chat_details.get("owner")
     is_owner = user_id == owner_id
 
-    chat_message_manager = ChatMessagesManager(db, ride_id, user_id, user_name)
-    chat_message_response_message, chat_message_status_code = (
-        chat_message_manager.send_message(text, timestamp, is_owner)
-    )
-
-    if chat_message_status_code != 201:
-        print(chat_message_response_message)
-        return jsonify(chat_message_response_message), chat_message_status_code
-
     participants = ride_chat_details.get("participants", [])
     participants = [p for p in participants if p != user_id]
 
@@ -661,109 +915,33 @@ def api_send_message():
         f"To: {destination}"
     )
 
-    print(participants)
-    notification_manager = NotificationManager(db)
-    notification_manager.store_notification_for_users(participants, ride_id, notification_message)
-
-    return jsonify(chat_message_response_message), chat_message_status_code
-
-@app.route('/api/get-messages/<ride_chat_id>', methods=['GET'])
-@auth_required
-def api_get_messages(ride_chat_id):
-    """
-    Fetch all messages from a rideChat.
-    """
-    user_id = get_user_id()
-    user_name = get_user_name()
-
-    ride_chat_manager = RideChatManager(db, user_id, user_name)
-    ride_chat_response_message, ride_chat_response_status_code = (
-        ride_chat_manager.get_ride_chat_details(ride_chat_id)
-    )
-
-    if ride_chat_response_status_code != 200:
-        return jsonify(ride_chat_response_message), ride_chat_response_status_code
-
-    chat_message_manager = ChatMessagesManager(db, ride_chat_id, user_id, user_name)
-    chat_message_response_message, chat_message_response_status_code = (
-        chat_message_manager.get_messages_sorted_by_timestamp_asc()
-    )
-
-    return jsonify(chat_message_response_message), chat_message_response_status_code
-
-@app.route('/api/check-ride-chat/<ride_chat_id>', methods=['GET'])
-@auth_required
-def api_check_ride_chat(ride_chat_id):
-    """
-    Check if a rideChat document exists.
-    """
-    user_id = get_user_id()
-    user_name = get_user_name()
-
-    ride_chat_manager = RideChatManager(db, user_id, user_name)
-    ride_chat_response = ride_chat_manager.get_ride_chat_details(ride_chat_id)
-    response_status_code = ride_chat_response[1]
-
-    if response_status_code != 200:
-        return jsonify({"exists": False, "error": "Ride chat not found"}), 404
-
-    return jsonify({"exists": True}), 200
+    task_ids = []
 
-@app.route('/api/get-all-user-ride-chats', methods=['GET'])
-@auth_required
-def api_get_all_user_ride_chats():
-    """
-    Fetch all the ride chats for the user.
-    """
-    user_id = get_user_id()
-    user_name = get_user_name()
-
-    user_manager = UserManager(db, user_id)
-    response = user_manager.get_user_ride()
-    ride_ids = response[0].get("rides")
+    def stage_notification(batch):
+        """
+        Stage the participants' notification with the message.
+        """
+        if participants:
+            task_ids.append(outbox.stage(batch, "notify_users", {
+                "userIds": participants, "rideId": ride_id, "message": notification_message
+            }))
 
-    ride_chat_manager = RideChatManager(db,  user_id, user_name)
-    ride_chat_response_message, ride_chat_response_status_code = (
-        ride_chat_manager.get_all_user_ride_chats(ride_ids)
+    chat_message_manager = ChatMessagesManager(db, ride_id, user_id, user_name)
+    chat_message_response_message, chat_message_status_code = (
+        chat_message_manager.send_message(text, timestamp, is_owner, stage_notification)
     )
 
-    return jsonify(ride_chat_response_message), ride_chat_response_status_code
-
-def delete_past_rides():
-    """
-    Deletes past rides from Firestore.
-    """
-    print("Checking for past rides...")
-
-    ride_manager = RideManager(db, None, None)
-    response = ride_manager.delete_past_rides()
-
-    deleted_rides = response[0].get("deletedRides")
-
-    for ride in deleted_rides:
-        ride_id = ride.get("id")
-        owner_id = ride.get("ownerID")
-        owner_name = ride.get("ownerName")
-        passenger_ids = ride.get("currentPassengers")
-
-        print("Deleting ", ride_id)
-
-        owner_user_manager = UserManager(db, owner_id)
-        owner_user_manager.remove_posted_ride(ride_id)
+    if chat_message_status_code != 201:
+        print(chat_message_response_message)
+        return jsonify(chat_message_response_message), chat_message_status_code
 
-        for passenger_id in passenger_ids:
-            passenger_user_manager = UserManager(db, passenger_id)
-            passenger_user_manager.remove_joined_ride(ride_id)
+    outbox.dispatch(task_ids)
 
-        chat_message_manager = ChatMessagesManager(db, ride_id, owner_id, owner_name)
-        chat_message_manager.delete_all_messages()
+    return jsonify(chat_message_response_message), chat_message_status_code
 
-        ride_chat_manager = RideChatManager(db, owner_id, owner_name)
-        ride_chat_manager.delete_ride_chat(ride_id)
+background_jobs.start()
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(delete_past_rides, "interval", minutes=10)
-scheduler.start()
+atexit.register(write_coalescer.last_message_writes.stop)
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8090, debug=True, threaded=True)
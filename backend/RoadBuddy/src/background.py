@@ -0,0 +1,288 @@
+import atexit
+from datetime import datetime
+from apscheduler.schedulers.background import BackgroundScheduler
+import booking
+from expiry_scheduler import ExpiryScheduler
+from job_metrics import JobMetrics
+from leader_lease import LeaderLease
+from outbox import Outbox
+from services.chat_messages_manager import ChatMessagesManager
+from services.notification_manager import NotificationManager
+from services.ride_chat_manager import RideChatManager
+from services.ride_manager import RideManager
+from services.ride_request_manager import RideRequestManager
+from services.sync_manager import SyncManager
+from services.user_manager import UserManager
+
+
+def raise_for_server_error(response):
+    """
+    Raise if a manager call failed on the server side, so the outbox retries the task.
+    Client errors such as a missing document are final.
+    """
+    response_message, response_status_code = response
+    if response_status_code >= 500:
+        raise RuntimeError(response_message.get("details"))
+
+
+class BackgroundJobs:
+    """
+    BackgroundJobs owns the work done outside requests: the outbox and its task
+    handlers, the scheduled jobs and the leader lease that decides which process runs
+    the leader-only ones, and the ride expiry scheduler.
+    """
+
+    def __init__(self, db, location_index):
+        """
+        Initialize the BackgroundJobs. Nothing runs until ``start``.
+        """
+        self.db = db
+        self.location_index = location_index
+        self.job_metrics = JobMetrics()
+        self.leader_lease = LeaderLease(
+            db, "background-jobs", on_elected=self.start_leader_duties,
+            on_demoted=self.stop_leader_duties
+        )
+        self.ride_expiry_scheduler = ExpiryScheduler(
+            self.job_metrics.track("expire_rides", self.expire_rides, self.leader_lease.is_leader)
+        )
+        self.outbox = Outbox(db, {
+            "remove_posted_ride": self.run_remove_posted_ride,
+            "remove_joined_ride": self.run_remove_joined_ride,
+            "remove_chat_participant": self.run_remove_chat_participant,
+            "delete_ride_chat": self.run_delete_ride_chat,
+            "notify_users": self.run_notify_users,
+        })
+        self.scheduler = BackgroundScheduler()
+
+    def start(self):
+        """
+        Start the outbox workers and the scheduled jobs, and release the leader lease
+        at exit.
+        """
+        lease = self.leader_lease
+        track = self.job_metrics.track
+
+        self.outbox.start()
+        self.scheduler.add_job(
+            lease.try_acquire, "interval", seconds=lease.ttl_seconds / 3,
+            id="leader_lease", next_run_time=datetime.now()
+        )
+        self.scheduler.add_job(
+            track("delete_past_rides", self.delete_past_rides, lease.is_leader),
+            "interval", minutes=60, id="delete_past_rides"
+        )
+        self.scheduler.add_job(
+            track("sync_ride_expiries", self.sync_ride_expiries, lease.is_leader),
+            "interval", minutes=1, id="sync_ride_expiries"
+        )
+        self.scheduler.add_job(
+            track("match_pending_ride_requests", self.match_pending_ride_requests,
+                  lease.is_leader),
+            "interval", minutes=5, id="match_pending_ride_requests"
+        )
+        self.scheduler.add_job(
+            track("poll_outbox", self.outbox.poll, lease.is_leader),
+            "interval", minutes=1, id="poll_outbox"
+        )
+        # Every process serves autocomplete from its own index, so this job is not
+        # leader-only.
+        self.scheduler.add_job(
+            track("refresh_location_index", self.refresh_location_index),
+            "interval", minutes=1, id="refresh_location_index", next_run_time=datetime.now()
+        )
+        self.scheduler.start()
+
+        atexit.register(lease.release)
+
+    def status(self):
+        """
+        Whether this process is the scheduler leader, and the per-job run metrics.
+        """
+        return {
+            "holder": self.leader_lease.holder_id,
+            "leader": self.leader_lease.is_leader(),
+            "scheduledExpiries": len(self.ride_expiry_scheduler),
+            "jobs": self.job_metrics.snapshot(),
+        }
+
+    def schedule_expiry(self, ride_id, ride_data):
+        """
+        Expire a newly posted ride at its departure, if this process leads. Otherwise
+        the leader picks it up on its next sync.
+        """
+        if self.leader_lease.is_leader():
+            self.ride_expiry_scheduler.schedule(
+                ride_id, booking.departure_datetime(ride_data).timestamp()
+            )
+
+    def cleanup_deleted_rides(self, deleted_rides):
+        """
+        Removes deleted rides from their owner's and passengers' lists and deletes
+        their chats.
+        """
+        for ride in deleted_rides:
+            ride_id = ride.get("id")
+            owner_id = ride.get("ownerID")
+            owner_name = ride.get("ownerName")
+            passenger_ids = ride.get("currentPassengers")
+
+            print("Deleting ", ride_id)
+
+            owner_user_manager = UserManager(self.db, owner_id)
+            owner_user_manager.remove_posted_ride(ride_id)
+
+            for passenger_id in passenger_ids:
+                passenger_user_manager = UserManager(self.db, passenger_id)
+                passenger_user_manager.remove_joined_ride(ride_id)
+
+            chat_message_manager = ChatMessagesManager(self.db, ride_id, owner_id, owner_name)
+            chat_message_manager.delete_all_messages()
+
+            ride_chat_manager = RideChatManager(self.db, owner_id, owner_name)
+            ride_chat_manager.delete_ride_chat(ride_id)
+
+    def run_remove_posted_ride(self, payload):
+        """
+        Outbox task: remove a ride from its owner's posted rides.
+        """
+        user_manager = UserManager(self.db, payload["userId"])
+        raise_for_server_error(user_manager.remove_posted_ride(payload["rideId"]))
+
+    def run_remove_joined_ride(self, payload):
+        """
+        Outbox task: remove a ride from a passenger's joined rides.
+        """
+        user_manager = UserManager(self.db, payload["userId"])
+        raise_for_server_error(user_manager.remove_joined_ride(payload["rideId"]))
+
+    def run_remove_chat_participant(self, payload):
+        """
+        Outbox task: remove a passenger from a ride chat.
+        """
+        ride_chat_manager = RideChatManager(self.db, payload["userId"], None)
+        raise_for_server_error(ride_chat_manager.remove_participant(payload["rideId"]))
+
+    def run_delete_ride_chat(self, payload):
+        """
+        Outbox task: delete a ride chat and its messages.
+        """
+        ride_id = payload["rideId"]
+        chat_messages_manager = ChatMessagesManager(self.db, ride_id, None, None)
+        raise_for_server_error(chat_messages_manager.delete_all_messages())
+
+        ride_chat_manager = RideChatManager(self.db, None, None)
+        raise_for_server_error(ride_chat_manager.delete_ride_chat(ride_id))
+
+    def run_notify_users(self, payload):
+        """
+        Outbox task: store the same notification for several users.
+        """
+        notification_manager = NotificationManager(self.db)
+        raise_for_server_error(notification_manager.store_notification_for_users(
+            payload["userIds"], payload["rideId"], payload["message"]
+        ))
+
+    def delete_past_rides(self):
+        """
+        Deletes past rides from Firestore. This is the fallback sweep for rides the
+        expiry scheduler does not know about. Also purges old sync tombstones.
+        """
+        print("Checking for past rides...")
+
+        ride_manager = RideManager(self.db, None, None)
+        response = ride_manager.delete_past_rides()
+
+        self.cleanup_deleted_rides(response[0].get("deletedRides"))
+
+        sync_manager = SyncManager(self.db, None)
+        response_message, response_status_code = sync_manager.purge_tombstones()
+        if response_status_code != 200:
+            print(response_message.get("details"))
+
+    def expire_rides(self, ride_ids):
+        """
+        Deletes rides as soon as the expiry scheduler reports they have departed.
+        """
+        ride_manager = RideManager(self.db, None, None)
+        response_message, response_status_code = ride_manager.delete_expired_rides(ride_ids)
+
+        if response_status_code != 200:
+            raise RuntimeError(response_message.get("details"))
+
+        self.cleanup_deleted_rides(response_message.get("deletedRides"))
+
+        # Raising makes the expiry scheduler retry the batch. Rides already deleted are
+        # skipped on the retry.
+        failed_ride_ids = response_message.get("failedRideIds")
+        if failed_ride_ids:
+            raise RuntimeError(f"Failed to delete rides {failed_ride_ids}")
+
+    def sync_ride_expiries(self):
+        """
+        Schedules expiry for rides created since the last sync. The first run loads
+        every ride.
+        """
+        ride_manager = RideManager(self.db, None, None)
+        response_message, response_status_code = ride_manager.get_rides_created_after(
+            self.ride_expiry_scheduler.synced_until, ["date", "departureTime"]
+        )
+
+        if response_status_code != 200:
+            print(response_message.get("details"))
+            return
+
+        self.ride_expiry_scheduler.schedule_many(
+            (ride_id, booking.departure_datetime(ride_data).timestamp())
+            for ride_id, ride_data in response_message.get("rides")
+        )
+        self.ride_expiry_scheduler.synced_until = response_message.get("latest")
+
+    def match_pending_ride_requests(self):
+        """
+        Matches pending ride requests to open rides in one batch.
+        """
+        print("Matching pending ride requests...")
+
+        ride_request_manager = RideRequestManager(self.db)
+        response_message, _ = ride_request_manager.match_pending_requests()
+        print(response_message)
+
+    def refresh_location_index(self):
+        """
+        Adds places from rides created since the last refresh to the location index.
+        """
+        ride_manager = RideManager(self.db, None, None)
+        response_message, response_status_code = ride_manager.get_rides_created_after(
+            self.location_index.refreshed_until, ["from", "to", "stops"]
+        )
+
+        if response_status_code != 200:
+            print(response_message.get("details"))
+            return
+
+        self.location_index.apply_refresh(
+            [
+                (ride_id, booking.get_stops(ride_data))
+                for ride_id, ride_data in response_message.get("rides")
+            ],
+            response_message.get("latest")
+        )
+
+    def start_leader_duties(self):
+        """
+        Called when this process becomes the leader. Reloads every ride into the expiry
+        scheduler from scratch, since rides may have changed while another process led.
+        """
+        print(f"{self.leader_lease.holder_id} is now the scheduler leader")
+        self.ride_expiry_scheduler.clear()
+        self.ride_expiry_scheduler.start()
+        self.scheduler.modify_job("sync_ride_expiries", next_run_time=datetime.now())
+
+    def stop_leader_duties(self):
+        """
+        Called when this process loses the leadership.
+        """
+        print(f"{self.leader_lease.holder_id} is no longer the scheduler leader")
+        self.ride_expiry_scheduler.stop()
+        self.ride_expiry_scheduler.clear()
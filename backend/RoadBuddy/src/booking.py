@@ -0,0 +1,126 @@
+from datetime import datetime
+import pytz
+from segment_tree import SegmentTree
+
+
+def get_stops(ride_data):
+    """
+    Ordered stops of a ride. Rides posted before multi-stop support have two.
+    """
+    return ride_data.get("stops") or [ride_data.get("from"), ride_data.get("to")]
+
+
+def get_segment_seats(ride_data):
+    """
+    Number of booked seats on each segment between consecutive stops.
+    """
+    segment_count = len(get_stops(ride_data)) - 1
+    segment_seats = ride_data.get("segmentSeats")
+    if segment_seats is None or len(segment_seats) != segment_count:
+        passengers = ride_data.get("currentPassengers") or []
+        segment_seats = [len(passengers)] * segment_count
+    return segment_seats
+
+
+def resolve_leg(ride_data, from_stop=None, to_stop=None):
+    """
+    Validate a leg given as stop indexes, defaulting to the whole ride.
+    Returns (from_stop, to_stop) or None if the leg is invalid.
+    """
+    last_stop = len(get_stops(ride_data)) - 1
+    try:
+        from_stop = 0 if from_stop is None else int(from_stop)
+        to_stop = last_stop if to_stop is None else int(to_stop)
+    except (TypeError, ValueError):
+        return None
+
+    if not 0 <= from_stop < to_stop <= last_stop:
+        return None
+    return from_stop, to_stop
+
+
+def has_free_seat(ride_data, from_stop, to_stop, seat_tree=None, seats=1):
+    """
+    Check whether ``seats`` seats are free on every segment of the leg, in O(log n)
+    once the tree is built.
+    """
+    seat_tree = seat_tree or SegmentTree(get_segment_seats(ride_data))
+    max_passengers = int(ride_data.get("maxPassengers", 0))
+    return seat_tree.range_max(from_stop, to_stop) + seats <= max_passengers
+
+
+def departure_datetime(ride_data):
+    """
+    Departure time of a ride as a timezone-aware Pacific datetime.
+    """
+    pacific_zone = pytz.timezone("America/Los_Angeles")
+    ride_datetime = datetime.strptime(
+        f"{ride_data['date']} {ride_data['departureTime']}", "%Y-%m-%d %I:%M %p"
+    )
+    return pacific_zone.localize(ride_datetime)
+
+
+def has_departed(ride_data):
+    """
+    Check whether the ride's departure time has already passed.
+    """
+    departure = departure_datetime(ride_data)
+    return departure <= datetime.now(departure.tzinfo)
+
+
+def normalize_booking_items(items, max_items=10):
+    """
+    Validate a list of {rideId, seats, fromStop, toStop} booking items.
+    Returns (items, None) or (None, error message).
+    """
+    if not isinstance(items, list) or not items:
+        return None, "items must be a non-empty list"
+
+    if len(items) > max_items:
+        return None, f"At most {max_items} rides can be booked at once"
+
+    normalized = []
+    for item in items:
+        if not isinstance(item, dict) or not str(item.get("rideId") or "").strip():
+            return None, "Every item needs a rideId"
+        try:
+            seats = int(item.get("seats", 1))
+        except (TypeError, ValueError):
+            return None, "seats must be a number"
+        if seats < 1:
+            return None, "seats must be at least 1"
+        normalized.append({
+            "rideId": str(item["rideId"]).strip(),
+            "seats": seats,
+            "fromStop": item.get("fromStop"),
+            "toStop": item.get("toStop"),
+        })
+
+    if len({item["rideId"] for item in normalized}) != len(normalized):
+        return None, "Each ride can only appear once"
+
+    return normalized, None
+
+
+def payment_sheet_error(ride_data, user_id, refund, from_stop=None, to_stop=None):
+    """
+    Check that the user can pay for a seat on the ride, or be refunded for one.
+    Returns an error message, or None.
+    """
+    if ride_data["ownerID"] == user_id and not refund:
+        return "User cannot book its own ride."
+
+    leg = resolve_leg(ride_data, from_stop, to_stop)
+    if leg is None:
+        return "Invalid stops for this ride."
+
+    if not has_free_seat(ride_data, *leg) and not refund:
+        return "Ride is full"
+
+    if has_departed(ride_data):
+        return "This ride is no longer available."
+
+    if user_id in (ride_data["currentPassengers"] or []) and not refund:
+        return "User already a passenger of this ride."
+
+    return None
@@ -0,0 +1,149 @@
+from flask import Blueprint, request, jsonify
+from clients import db
+from concurrency import gather
+from serialization import conditional_json
+from session_auth import auth_required, get_user_id, get_user_name
+from streaming import stream_response
+from utils import parse_fields
+from services.chat_messages_manager import ChatMessagesManager
+from services.ride_chat_manager import RideChatManager, RIDE_CHAT_FIELDS
+from services.user_manager import UserManager
+
+# Ride chat endpoints that only read. Sending a message stays in app.py with the other
+# writes that stage outbox tasks.
+chat_routes = Blueprint("chat_routes", __name__)
+
+
+def message_etag(ride_chat_id, message_version):
+    """
+    ETag of a chat's message list, from the id of its newest message.
+    """
+    return f"{ride_chat_id}-m{message_version}"
+
+
+@chat_routes.route('/api/get-messages/<ride_chat_id>', methods=['GET'])
+@auth_required
+def api_get_messages(ride_chat_id):
+    """
+    Fetch all messages from a rideChat.
+    """
+    user_id = get_user_id()
+    user_name = get_user_name()
+
+    # The chat and its message version are read concurrently. The version is read
+    # before the messages, so the ETag never names a newer version than the messages
+    # returned. A client that already has this version gets a 304 without the messages
+    # being loaded.
+    ride_chat_manager = RideChatManager(db, user_id, user_name)
+    chat_message_manager = ChatMessagesManager(db, ride_chat_id, user_id, user_name)
+    ride_chat_response, version_response = gather(
+        ride_chat_manager.get_ride_chat_details_async(ride_chat_id),
+        chat_message_manager.get_message_version_async()
+    )
+    ride_chat_response_message, ride_chat_response_status_code = ride_chat_response
+    version_response_message, version_response_status_code = version_response
+
+    if ride_chat_response_status_code != 200:
+        return jsonify(ride_chat_response_message), ride_chat_response_status_code
+
+    if version_response_status_code != 200:
+        return jsonify(version_response_message), version_response_status_code
+
+    etag = message_etag(ride_chat_id, version_response_message.get("messageVersion"))
+    if request.if_none_match.contains(etag):
+        return conditional_json({}, etag)
+
+    chat_message_response_message, chat_message_response_status_code = (
+        chat_message_manager.stream_messages_sorted_by_timestamp_asc()
+    )
+
+    if chat_message_response_status_code != 200:
+        return jsonify(chat_message_response_message), chat_message_response_status_code
+
+    response = stream_response(
+        "messages", chat_message_response_message.get("messages"), as_object=True
+    )
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@chat_routes.route('/api/get-messages/<ride_chat_id>/version', methods=['GET'])
+@auth_required
+def api_get_messages_version(ride_chat_id):
+    """
+    Cheap poll for new messages: returns the chat's message version and the ETag that
+    get-messages would return, without loading the messages.
+    """
+    user_id = get_user_id()
+    user_name = get_user_name()
+
+    ride_chat_manager = RideChatManager(db, user_id, user_name)
+    ride_chat_response_message, ride_chat_response_status_code = (
+        ride_chat_manager.get_ride_chat_details(ride_chat_id)
+    )
+
+    if ride_chat_response_status_code != 200:
+        return jsonify(ride_chat_response_message), ride_chat_response_status_code
+
+    chat_message_manager = ChatMessagesManager(db, ride_chat_id, user_id, user_name)
+    version_response_message, version_response_status_code = (
+        chat_message_manager.get_message_version()
+    )
+
+    if version_response_status_code != 200:
+        return jsonify(version_response_message), version_response_status_code
+
+    message_version = version_response_message.get("messageVersion")
+    return conditional_json(
+        {"messageVersion": message_version}, message_etag(ride_chat_id, message_version)
+    )
+
+
+@chat_routes.route('/api/check-ride-chat/<ride_chat_id>', methods=['GET'])
+@auth_required
+def api_check_ride_chat(ride_chat_id):
+    """
+    Check if a rideChat document exists.
+    """
+    user_id = get_user_id()
+    user_name = get_user_name()
+
+    ride_chat_manager = RideChatManager(db, user_id, user_name)
+    ride_chat_response = ride_chat_manager.get_ride_chat_details(ride_chat_id)
+    response_status_code = ride_chat_response[1]
+
+    if response_status_code != 200:
+        return jsonify({"exists": False, "error": "Ride chat not found"}), 404
+
+    return conditional_json(
+        {"exists": True}, f"{ride_chat_id}-{ride_chat_response[0].get('version')}"
+    )
+
+
+@chat_routes.route('/api/get-all-user-ride-chats', methods=['GET'])
+@auth_required
+def api_get_all_user_ride_chats():
+    """
+    Fetch all the ride chats for the user. ``fields`` optionally limits each chat to a
+    comma-separated list of fields.
+    """
+    fields, fields_error = parse_fields(request.args.get('fields'), RIDE_CHAT_FIELDS)
+    if fields_error:
+        return jsonify(fields_error[0]), fields_error[1]
+
+    user_id = get_user_id()
+
+    user_manager = UserManager(db, user_id)
+    response = user_manager.get_user_ride()
+    ride_ids = response[0].get("rides")
+
+    ride_chat_manager = RideChatManager(db, user_id, get_user_name())
+    ride_chat_response_message, ride_chat_response_status_code = (
+        ride_chat_manager.get_all_user_ride_chats(ride_ids, fields)
+    )
+
+    if ride_chat_response_status_code != 200:
+        return jsonify(ride_chat_response_message), ride_chat_response_status_code
+
+    return stream_response("ride_chats", ride_chat_response_message.get("ride_chats"))
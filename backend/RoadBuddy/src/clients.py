@@ -0,0 +1,18 @@
+import firebase_admin
+from firebase_admin import credentials, firestore
+from metrics import FirestoreMetrics
+from resilience import Resilience
+from tracing import Tracer, record as record_span
+
+cred = credentials.Certificate("../config/firebase-config.json")
+firebase_admin.initialize_app(cred)
+
+# Traces each request's manager calls.
+tracer = Tracer()
+
+# Counts and times every Firestore call, per endpoint and manager method.
+firestore_metrics = FirestoreMetrics(on_call=record_span)
+
+# Firestore client shared by the app, its blueprints and the background jobs. Calls
+# go through deadlines, retries and the circuit breaker, then through the metrics.
+db = firestore_metrics.instrument(Resilience().wrap(firestore.client()))
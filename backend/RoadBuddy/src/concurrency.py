@@ -0,0 +1,57 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+
+# Threads shared by every request for overlapping independent I/O calls.
+IO_POOL_WORKERS = int(os.getenv("IO_POOL_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=IO_POOL_WORKERS, thread_name_prefix="io-pool")
+_local = threading.local()
+
+
+def _run_in_pool(fn, args, kwargs):
+    _local.in_pool = True
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _local.in_pool = False
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Run ``fn(*args, **kwargs)`` on the shared I/O pool and return its Future.
+
+    Calls made from a pool thread run inline instead: a pool thread waiting on work
+    queued behind it in the same bounded pool could otherwise deadlock. The call sees
+    the caller's context variables, such as the request its metrics are attributed to.
+    """
+    if getattr(_local, "in_pool", False):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return _executor.submit(contextvars.copy_context().run, _run_in_pool, fn, args, kwargs)
+
+
+def gather(*futures, timeout=None):
+    """
+    Wait for every future and return their results in order.
+
+    If one fails, the futures that have not started yet are cancelled and its
+    exception is raised. Raises TimeoutError if they are not all done in ``timeout``
+    seconds.
+    """
+    done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+
+    failed = [future for future in futures if future in done and future.exception()]
+    if failed or not_done:
+        for future in not_done:
+            future.cancel()
+        if failed:
+            raise failed[0].exception()
+        raise TimeoutError(f"{len(not_done)} call(s) did not finish in {timeout}s")
+
+    return [future.result() for future in futures]
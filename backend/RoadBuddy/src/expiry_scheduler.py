@@ -0,0 +1,178 @@
+import heapq
+import threading
+import time
+
+# Seconds to wait before retrying keys whose expiry callback failed. The delay doubles
+# with each failure of the same key.
+RETRY_DELAY = 60
+
+# Failed callbacks after which a key is dropped. The hourly past-ride sweep is the
+# fallback for those.
+MAX_RETRIES = 5
+
+
+class ExpiryScheduler:
+    """
+    Calls ``on_expire(keys)`` as close as possible to each key's expiry time.
+    ``synced_until`` is free for the owner to record how far it has loaded keys.
+
+    Expiry times live in a min-heap, so the worker thread only ever looks at the
+    earliest deadline and sleeps until it is due. Rescheduled and cancelled keys leave
+    stale heap entries behind; they are skipped when popped and the heap is compacted
+    once stale entries outnumber live ones.
+
+    Keys whose callback fails are retried with exponential backoff, at most
+    ``MAX_RETRIES`` times.
+    """
+
+    def __init__(self, on_expire):
+        """
+        Initialize the ExpiryScheduler.
+        """
+        self.on_expire = on_expire
+        self.heap = []
+        self.deadlines = {}
+        self.failures = {}
+        self.synced_until = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def __len__(self):
+        with self.condition:
+            return len(self.deadlines)
+
+    def schedule(self, key, expires_at):
+        """
+        Schedule (or reschedule) ``key`` to expire at UNIX time ``expires_at``.
+        """
+        with self.condition:
+            if self.deadlines.get(key) == expires_at:
+                return
+            self.deadlines[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, key))
+            if self.heap[0] == (expires_at, key):
+                self.condition.notify()
+
+    def schedule_many(self, items):
+        """
+        Schedule several (key, expires_at) pairs at once.
+        """
+        with self.condition:
+            for key, expires_at in items:
+                if self.deadlines.get(key) != expires_at:
+                    self.deadlines[key] = expires_at
+                    self.heap.append((expires_at, key))
+            heapq.heapify(self.heap)
+            self.condition.notify()
+
+    def cancel(self, key):
+        """
+        Stop tracking ``key``. Its heap entry is dropped lazily.
+        """
+        with self.condition:
+            self.deadlines.pop(key, None)
+            self.failures.pop(key, None)
+            if len(self.heap) > 2 * len(self.deadlines) + 64:
+                self.heap = [(t, k) for k, t in self.deadlines.items()]
+                heapq.heapify(self.heap)
+
+    def clear(self):
+        """
+        Forget every scheduled key and reset ``synced_until``.
+        """
+        with self.condition:
+            self.heap = []
+            self.deadlines = {}
+            self.failures = {}
+            self.synced_until = None
+            self.condition.notify()
+
+    def pop_expired(self):
+        """
+        Remove and return every key whose deadline has passed.
+        """
+        now = time.time()
+        expired = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) == expires_at:
+                    del self.deadlines[key]
+                    expired.append(key)
+        return expired
+
+    def _seconds_until_next(self):
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.time(), 0)
+
+    def retry_later(self, keys, error):
+        """
+        Reschedule ``keys`` after their callback failed, backing off per key. Keys that
+        have failed ``MAX_RETRIES`` times are dropped.
+        """
+        now = time.time()
+        with self.condition:
+            for key in keys:
+                if key in self.deadlines:
+                    # Rescheduled while the callback ran.
+                    continue
+                attempts = self.failures.get(key, 0) + 1
+                if attempts > MAX_RETRIES:
+                    print(f"Giving up expiring {key} after {MAX_RETRIES} retries: {error}")
+                    self.failures.pop(key, None)
+                    continue
+                self.failures[key] = attempts
+                delay = RETRY_DELAY * 2 ** (attempts - 1)
+                print(f"Expiry callback for {key} failed, retrying in {delay}s: {error}")
+                self.deadlines[key] = now + delay
+                heapq.heappush(self.heap, (now + delay, key))
+            self.condition.notify()
+
+    def _run(self):
+        worker = threading.current_thread()
+        while True:
+            with self.condition:
+                while self.thread is worker:
+                    timeout = self._seconds_until_next()
+                    if timeout == 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.thread is not worker:
+                    return
+
+            expired = self.pop_expired()
+            if not expired:
+                continue
+            try:
+                self.on_expire(expired)
+            except Exception as e:
+                self.retry_later(expired, e)
+                continue
+            with self.condition:
+                for key in expired:
+                    self.failures.pop(key, None)
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self._run, name="expiry-scheduler", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stop the worker thread.
+        """
+        with self.condition:
+            thread, self.thread = self.thread, None
+            self.condition.notify()
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,74 @@
+import functools
+
+# Kind of Firestore object returned by each builder method.
+RETURNED_KINDS = {
+    "collection": "collection",
+    "document": "document",
+    "batch": "batch",
+    "transaction": "transaction",
+    "where": "collection",
+    "order_by": "collection",
+    "limit": "collection",
+    "limit_to_last": "collection",
+    "offset": "collection",
+    "select": "collection",
+    "start_at": "collection",
+    "start_after": "collection",
+    "end_at": "collection",
+    "end_before": "collection",
+}
+
+
+def wrap_result(result, handler, name):
+    """
+    Wrap what a builder method returned (a collection, query, document, batch or
+    transaction) so its calls go through ``handler`` too. Other results are returned
+    as they are.
+    """
+    kind = RETURNED_KINDS.get(name)
+    return FirestoreProxy(result, handler, kind) if kind else result
+
+
+def unwrap(value):
+    """
+    The object behind a proxy (one layer of it), also inside a list or tuple, so it
+    can be handed back to the client it came from.
+    """
+    if isinstance(value, FirestoreProxy):
+        return object.__getattribute__(value, "_target")
+    if isinstance(value, (list, tuple)) and any(isinstance(v, FirestoreProxy) for v in value):
+        return [unwrap(v) for v in value]
+    return value
+
+
+class FirestoreProxy:
+    """
+    Proxy for a Firestore object. Its method calls go through
+    ``handler.call(kind, name, method, *args, **kwargs)``, where ``kind`` is "client",
+    "collection", "document", "batch" or "transaction". Proxies can be layered, one
+    handler wrapping the client another has wrapped.
+    """
+    __slots__ = ("_target", "_handler", "_kind")
+
+    def __init__(self, target, handler, kind):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_handler", handler)
+        object.__setattr__(self, "_kind", kind)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        return functools.partial(self._handler.call, self._kind, name, value)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __eq__(self, other):
+        return self._target == unwrap(other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+    def __repr__(self):
+        return f"<{type(self._handler).__name__} proxy {self._target!r}>"
@@ -0,0 +1,299 @@
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import request, jsonify, make_response
+from google.api_core import exceptions as api_exceptions
+
+# How long a key's response is replayed for. Give the idempotency_keys collection a
+# Firestore TTL policy on expiresAt so expired keys are deleted.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
+# A key claimed longer ago than this without a response is taken to be abandoned by
+# a worker that died, and can be claimed again.
+IN_PROGRESS_SECONDS = int(os.getenv("IDEMPOTENCY_IN_PROGRESS_SECONDS", "30"))
+
+# Responses kept in this process. The least recently used are dropped first.
+MEMORY_ENTRIES = int(os.getenv("IDEMPOTENCY_MEMORY_ENTRIES", "10000"))
+
+# Longest key accepted in the Idempotency-Key header.
+MAX_KEY_LENGTH = 255
+
+
+class StoredResponse:
+    """
+    A response kept for replay, with the fingerprint of the request that produced it.
+    """
+    __slots__ = ("status", "mimetype", "body", "fingerprint", "expires_at")
+
+    def __init__(self, status, mimetype, body, fingerprint, expires_at):
+        self.status = status
+        self.mimetype = mimetype
+        self.body = body
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+
+    def to_document(self):
+        """
+        Firestore fields of a completed key. The body is stored compressed.
+        """
+        return {
+            "status": "completed",
+            "responseStatus": self.status,
+            "mimetype": self.mimetype,
+            "body": zlib.compress(self.body),
+            "fingerprint": self.fingerprint,
+            "expiresAt": datetime.fromtimestamp(self.expires_at, timezone.utc),
+        }
+
+    @staticmethod
+    def from_document(document):
+        """
+        StoredResponse of a completed key's Firestore fields.
+        """
+        return StoredResponse(
+            document["responseStatus"],
+            document["mimetype"],
+            zlib.decompress(document["body"]),
+            document["fingerprint"],
+            document["expiresAt"].timestamp(),
+        )
+
+    def replay(self):
+        """
+        The stored response, marked as a replay.
+        """
+        response = make_response(self.body, self.status)
+        response.mimetype = self.mimetype
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+
+class MemoryTier:
+    """
+    Stored responses kept in this process, up to ``entries`` of them. The least
+    recently used are dropped first.
+    """
+
+    def __init__(self, entries=MEMORY_ENTRIES):
+        """
+        Initialize an empty MemoryTier.
+        """
+        self.entries = entries
+        self.responses = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, scope):
+        """
+        The unexpired stored response of a key, or None.
+        """
+        with self.lock:
+            stored = self.responses.get(scope)
+            if stored is None:
+                return None
+            if stored.expires_at <= time.time():
+                del self.responses[scope]
+                return None
+            self.responses.move_to_end(scope)
+            return stored
+
+    def put(self, scope, stored):
+        """
+        Keep a stored response.
+        """
+        with self.lock:
+            self.responses[scope] = stored
+            self.responses.move_to_end(scope)
+            while len(self.responses) > self.entries:
+                self.responses.popitem(last=False)
+
+
+class Idempotency:
+    """
+    Idempotency is a view decorator that makes POSTs sent with an Idempotency-Key
+    header safe to retry: the first request with a key runs, and later requests from
+    the same user to the same endpoint with that key get its response replayed
+    instead of running again.
+
+    Responses are kept in two tiers: a bounded in-process LRU, and the
+    ``idempotency_keys`` collection shared by every worker. A retry costs one
+    Firestore read at most, and none if it reaches the worker that ran the original.
+
+    Concurrent requests with the same key are serialized within a process. Across
+    processes, the first to claim the key runs and the others get 409 with a
+    Retry-After until it finishes. A key reused with a different body gets 422.
+    Responses with a 5xx status are not stored, so the client can retry them. If the
+    store cannot be reached the request runs without idempotency.
+
+    ``admit``, if given, is called only for requests that will run, after the stored
+    responses have been checked. It returns None to let the request run, or a response
+    to send instead, which is not stored. This is how keyed requests are rate limited
+    without charging replays.
+    """
+
+    def __init__(self, db, get_user_id, admit=None, ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+                 memory_entries=MEMORY_ENTRIES):
+        """
+        Initialize the Idempotency decorator.
+        """
+        self.db = db
+        self.get_user_id = get_user_id
+        self.admit = admit
+        self.ttl_seconds = ttl_seconds
+        self.memory = MemoryTier(memory_entries)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    @property
+    def key_ref(self):
+        """
+        The ``idempotency_keys`` collection.
+        """
+        return self.db.collection("idempotency_keys")
+
+    def __call__(self, view):
+        """
+        Decorate a view.
+        """
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get("Idempotency-Key")
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": "Idempotency-Key is too long."}), 400
+
+            scope = hashlib.sha256(
+                f"{self.get_user_id()}\0{request.endpoint}\0{key}".encode("utf-8")
+            ).hexdigest()
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+            with self._key_lock(scope):
+                return self._handle(scope, fingerprint, lambda: view(*args, **kwargs))
+
+        decorated_function.idempotent = True
+        return decorated_function
+
+    def _handle(self, scope, fingerprint, run):
+        stored = self.memory.get(scope)
+        claimed = False
+        if stored is None:
+            try:
+                stored, claimed = self._claim(scope, fingerprint)
+            except Exception as e:
+                print(f"Idempotency store unavailable, running request without it: {e}")
+                rejection = self.admit() if self.admit else None
+                return run() if rejection is None else rejection
+
+        if stored == "in_progress":
+            response = jsonify({"error": "A request with this Idempotency-Key is in progress."})
+            response.headers["Retry-After"] = "1"
+            return response, 409
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                return jsonify({
+                    "error": "Idempotency-Key was already used with a different request."
+                }), 422
+            return stored.replay()
+
+        rejection = self.admit() if self.admit else None
+        if rejection is not None:
+            self._release(scope, claimed)
+            return rejection
+
+        try:
+            response = make_response(run())
+        except Exception:
+            self._release(scope, claimed)
+            raise
+
+        if response.status_code >= 500 or response.is_streamed:
+            self._release(scope, claimed)
+            return response
+
+        stored = StoredResponse(
+            response.status_code, response.mimetype, response.get_data(), fingerprint,
+            time.time() + self.ttl_seconds,
+        )
+        self.memory.put(scope, stored)
+        try:
+            self.key_ref.document(scope).set(stored.to_document())
+        except Exception as e:
+            print(f"Failed to store idempotent response: {e}")
+        return response
+
+    def _claim(self, scope, fingerprint):
+        """
+        Look the key up in Firestore and claim it if it is free. Returns the stored
+        response, "in_progress" or None, and whether this request claimed the key.
+        """
+        key_doc_ref = self.key_ref.document(scope)
+        now = datetime.now(timezone.utc)
+        snapshot = key_doc_ref.get()
+        if snapshot.exists:
+            document = snapshot.to_dict()
+            if document.get("expiresAt") and document["expiresAt"] > now:
+                if document.get("status") == "completed":
+                    stored = StoredResponse.from_document(document)
+                    self.memory.put(scope, stored)
+                    return stored, False
+                return "in_progress", False
+
+        claim = {
+            "status": "in_progress",
+            "fingerprint": fingerprint,
+            "expiresAt": now + timedelta(seconds=IN_PROGRESS_SECONDS),
+        }
+        try:
+            if snapshot.exists:
+                # An expired or abandoned claim: take it over unless someone else did.
+                key_doc_ref.update(claim, option=self.db.write_option(
+                    last_update_time=snapshot.update_time
+                ))
+            else:
+                key_doc_ref.create(claim)
+        except (api_exceptions.Conflict, api_exceptions.FailedPrecondition):
+            return "in_progress", False
+        return None, True
+
+    def _release(self, scope, claimed):
+        # Let the client retry a request that failed.
+        if not claimed:
+            return
+        try:
+            self.key_ref.document(scope).delete()
+        except Exception as e:
+            print(f"Failed to release idempotency key: {e}")
+
+    def _key_lock(self, scope):
+        with self.lock:
+            entry = self.key_locks.get(scope)
+            if entry is None:
+                entry = self.key_locks[scope] = [threading.Lock(), 0]
+            entry[1] += 1
+        return _KeyLock(self, scope, entry)
+
+
+class _KeyLock:
+    """
+    Holds one key's lock, and drops the lock when no request is using it.
+    """
+
+    def __init__(self, idempotency, scope, entry):
+        self.idempotency = idempotency
+        self.scope = scope
+        self.entry = entry
+
+    def __enter__(self):
+        self.entry[0].acquire()
+
+    def __exit__(self, *exc_info):
+        self.entry[0].release()
+        with self.idempotency.lock:
+            self.entry[1] -= 1
+            if not self.entry[1]:
+                del self.idempotency.key_locks[self.scope]
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+
+class JobMetrics:
+    """
+    Per-job run counters for the background jobs of this process.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty JobMetrics.
+        """
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def _job(self, name):
+        return self.jobs.setdefault(name, {
+            "runs": 0,
+            "failures": 0,
+            "skipped": 0,
+            "lastStartedAt": None,
+            "lastSucceededAt": None,
+            "lastDurationSeconds": None,
+            "totalDurationSeconds": 0.0,
+            "lastError": None,
+        })
+
+    def record_skip(self, name):
+        """
+        Count a run skipped because this process is not allowed to run the job.
+        """
+        with self.lock:
+            self._job(name)["skipped"] += 1
+
+    def record_run(self, name, started_at, duration, error=None):
+        """
+        Record one finished run of a job.
+        """
+        with self.lock:
+            job = self._job(name)
+            job["runs"] += 1
+            job["lastStartedAt"] = started_at.isoformat()
+            job["lastDurationSeconds"] = round(duration, 3)
+            job["totalDurationSeconds"] = round(job["totalDurationSeconds"] + duration, 3)
+            if error is None:
+                job["lastSucceededAt"] = datetime.now(timezone.utc).isoformat()
+            else:
+                job["failures"] += 1
+                job["lastError"] = str(error)
+
+    def track(self, name, job, should_run=None):
+        """
+        Wrap ``job`` so every call is recorded under ``name``. When ``should_run`` is
+        given, calls for which it returns False are skipped and counted as such.
+        Exceptions are recorded and re-raised.
+        """
+        @wraps(job)
+        def tracked_job(*args, **kwargs):
+            if should_run is not None and not should_run():
+                self.record_skip(name)
+                return None
+
+            started_at = datetime.now(timezone.utc)
+            started = time.perf_counter()
+            try:
+                result = job(*args, **kwargs)
+            except Exception as e:
+                self.record_run(name, started_at, time.perf_counter() - started, e)
+                raise
+            self.record_run(name, started_at, time.perf_counter() - started)
+            return result
+
+        return tracked_job
+
+    def snapshot(self):
+        """
+        Copy of the metrics of every job that has been called so far.
+        """
+        with self.lock:
+            return {name: dict(job) for name, job in self.jobs.items()}
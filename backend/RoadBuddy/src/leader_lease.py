@@ -0,0 +1,116 @@
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+
+class LeaderLease:
+    """
+    Leader election through a lease document in Firestore.
+
+    Every process calls ``try_acquire`` every ``ttl / 3`` seconds. The process named in
+    the lease document holds leadership until ``expiresAt`` and renews it on each call;
+    any other process may take the lease over once it has expired. A leader that fails
+    to renew steps down locally before its lease can expire on the server, so two
+    processes never both believe they lead.
+    """
+
+    def __init__(self, db, name, ttl_seconds=15, on_elected=None, on_demoted=None):
+        """
+        Initialize the LeaderLease.
+        """
+        self.db = db
+        self.lease_ref = db.collection("scheduler_leases").document(name)
+        self.holder_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.ttl_seconds = ttl_seconds
+        self.callbacks = {"elected": on_elected, "demoted": on_demoted}
+        self.valid_until = 0.0
+
+    def is_leader(self):
+        """
+        Whether this process currently holds the lease.
+        """
+        return time.monotonic() < self.valid_until
+
+    def try_acquire(self):
+        """
+        Take or renew the lease if it is free, expired or already ours.
+        Returns True if this process holds the lease afterwards.
+        """
+        started = time.monotonic()
+
+        @firestore.transactional
+        def acquire(transaction):
+            """
+            Write ourselves into the lease document unless another holder is live.
+            """
+            snapshot = self.lease_ref.get(transaction=transaction)
+            lease = snapshot.to_dict() if snapshot.exists else {}
+            now = datetime.now(timezone.utc)
+
+            holder = lease.get("holder")
+            expires_at = lease.get("expiresAt")
+            if holder not in (None, self.holder_id) and expires_at and expires_at > now:
+                return False
+
+            transaction.set(self.lease_ref, {
+                "holder": self.holder_id,
+                "expiresAt": now + timedelta(seconds=self.ttl_seconds),
+                "renewedAt": now,
+                "acquiredAt": lease.get("acquiredAt") if holder == self.holder_id else now,
+            })
+            return True
+
+        try:
+            acquired = acquire(self.db.transaction())
+        except Exception as e:
+            print(f"Leader lease renewal failed: {e}")
+            acquired = False
+
+        was_leader = self.is_leader()
+        if acquired:
+            # Stay one renewal interval short of the server-side expiry.
+            self.valid_until = started + self.ttl_seconds * 2 / 3
+        elif not was_leader:
+            self.valid_until = 0.0
+
+        if acquired and not was_leader:
+            self._notify("elected")
+        elif was_leader and not self.is_leader():
+            self._notify("demoted")
+
+        return acquired
+
+    def release(self):
+        """
+        Give up the lease so another process can take over immediately.
+        """
+        was_leader = self.is_leader()
+        self.valid_until = 0.0
+
+        @firestore.transactional
+        def release_lease(transaction):
+            """
+            Delete the lease document if we still hold it.
+            """
+            snapshot = self.lease_ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.get("holder") == self.holder_id:
+                transaction.delete(self.lease_ref)
+
+        try:
+            release_lease(self.db.transaction())
+        except Exception as e:
+            print(f"Leader lease release failed: {e}")
+
+        if was_leader:
+            self._notify("demoted")
+
+    def _notify(self, event):
+        callback = self.callbacks.get(event)
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Leader lease {event} callback failed: {e}")
@@ -0,0 +1,89 @@
+import bisect
+import heapq
+import threading
+from collections import Counter
+from routing import normalize_place
+
+
+class LocationIndex:
+    """
+    In-memory prefix index of place names seen in rides.
+
+    Normalized names are kept in a sorted list, so every name starting with a prefix
+    sits in one contiguous slice found with two binary searches. Each name remembers
+    how often it was seen and its most common spelling, which is what gets suggested.
+    The whole slice is ranked with a bounded heap, so short prefixes cost
+    O(matches * log(limit)) rather than a full sort.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty LocationIndex.
+        """
+        self.keys = []
+        self.spellings = {}
+        self.counts = Counter()
+        self.refreshed_until = None
+        self.local_ride_ids = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add(self, places):
+        for place in places:
+            if not isinstance(place, str):
+                continue
+            key = normalize_place(place)
+            if not key:
+                continue
+            spellings = self.spellings.get(key)
+            if spellings is None:
+                spellings = self.spellings[key] = Counter()
+                bisect.insort(self.keys, key)
+            spellings[" ".join(place.split())] += 1
+            self.counts[key] += 1
+
+    def add_posted_ride(self, ride_id, places):
+        """
+        Index the places of a ride posted by this process right away. The next refresh
+        will see the same ride and skip it.
+        """
+        with self.lock:
+            self.local_ride_ids.add(ride_id)
+            self._add(places)
+
+    def apply_refresh(self, rides, refreshed_until):
+        """
+        Index (ride_id, places) pairs for rides created since the last refresh.
+        """
+        with self.lock:
+            for ride_id, places in rides:
+                if ride_id in self.local_ride_ids:
+                    self.local_ride_ids.discard(ride_id)
+                    continue
+                self._add(places)
+            if refreshed_until is not None:
+                self.refreshed_until = refreshed_until
+
+    def suggest(self, prefix, limit=10):
+        """
+        Most frequently seen places whose normalized name starts with ``prefix``.
+        """
+        prefix = normalize_place(prefix)
+        if not prefix:
+            return []
+
+        with self.lock:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + "\uffff", lo=start)
+
+            ranked = heapq.nsmallest(
+                limit,
+                self.keys[start:end],
+                key=lambda key: (-self.counts[key], key)
+            )
+            return [
+                self.spellings[key].most_common(1)[0][0]
+                for key in ranked
+            ]
@@ -0,0 +1,211 @@
+import heapq
+
+INFINITY = float("inf")
+
+
+class _FlowGraph:
+    """
+    Residual graph for a min-cost flow problem, stored as flat edge arrays.
+    Edge ``e`` and its reverse edge ``e ^ 1`` are always added together.
+    """
+
+    def __init__(self, node_count):
+        self.node_count = node_count
+        self.adjacency = [[] for _ in range(node_count)]
+        self.to = []
+        self.capacity = []
+        self.cost = []
+
+    def add_edge(self, source, target, capacity, cost):
+        """
+        Add a directed edge and its zero-capacity reverse edge. Returns the edge index.
+        """
+        edge = len(self.to)
+        self.adjacency[source].append(edge)
+        self.to.append(target)
+        self.capacity.append(capacity)
+        self.cost.append(cost)
+
+        self.adjacency[target].append(edge + 1)
+        self.to.append(source)
+        self.capacity.append(0)
+        self.cost.append(-cost)
+        return edge
+
+    def _shortest_distances(self, source, potential):
+        """
+        Dijkstra over reduced costs. Returns the distance of every node.
+        """
+        distance = [INFINITY] * self.node_count
+        distance[source] = 0
+        heap = [(0, source)]
+
+        while heap:
+            dist_u, u = heapq.heappop(heap)
+            if dist_u > distance[u]:
+                continue
+            pot_u = potential[u]
+            for edge in self.adjacency[u]:
+                if self.capacity[edge] <= 0:
+                    continue
+                v = self.to[edge]
+                candidate = dist_u + self.cost[edge] + pot_u - potential[v]
+                if candidate < distance[v]:
+                    distance[v] = candidate
+                    heapq.heappush(heap, (candidate, v))
+
+        return distance
+
+    def _augment_tight_paths(self, source, sink, potential):
+        """
+        Push flow along every source->sink path made of zero reduced cost edges.
+        Every such path is a shortest path, so optimality is preserved.
+        """
+        pushed = 0
+        edge_pointer = [0] * self.node_count
+        on_path = [False] * self.node_count
+
+        while True:
+            path = []
+            node = source
+            on_path[source] = True
+
+            while node != sink:
+                adjacency = self.adjacency[node]
+                advanced = False
+                while edge_pointer[node] < len(adjacency):
+                    edge = adjacency[edge_pointer[node]]
+                    v = self.to[edge]
+                    if (
+                        self.capacity[edge] > 0
+                        and not on_path[v]
+                        and self.cost[edge] + potential[node] - potential[v] == 0
+                    ):
+                        path.append(edge)
+                        on_path[v] = True
+                        node = v
+                        advanced = True
+                        break
+                    edge_pointer[node] += 1
+
+                if advanced:
+                    continue
+
+                if not path:
+                    on_path[source] = False
+                    return pushed
+
+                # Dead end: retreat and skip the edge that led here.
+                on_path[node] = False
+                edge = path.pop()
+                node = self.to[edge ^ 1]
+                edge_pointer[node] += 1
+
+            amount = min(self.capacity[edge] for edge in path)
+            for edge in path:
+                self.capacity[edge] -= amount
+                self.capacity[edge ^ 1] += amount
+                on_path[self.to[edge]] = False
+            on_path[source] = False
+            pushed += amount
+
+    def min_cost_max_flow(self, source, sink):
+        """
+        Primal-dual min-cost max-flow. All edge costs must be non-negative.
+        Returns (flow, cost).
+        """
+        potential = [0] * self.node_count
+        flow = 0
+        total_cost = 0
+
+        while True:
+            distance = self._shortest_distances(source, potential)
+            if distance[sink] == INFINITY:
+                break
+
+            reachable_max = max(d for d in distance if d != INFINITY)
+            for node in range(self.node_count):
+                if distance[node] == INFINITY:
+                    potential[node] += reachable_max
+                else:
+                    potential[node] += distance[node]
+
+            pushed = self._augment_tight_paths(source, sink, potential)
+            flow += pushed
+            total_cost += pushed * (potential[sink] - potential[source])
+
+        return flow, total_cost
+
+
+def _connected_components(rider_count, candidates):
+    """
+    Group riders that compete for at least one common ride, using union-find.
+    Returns a list of rider index lists.
+    """
+    parent = list(range(rider_count))
+
+    def find(node):
+        """
+        Find the component root of a rider, compressing the path.
+        """
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    first_rider_of_ride = {}
+    for rider, options in enumerate(candidates):
+        for ride, _ in options:
+            other = first_rider_of_ride.setdefault(ride, rider)
+            root_a, root_b = find(rider), find(other)
+            if root_a != root_b:
+                parent[root_a] = root_b
+
+    components = {}
+    for rider, options in enumerate(candidates):
+        if options:
+            components.setdefault(find(rider), []).append(rider)
+
+    return list(components.values())
+
+
+def solve_assignment(candidates, seats):
+    """
+    Capacity-constrained rider-to-ride assignment.
+
+    ``candidates[r]`` is a list of (ride_index, cost) pairs - the sparse row of the
+    rider x ride cost matrix - and ``seats[k]`` is the number of free seats on ride ``k``.
+    Each rider gets at most one ride, no ride exceeds its seats, the number of assigned
+    riders is maximised and, among maximum assignments, the total cost is minimised.
+
+    Costs must be non-negative integers. Riders that share no candidate ride are solved
+    independently, so large inputs split into many small flow problems.
+
+    Returns a dict mapping rider index to ride index.
+    """
+    assignment = {}
+
+    for riders in _connected_components(len(candidates), candidates):
+        rides = sorted({ride for rider in riders for ride, _ in candidates[rider]})
+        ride_node = {ride: len(riders) + 1 + i for i, ride in enumerate(rides)}
+        source = 0
+        sink = len(riders) + len(rides) + 1
+        graph = _FlowGraph(sink + 1)
+
+        rider_edges = []
+        for i, rider in enumerate(riders):
+            graph.add_edge(source, i + 1, 1, 0)
+            for ride, cost in candidates[rider]:
+                edge = graph.add_edge(i + 1, ride_node[ride], 1, cost)
+                rider_edges.append((rider, ride, edge))
+
+        for ride in rides:
+            graph.add_edge(ride_node[ride], sink, seats[ride], 0)
+
+        graph.min_cost_max_flow(source, sink)
+
+        for rider, ride, edge in rider_edges:
+            if graph.capacity[edge] == 0:
+                assignment[rider] = ride
+
+    return assignment
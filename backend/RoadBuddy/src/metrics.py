@@ -0,0 +1,356 @@
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from tracing import measure_iter
+from firestore_proxy import FirestoreProxy, unwrap, wrap_result
+
+# Upper bounds, in seconds, of the Firestore call latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the per-request operation count histogram buckets.
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+OPERATIONS = ("read", "write", "delete", "streamed")
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services") + os.sep
+METRICS_FILE = os.path.abspath(__file__)
+
+# What each Firestore call costs. Writes staged on a batch or transaction are billed
+# when it commits, but counted when they are staged so they can be attributed.
+CALL_OPERATIONS = {
+    ("document", "get"): "read",
+    ("document", "set"): "write",
+    ("document", "create"): "write",
+    ("document", "update"): "write",
+    ("document", "delete"): "delete",
+    ("collection", "add"): "write",
+    ("collection", "get"): "streamed",
+    ("collection", "stream"): "streamed",
+    ("client", "get_all"): "read",
+    ("transaction", "get_all"): "read",
+    ("transaction", "get"): "read",
+    ("batch", "set"): "write",
+    ("batch", "create"): "write",
+    ("batch", "update"): "write",
+    ("batch", "delete"): "delete",
+    ("transaction", "set"): "write",
+    ("transaction", "create"): "write",
+    ("transaction", "update"): "write",
+    ("transaction", "delete"): "delete",
+}
+
+# Staged writes do not touch the network, so only these calls are timed.
+TIMED_CALLS = {
+    ("document", "get"), ("document", "set"), ("document", "create"),
+    ("document", "update"), ("document", "delete"), ("collection", "add"),
+    ("collection", "get"), ("collection", "stream"), ("client", "get_all"),
+    ("transaction", "get_all"), ("transaction", "get"), ("batch", "commit"),
+    ("transaction", "_commit"),
+}
+
+_endpoint = contextvars.ContextVar("firestore_metrics_endpoint", default="background")
+_request_totals = contextvars.ContextVar("firestore_metrics_request_totals", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+@functools.lru_cache(maxsize=None)
+def _is_service_file(filename):
+    return os.path.abspath(filename).startswith(SERVICES_DIR)
+
+
+def _qualname(frame):
+    # code.co_qualname is new in Python 3.11. Before it, a method's class is taken
+    # from its ``self``.
+    code = frame.f_code
+    qualname = getattr(code, "co_qualname", None)
+    if qualname is None:
+        instance = frame.f_locals.get("self")
+        qualname = (
+            code.co_name if instance is None else f"{type(instance).__name__}.{code.co_name}"
+        )
+    return qualname.split(".<locals>")[0]
+
+
+def _caller():
+    """
+    The manager method that made the current Firestore call, or the function that made
+    it if no manager is on the stack.
+    """
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    while frame is not None and os.path.abspath(frame.f_code.co_filename) == METRICS_FILE:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+
+    direct = frame
+    while frame is not None:
+        if _is_service_file(frame.f_code.co_filename):
+            return _qualname(frame)
+        frame = frame.f_back
+
+    module = direct.f_globals.get("__name__", "")
+    return f"{module}.{_qualname(direct)}"
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed buckets, one series per label set.
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        """
+        Initialize an empty Histogram.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        """
+        Record one observation. Callers hold the registry lock.
+        """
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self):
+        """
+        Lines of the Prometheus text format for this histogram.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (bucket_counts, total, count) in sorted(self.series.items()):
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), (*bucket_counts, count)):
+                le_label = f'le="{bound}"'
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.label_names, labels, le_label)} "
+                    f"{bucket_count}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Counter:
+    """
+    Prometheus-style counter, one series per label set.
+    """
+
+    def __init__(self, name, documentation, label_names):
+        """
+        Initialize an empty Counter.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        """
+        Add to a series. Callers hold the registry lock.
+        """
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def expose(self):
+        """
+        Lines of the Prometheus text format for this counter.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class RequestTotals:
+    """
+    Firestore operations made while handling one request.
+    """
+
+    def __init__(self, endpoint):
+        """
+        Initialize zeroed RequestTotals.
+        """
+        self.endpoint = endpoint
+        self.counts = dict.fromkeys(OPERATIONS, 0)
+        self.calls = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def header(self):
+        """
+        Summary of the totals for the debug response header.
+        """
+        with self.lock:
+            counts = ", ".join(f"{op}={count}" for op, count in self.counts.items())
+            return f"{counts}, calls={self.calls}, time_ms={self.seconds * 1000:.1f}"
+
+
+class FirestoreMetrics:
+    """
+    FirestoreMetrics counts the reads, writes, deletes and streamed documents of every
+    Firestore call and times it, attributed to the Flask endpoint and to the manager
+    method that made the call.
+
+    ``instrument(db)`` wraps a Firestore client. Everything reached from it
+    (collections, queries, documents, batches and transactions) is wrapped too, and
+    unwrapped again when handed back to the client, so the managers use it as they
+    would the client itself.
+
+    ``on_call(name, seconds)``, if given, is called with the latency of every timed
+    call, e.g. to add it to a request trace.
+    """
+
+    def __init__(self, on_call=None):
+        """
+        Initialize empty FirestoreMetrics.
+        """
+        self.on_call = on_call
+        self.lock = threading.Lock()
+        self.operations = Counter(
+            "firestore_operations_total",
+            "Firestore documents read, written, deleted or streamed.",
+            ("endpoint", "method", "operation"),
+        )
+        self.latency = Histogram(
+            "firestore_call_duration_seconds",
+            "Latency of Firestore calls.",
+            ("endpoint", "method", "call"),
+            LATENCY_BUCKETS,
+        )
+        self.per_request = Histogram(
+            "firestore_request_operations",
+            "Firestore operations per request.",
+            ("endpoint", "operation"),
+            COUNT_BUCKETS,
+        )
+
+    def instrument(self, db):
+        """
+        Wrap a Firestore client so every call made through it is counted.
+        """
+        return FirestoreProxy(db, self, "client")
+
+    def start_request(self, endpoint):
+        """
+        Attribute the Firestore calls made from now on in this context to ``endpoint``.
+        """
+        _endpoint.set(endpoint or "unknown")
+        _request_totals.set(RequestTotals(endpoint or "unknown"))
+
+    @staticmethod
+    def request_totals():
+        """
+        Totals of the request being handled in this context, or None.
+        """
+        return _request_totals.get()
+
+    def finish_request(self):
+        """
+        Record the operation counts of the request being handled in this context, and
+        attribute later calls in this context to background work again.
+        """
+        totals = _request_totals.get()
+        _endpoint.set("background")
+        if totals is None:
+            return
+        _request_totals.set(None)
+        with self.lock:
+            for operation, count in totals.counts.items():
+                self.per_request.observe((totals.endpoint, operation), count)
+
+    def record(self, method, call, operation, count, seconds=None):
+        """
+        Count ``count`` documents of ``operation`` and, if timed, the call latency.
+        """
+        endpoint = _endpoint.get()
+        if seconds is not None and self.on_call is not None:
+            self.on_call(f"firestore {call}", seconds)
+        with self.lock:
+            if operation and count:
+                self.operations.inc((endpoint, method, operation), count)
+            if seconds is not None:
+                self.latency.observe((endpoint, method, call), seconds)
+
+        totals = _request_totals.get()
+        if totals is not None:
+            with totals.lock:
+                if operation:
+                    totals.counts[operation] += count
+                if seconds is not None:
+                    totals.calls += 1
+                    totals.seconds += seconds
+
+    def call(self, kind, name, function, *args, **kwargs):
+        """
+        Call a Firestore method on behalf of a wrapped object, counting and timing it.
+        """
+        args = [unwrap(arg) for arg in args]
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+
+        operation = CALL_OPERATIONS.get((kind, name))
+        timed = (kind, name) in TIMED_CALLS
+        if operation is None and not timed:
+            return wrap_result(function(*args, **kwargs), self, name)
+
+        method = _caller()
+        call = f"{kind}.{name}"
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+
+        if hasattr(result, "__next__"):
+            return measure_iter(
+                result,
+                lambda count, seconds: self._record_documents(
+                    method, call, operation, count, seconds
+                ),
+                elapsed,
+            )
+
+        if operation in ("read", "streamed") and isinstance(result, list):
+            count = len(result)
+        else:
+            count = 1
+        self._record_documents(method, call, operation, count, elapsed if timed else None)
+        return result
+
+    def _record_documents(self, method, call, operation, count, seconds):
+        self.record(method, call, operation, count, seconds)
+        if operation == "streamed":
+            # A query is billed at least one read, even if it matches nothing.
+            self.record(method, call, "read", max(count, 1))
+
+    def expose(self):
+        """
+        Every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            lines = (
+                self.operations.expose() + self.latency.expose() + self.per_request.expose()
+            )
+        return "\n".join(lines) + "\n"
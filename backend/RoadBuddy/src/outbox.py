@@ -0,0 +1,176 @@
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+# Seconds a claimed task is hidden from other workers while its handler runs.
+CLAIM_TIMEOUT = 120
+
+# Retry delay after the first failure; it doubles with every further attempt.
+RETRY_BASE_DELAY = 5
+
+
+class Outbox:
+    """
+    Transactional outbox for the side effects of a primary write.
+
+    Tasks are staged as documents in the same batch or transaction as the primary
+    write, so they exist exactly when that write commits. Once it has committed the
+    caller dispatches them to a bounded pool of worker threads, and a periodic ``poll``
+    picks up tasks left behind by a full queue or a dead process.
+
+    Every task is claimed in a transaction before its handler runs, so concurrent
+    workers never run it twice at once; a crash after the handler finished can still
+    run it again, so handlers must be idempotent. Failures are retried with exponential
+    backoff and moved to ``outbox_dead_letters`` after ``max_attempts``.
+    """
+
+    def __init__(self, db, handlers, workers=4, max_attempts=5, queue_size=1000):
+        """
+        Initialize the Outbox. ``handlers`` maps a task type to a callable taking the
+        task payload; the task fails if it raises.
+        """
+        self.db = db
+        self.tasks_ref = db.collection("outbox")
+        self.dead_letters_ref = db.collection("outbox_dead_letters")
+        self.handlers = handlers
+        self.max_attempts = max_attempts
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = [
+            threading.Thread(target=self._work, name=f"outbox-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def stage(self, writer, task_type, payload):
+        """
+        Add a task to ``writer`` (a batch or transaction) and return its id.
+        """
+        task_ref = self.tasks_ref.document()
+        writer.set(task_ref, {
+            "type": task_type,
+            "payload": payload,
+            "attempts": 0,
+            "runAfter": datetime.now(timezone.utc),
+            "claimedUntil": None,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        })
+        return task_ref.id
+
+    def dispatch(self, task_ids):
+        """
+        Queue committed tasks for the worker pool. Tasks that do not fit in the queue
+        are left for the next poll.
+        """
+        for task_id in task_ids:
+            try:
+                self.queue.put_nowait(task_id)
+            except queue.Full:
+                print(f"Outbox queue is full, leaving task {task_id} for the poller")
+                return
+
+    def poll(self, limit=100):
+        """
+        Dispatch tasks that are due, oldest first.
+        """
+        due_tasks = (
+            self.tasks_ref
+            .where("runAfter", "<=", datetime.now(timezone.utc))
+            .order_by("runAfter")
+            .limit(limit)
+            .select([])
+            .stream()
+        )
+        self.dispatch([task.id for task in due_tasks])
+
+    def claim(self, task_id):
+        """
+        Mark a due, unclaimed task as claimed and return its data, or None if it is
+        gone, not due yet or claimed by another worker.
+        """
+        task_ref = self.tasks_ref.document(task_id)
+
+        @firestore.transactional
+        def claim_task(transaction):
+            """
+            Claim the task and count the attempt.
+            """
+            task_doc = task_ref.get(transaction=transaction)
+            if not task_doc.exists:
+                return None
+
+            task = task_doc.to_dict()
+            now = datetime.now(timezone.utc)
+            claimed_until = task.get("claimedUntil")
+            if task.get("runAfter") > now or (claimed_until and claimed_until > now):
+                return None
+
+            task["attempts"] = task.get("attempts", 0) + 1
+            transaction.update(task_ref, {
+                "attempts": task["attempts"],
+                "claimedUntil": now + timedelta(seconds=CLAIM_TIMEOUT),
+            })
+            return task
+
+        return claim_task(self.db.transaction())
+
+    def run(self, task_id):
+        """
+        Claim and run one task, then delete it, reschedule it or dead-letter it.
+        """
+        task = self.claim(task_id)
+        if task is None:
+            return
+
+        task_ref = self.tasks_ref.document(task_id)
+        try:
+            self.handlers[task.get("type")](task.get("payload"))
+        except Exception as e:
+            print(f"Outbox task {task_id} ({task.get('type')}) failed: {e}")
+            if task["attempts"] >= self.max_attempts:
+                batch = self.db.batch()
+                batch.set(self.dead_letters_ref.document(task_id), dict(
+                    task,
+                    claimedUntil=None,
+                    lastError=str(e),
+                    failedAt=firestore.SERVER_TIMESTAMP,
+                ))
+                batch.delete(task_ref)
+                batch.commit()
+            else:
+                delay = RETRY_BASE_DELAY * 2 ** (task["attempts"] - 1)
+                task_ref.update({
+                    "runAfter": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                    "claimedUntil": None,
+                    "lastError": str(e),
+                })
+            return
+
+        task_ref.delete()
+
+    def _work(self):
+        while True:
+            task_id = self.queue.get()
+            if task_id is None:
+                return
+            try:
+                self.run(task_id)
+            except Exception as e:
+                print(f"Outbox worker failed on task {task_id}: {e}")
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        for worker in self.workers:
+            if not worker.is_alive():
+                worker.start()
+
+    def stop(self):
+        """
+        Let the workers finish the queued tasks, then stop them.
+        """
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join()
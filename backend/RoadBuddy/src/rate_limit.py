@@ -0,0 +1,223 @@
+import math
+import os
+import threading
+import time
+from google.cloud import firestore
+
+# Where per-user buckets live: "memory" (this process only) or "firestore" (shared
+# by every worker, at the cost of a transaction per limited request).
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# Requests per second, and burst, that one process admits to the limited endpoints
+# as a whole. Lower-priority requests give up first as it runs out.
+GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL_RATE", "200"))
+GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "400"))
+
+# Share of the global bucket held back from each priority class, so that when the
+# process is overloaded payments are admitted after everything else is shed.
+PRIORITY_RESERVES = {
+    "critical": 0.0,
+    "normal": 0.2,
+    "low": 0.4,
+}
+
+# Buckets of idle users are dropped from the in-memory store after this long.
+IDLE_BUCKET_SECONDS = 3600
+
+
+class Limit:
+    """
+    A per-user token bucket: ``burst`` requests at once, refilled at ``rate`` per
+    second, and the priority class the endpoint's requests belong to.
+    """
+
+    def __init__(self, rate, burst, priority="normal"):
+        """
+        Initialize the Limit.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.priority = priority
+
+
+# Limits of the hot write endpoints, by Flask endpoint name.
+RATE_LIMITS = {
+    "create_payment_sheet": Limit(rate=0.2, burst=5, priority="critical"),
+    "api_post_ride": Limit(rate=1 / 60, burst=5, priority="normal"),
+    "api_send_message": Limit(rate=1.0, burst=10, priority="low"),
+}
+
+
+def refill(tokens, updated, rate, burst, now):
+    """
+    Tokens in a bucket that held ``tokens`` at ``updated``.
+    """
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+def take(tokens, rate, cost=1.0, floor=0.0):
+    """
+    Take ``cost`` tokens from a bucket without going below ``floor``. Returns the
+    tokens left, or None and the seconds until enough have refilled.
+    """
+    if tokens - cost >= floor:
+        return tokens - cost, 0.0
+    return None, (floor + cost - tokens) / rate if rate else math.inf
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in this process.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Initialize an empty MemoryBucketStore.
+        """
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.last_sweep = clock()
+
+    def acquire(self, key, rate, burst, floor=0.0):
+        """
+        Take a token from the bucket ``key``, leaving at least ``floor`` (a share of
+        ``burst``) in it. Returns (allowed, retry_after).
+        """
+        now = self.clock()
+        with self.lock:
+            self._sweep(now)
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, rate, burst, now)
+            left, retry_after = take(tokens, rate, floor=floor * burst)
+            self.buckets[key] = (tokens if left is None else left, now)
+        return left is not None, retry_after
+
+    def refund(self, key, burst):
+        """
+        Give back a token taken from the bucket ``key`` for a request that was then
+        refused.
+        """
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (min(burst, tokens + 1.0), updated)
+
+    def _sweep(self, now):
+        if now - self.last_sweep < IDLE_BUCKET_SECONDS:
+            return
+        self.last_sweep = now
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if now - bucket[1] < IDLE_BUCKET_SECONDS
+        }
+
+
+class FirestoreBucketStore:
+    """
+    Token buckets kept in the ``rate_limits`` collection, so every worker shares
+    them. Each bucket is updated in a transaction.
+    """
+
+    def __init__(self, db):
+        """
+        Initialize the FirestoreBucketStore.
+        """
+        self.db = db
+        self.bucket_ref = db.collection("rate_limits")
+
+    def acquire(self, key, rate, burst, floor=0.0):
+        """
+        Take a token from the bucket ``key``, leaving at least ``floor`` (a share of
+        ``burst``) in it. Returns (allowed, retry_after).
+        """
+        bucket_ref = self.bucket_ref.document(key)
+
+        @firestore.transactional
+        def acquire(transaction):
+            """
+            Refill the bucket and take a token from it if there is one.
+            """
+            snapshot = bucket_ref.get(transaction=transaction)
+            bucket = snapshot.to_dict() if snapshot.exists else {}
+            now = time.time()
+            tokens = refill(
+                bucket.get("tokens", burst), bucket.get("updatedAt", now), rate, burst, now
+            )
+            left, retry_after = take(tokens, rate, floor=floor * burst)
+            transaction.set(bucket_ref, {
+                "tokens": tokens if left is None else left,
+                "updatedAt": now,
+            })
+            return left is not None, retry_after
+
+        return acquire(self.db.transaction())
+
+
+class RateLimiter:
+    """
+    RateLimiter admits requests to the rate-limited endpoints.
+
+    Each user has a token bucket per endpoint (see RATE_LIMITS), kept in ``store``.
+    A request that finds its bucket empty is rejected with 429 and a Retry-After.
+
+    All limited requests first draw from one in-process bucket. Each priority class
+    must leave its PRIORITY_RESERVES share of that bucket untouched, so as the process
+    nears GLOBAL_RATE the low-priority requests are shed first (503) and critical ones
+    keep going. A request shed there does not spend its user's token, and one refused
+    by its user's bucket gives its global token back.
+
+    If the shared store fails, the request is let through: an outage of the limiter
+    should not take the endpoints down with it.
+    """
+
+    def __init__(self, store, limits=None, global_rate=GLOBAL_RATE,
+                 global_burst=GLOBAL_BURST):
+        """
+        Initialize the RateLimiter.
+        """
+        self.store = store
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.global_store = MemoryBucketStore()
+
+    def check(self, endpoint, user_id):
+        """
+        Admit or refuse a request. Returns None if it may go ahead, otherwise
+        (status, retry_after_seconds).
+        """
+        limit = self.limits.get(endpoint)
+        if limit is None or not user_id:
+            return None
+
+        allowed, retry_after = self.global_store.acquire(
+            "global", self.global_rate, self.global_burst,
+            floor=PRIORITY_RESERVES.get(limit.priority, 0.0),
+        )
+        if not allowed:
+            return 503, retry_after
+
+        try:
+            allowed, retry_after = self.store.acquire(
+                f"{endpoint}:{user_id}", limit.rate, limit.burst
+            )
+        except Exception as e:
+            print(f"Rate limit check failed, allowing request: {e}")
+            allowed = True
+        if not allowed:
+            self.global_store.refund("global", self.global_burst)
+            return 429, retry_after
+
+        return None
+
+
+def create_rate_limiter(db, backend=RATE_LIMIT_BACKEND):
+    """
+    RateLimiter whose per-user buckets use ``backend``.
+    """
+    if backend == "firestore":
+        return RateLimiter(FirestoreBucketStore(db))
+    if backend != "memory":
+        raise ValueError(f"Unknown rate limit backend: {backend}")
+    return RateLimiter(MemoryBucketStore())
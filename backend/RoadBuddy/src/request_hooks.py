@@ -0,0 +1,115 @@
+import math
+import os
+from flask import current_app, request, jsonify
+from clients import db, firestore_metrics, tracer
+from rate_limit import create_rate_limiter
+import resilience
+from session_auth import get_user_id
+from utils import UNAVAILABLE_MESSAGE
+
+# Adds an X-Firestore-Operations header with each response's Firestore usage.
+FIRESTORE_METRICS_HEADER = os.getenv('FIRESTORE_METRICS_HEADER') == '1'
+
+rate_limiter = create_rate_limiter(db)
+
+
+def start_trace():
+    """
+    Trace this request's manager calls, and profile it if it sent X-Profile.
+    """
+    tracer.start_request(f"{request.method} {request.path}", request.headers.get('X-Profile'))
+
+
+def finish_trace(_error):
+    """
+    Log the request if it was slow and write its profile, if one was taken.
+    """
+    tracer.finish_request()
+
+
+def start_deadline():
+    """
+    Give the request REQUEST_DEADLINE_SECONDS for its Firestore and Stripe calls.
+    """
+    resilience.start_request()
+
+
+def finish_deadline(_error):
+    """
+    Clear the request's deadline.
+    """
+    resilience.finish_request()
+
+
+def rate_limit_response():
+    """
+    Refuse requests to the rate-limited endpoints over the user's limit (429) or
+    shed while the process is overloaded (503), with a Retry-After. Returns None if
+    the request may go ahead.
+    """
+    rejection = rate_limiter.check(request.endpoint, get_user_id())
+    if rejection is None:
+        return None
+
+    status, retry_after = rejection
+    if status == 429:
+        body = {"error": "Too many requests, please slow down."}
+    else:
+        body = {"error": UNAVAILABLE_MESSAGE}
+    response = jsonify(body)
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, status
+
+
+def enforce_rate_limit():
+    """
+    Apply the rate limits before the view runs. Idempotent views sent an
+    Idempotency-Key apply them themselves, once no stored response can be replayed,
+    so a client retrying a request is not charged again.
+    """
+    view = current_app.view_functions.get(request.endpoint)
+    if request.headers.get('Idempotency-Key') and getattr(view, 'idempotent', False):
+        return None
+    return rate_limit_response()
+
+
+def start_firestore_metrics():
+    """
+    Attribute the Firestore calls made for this request to its endpoint.
+    """
+    firestore_metrics.start_request(request.endpoint)
+
+
+def add_firestore_metrics_header(response):
+    """
+    In debug mode, report the request's Firestore usage in a response header. For a
+    streamed response it only covers the reads made before the body started.
+    """
+    totals = firestore_metrics.request_totals()
+    if (current_app.debug or FIRESTORE_METRICS_HEADER) and totals is not None:
+        response.headers['X-Firestore-Operations'] = totals.header()
+    return response
+
+
+def finish_firestore_metrics(_error):
+    """
+    Record the request's Firestore usage in the per-request histograms.
+    """
+    firestore_metrics.finish_request()
+
+
+def install_request_hooks(app):
+    """
+    Register the per-request hooks on ``app``. Before-request hooks run in the order
+    they are registered, teardown hooks in the reverse order.
+    """
+    app.before_request(start_trace)
+    app.teardown_request(finish_trace)
+    app.before_request(start_deadline)
+    app.teardown_request(finish_deadline)
+    # After start_firestore_metrics, so a Firestore-backed limiter's transactions are
+    # counted against the endpoint being limited.
+    app.before_request(start_firestore_metrics)
+    app.before_request(enforce_rate_limit)
+    app.after_request(add_firestore_metrics_header)
+    app.teardown_request(finish_firestore_metrics)
@@ -0,0 +1,352 @@
+import contextvars
+import os
+import random
+import threading
+import time
+
+import stripe
+from google.api_core import exceptions as api_exceptions
+from firestore_proxy import FirestoreProxy, unwrap, wrap_result
+
+# Time budget of a request. Every Firestore call made for it gets what is left as its
+# timeout, so a chain of slow calls cannot run past it.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "10"))
+
+# Timeout of Firestore calls made outside a request, e.g. by scheduled jobs.
+BACKGROUND_RPC_TIMEOUT_SECONDS = float(os.getenv("BACKGROUND_RPC_TIMEOUT_SECONDS", "30"))
+
+# Attempts of an idempotent read, and the backoff between them. Each wait is drawn
+# uniformly between zero and the exponential backoff ("full jitter").
+READ_ATTEMPTS = int(os.getenv("READ_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "0.05"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "1.0"))
+
+# Consecutive failures that open a circuit, and how long it stays open before one
+# trial call is let through.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "10"))
+
+# Timeout of a single Stripe HTTP request.
+STRIPE_TIMEOUT_SECONDS = int(os.getenv("STRIPE_TIMEOUT_SECONDS", "10"))
+
+# Errors that mean the backend is unhealthy rather than that the request is wrong.
+TRANSIENT_FIRESTORE_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    ConnectionError,
+    TimeoutError,
+)
+TRANSIENT_STRIPE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+
+# Firestore calls that only read, and so can be retried.
+IDEMPOTENT_READS = {
+    ("document", "get"),
+    ("collection", "get"),
+    ("collection", "stream"),
+    ("client", "get_all"),
+}
+
+# Firestore calls that reach the backend. Transaction begin/commit/rollback take no
+# timeout and are retried by firestore.transactional itself.
+RPC_CALLS = IDEMPOTENT_READS | {
+    ("document", "set"), ("document", "create"), ("document", "update"),
+    ("document", "delete"), ("collection", "add"), ("batch", "commit"),
+    ("transaction", "get"), ("transaction", "get_all"), ("transaction", "_begin"),
+    ("transaction", "_commit"), ("transaction", "_rollback"),
+}
+TIMEOUT_FREE_CALLS = {("transaction", "_begin"), ("transaction", "_commit"),
+                      ("transaction", "_rollback")}
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class RequestDeadlineExceeded(Exception):
+    """
+    The request ran out of time before a backend call could be made.
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    A backend call was refused because the backend's circuit breaker is open.
+    """
+
+
+def is_unavailable(error):
+    """
+    True if ``error`` means a backend is down or overloaded, so the request should get
+    a 503 and be retried later rather than a 500.
+    """
+    return isinstance(error, (
+        RequestDeadlineExceeded, CircuitOpenError,
+        *TRANSIENT_FIRESTORE_ERRORS, *TRANSIENT_STRIPE_ERRORS,
+    ))
+
+
+def start_request(seconds=REQUEST_DEADLINE_SECONDS):
+    """
+    Give the request being handled in this context ``seconds`` to finish.
+    """
+    _deadline.set(time.monotonic() + seconds)
+
+
+def finish_request():
+    """
+    Clear this context's deadline.
+    """
+    _deadline.set(None)
+
+
+def remaining():
+    """
+    Seconds left before this context's deadline, or None if it has none.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def rpc_timeout(default=BACKGROUND_RPC_TIMEOUT_SECONDS):
+    """
+    Timeout for the next backend call: what is left of the deadline, or ``default``
+    outside a request. Raises RequestDeadlineExceeded if nothing is left.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise RequestDeadlineExceeded("Request deadline exceeded")
+    return min(left, default)
+
+
+def backoff(attempt, rng=random):
+    """
+    Jittered wait before retry number ``attempt`` (starting at 1).
+    """
+    return rng.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker stops calling a backend after ``failure_threshold`` consecutive
+    failures. While open, calls fail at once with CircuitOpenError. After
+    ``reset_seconds`` one trial call is let through: if it succeeds the circuit
+    closes, otherwise it stays open for another ``reset_seconds``.
+
+    ``is_failure(error)`` decides which errors count against the backend; the others
+    (a missing document, a declined card) are the caller's problem.
+    """
+
+    def __init__(self, name, is_failure, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds=BREAKER_RESET_SECONDS):
+        """
+        Initialize a closed CircuitBreaker.
+        """
+        self.name = name
+        self.is_failure = is_failure
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        """
+        "closed", "open" or "half-open".
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go through now.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_seconds:
+                # Let this call through as the trial, and keep the others out until
+                # it finishes or another reset_seconds pass.
+                self.opened_at = now
+                return
+        raise CircuitOpenError(f"{self.name} is unavailable, circuit open")
+
+    def record_success(self):
+        """
+        Close the circuit after a successful call.
+        """
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"Circuit breaker {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, error):
+        """
+        Count a failed call, opening the circuit if it was one too many.
+        """
+        if not self.is_failure(error):
+            self.record_success()
+            return
+        with self.lock:
+            self.failures += 1
+            if self.opened_at is not None:
+                self.opened_at = time.monotonic()
+            elif self.failures >= self.failure_threshold:
+                print(f"Circuit breaker {self.name} opened after {self.failures} failure(s): "
+                      f"{error}")
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call ``fn`` through the breaker.
+        """
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+
+def _is_firestore_failure(error):
+    return isinstance(error, TRANSIENT_FIRESTORE_ERRORS)
+
+
+def _is_stripe_failure(error):
+    return isinstance(error, TRANSIENT_STRIPE_ERRORS)
+
+
+firestore_breaker = CircuitBreaker("firestore", _is_firestore_failure)
+stripe_breaker = CircuitBreaker("stripe", _is_stripe_failure)
+
+
+def call_stripe(fn, *args, **kwargs):
+    """
+    Make a Stripe API call within the request's deadline and through the Stripe
+    circuit breaker.
+    """
+    rpc_timeout()
+    return stripe_breaker.call(fn, *args, **kwargs)
+
+
+def configure_stripe():
+    """
+    Bound every Stripe HTTP request by STRIPE_TIMEOUT_SECONDS, and let the Stripe
+    library retry network errors with its own jittered backoff and idempotency keys.
+    """
+    stripe.default_http_client = stripe.RequestsClient(timeout=STRIPE_TIMEOUT_SECONDS)
+    stripe.max_network_retries = READ_ATTEMPTS - 1
+
+
+class Resilience:
+    """
+    Resilience applies deadlines, retries and a circuit breaker to a Firestore client.
+
+    ``wrap(db)`` returns a client whose every backend call goes through the breaker
+    and gets the request's remaining time as its ``timeout``. Idempotent reads that
+    fail with a transient error are retried up to READ_ATTEMPTS times with jittered
+    backoff, while time is left; a stream is only retried if it fails before its
+    first document. Writes are never retried here.
+    """
+
+    def __init__(self, breaker=firestore_breaker, attempts=READ_ATTEMPTS, sleep=time.sleep):
+        """
+        Initialize the Resilience layer.
+        """
+        self.breaker = breaker
+        self.attempts = attempts
+        self.sleep = sleep
+
+    def wrap(self, db):
+        """
+        Wrap a Firestore client.
+        """
+        return FirestoreProxy(db, self, "client")
+
+    def call(self, kind, name, function, *args, **kwargs):
+        """
+        Call a Firestore method on behalf of a wrapped object.
+        """
+        args = [unwrap(arg) for arg in args]
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+
+        if (kind, name) not in RPC_CALLS:
+            return wrap_result(function(*args, **kwargs), self, name)
+
+        attempts = self.attempts if (kind, name) in IDEMPOTENT_READS else 1
+        with_timeout = (kind, name) not in TIMEOUT_FREE_CALLS and "timeout" not in kwargs
+        if name == "stream" or (kind, name) == ("client", "get_all"):
+            return self._stream(attempts, with_timeout, function, args, kwargs)
+        return self._retry(attempts, with_timeout, function, args, kwargs)
+
+    def _attempt(self, with_timeout, function, args, kwargs):
+        if with_timeout:
+            kwargs = {**kwargs, "timeout": rpc_timeout()}
+        self.breaker.before_call()
+        return function(*args, **kwargs)
+
+    def _should_retry(self, attempt, attempts, error):
+        # Returns the wait before the next attempt, or None to give up.
+        self.breaker.record_failure(error)
+        if attempt >= attempts or not _is_firestore_failure(error):
+            return None
+        wait = backoff(attempt)
+        left = remaining()
+        if left is not None and left <= wait:
+            return None
+        return wait
+
+    def _retry(self, attempts, with_timeout, function, args, kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self._attempt(with_timeout, function, args, kwargs)
+            except (CircuitOpenError, RequestDeadlineExceeded):
+                raise
+            except Exception as e:
+                wait = self._should_retry(attempt, attempts, e)
+                if wait is None:
+                    raise
+                self.sleep(wait)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _stream(self, attempts, with_timeout, function, args, kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                iterator = iter(self._attempt(with_timeout, function, args, kwargs))
+                first = next(iterator)
+            except StopIteration:
+                self.breaker.record_success()
+                return
+            except (CircuitOpenError, RequestDeadlineExceeded):
+                raise
+            except Exception as e:
+                wait = self._should_retry(attempt, attempts, e)
+                if wait is None:
+                    raise
+                self.sleep(wait)
+                continue
+            self.breaker.record_success()
+            yield first
+            yield from iterator
+            return
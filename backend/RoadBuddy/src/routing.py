@@ -0,0 +1,319 @@
+import heapq
+import json
+import math
+import os
+import threading
+from array import array
+from cachetools import LRUCache
+
+DEFAULT_GRAPH_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "road_graph_sample.json"
+)
+EARTH_RADIUS_METERS = 6371000.0
+
+# Suggested fare per seat: a flat base plus a share of the fuel cost per kilometre.
+FARE_BASE = 2.00
+FARE_PER_KM = 0.12
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two coordinates, in meters.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def normalize_place(name):
+    """
+    Normalize a free-text place name for lookups.
+    """
+    return " ".join((name or "").lower().replace(",", " ").split())
+
+
+class RoadGraph:
+    """
+    Directed road network stored in compressed sparse row (CSR) form.
+
+    The outgoing edges of node ``u`` are ``offsets[u]`` to ``offsets[u + 1]`` in the
+    ``targets``, ``distances`` (meters) and ``durations`` (seconds) arrays, and
+    ``coordinates`` holds a latitude/longitude pair per node.
+    """
+
+    def __init__(self, names, latitudes, longitudes, edges):
+        """
+        Build the CSR arrays from a list of (source, target, meters, seconds) edges.
+        """
+        node_count = len(names)
+        self.names = names
+        self.coordinates = array("d", [c for pair in zip(latitudes, longitudes) for c in pair])
+
+        counts = [0] * (node_count + 1)
+        for source, _, _, _ in edges:
+            counts[source + 1] += 1
+        for node in range(node_count):
+            counts[node + 1] += counts[node]
+        self.offsets = array("l", counts)
+
+        position = list(counts[:-1])
+        self.targets = array("l", [0] * len(edges))
+        self.distances = array("d", [0.0] * len(edges))
+        self.durations = array("d", [0.0] * len(edges))
+        for source, target, meters, seconds in edges:
+            slot = position[source]
+            position[source] += 1
+            self.targets[slot] = target
+            self.distances[slot] = meters
+            self.durations[slot] = seconds
+
+        self.index = {}
+        for node, name in enumerate(names):
+            self.index[normalize_place(name)] = node
+
+    @classmethod
+    def load(cls, path=DEFAULT_GRAPH_PATH):
+        """
+        Load a road-network extract from a JSON file.
+
+        Nodes are ``{"id", "name", "lat", "lon", "aliases"}`` objects and edges are
+        ``[from_id, to_id, meters, speed_kph]`` lists, plus an optional ``"oneway"``
+        fifth item. Edges are two-way unless marked one-way.
+        """
+        with open(path, encoding="utf-8") as graph_file:
+            extract = json.load(graph_file)
+
+        node_ids = {node["id"]: index for index, node in enumerate(extract["nodes"])}
+        edges = []
+        for edge in extract["edges"]:
+            source, target = node_ids[edge[0]], node_ids[edge[1]]
+            meters, speed_kph = float(edge[2]), float(edge[3])
+            seconds = meters / (speed_kph * 1000 / 3600)
+            edges.append((source, target, meters, seconds))
+            if len(edge) < 5 or edge[4] != "oneway":
+                edges.append((target, source, meters, seconds))
+
+        graph = cls(
+            [node["name"] for node in extract["nodes"]],
+            [node["lat"] for node in extract["nodes"]],
+            [node["lon"] for node in extract["nodes"]],
+            edges,
+        )
+        for node in extract["nodes"]:
+            for alias in node.get("aliases", []):
+                graph.index[normalize_place(alias)] = node_ids[node["id"]]
+        return graph
+
+    @property
+    def node_count(self):
+        """
+        Number of nodes in the graph.
+        """
+        return len(self.names)
+
+    def resolve(self, place):
+        """
+        Node for a place name or alias, or None if the place is not in the graph.
+        """
+        return self.index.get(normalize_place(place))
+
+    def straight_line(self, source, target):
+        """
+        Great-circle distance between two nodes, in meters.
+        """
+        return haversine_meters(
+            self.coordinates[2 * source], self.coordinates[2 * source + 1],
+            self.coordinates[2 * target], self.coordinates[2 * target + 1],
+        )
+
+    def max_straight_line_speed(self):
+        """
+        Fastest straight-line progress any edge allows, in meters per second.
+        Dividing the straight-line distance to a goal by it never overestimates the
+        remaining travel time, so A* with that heuristic stays exact.
+        """
+        return max(
+            (
+                self.straight_line(node, self.targets[slot]) / self.durations[slot]
+                for node in range(self.node_count)
+                for slot in range(self.offsets[node], self.offsets[node + 1])
+                if self.durations[slot] > 0
+            ),
+            default=0.0,
+        )
+
+
+class RoutePlanner:
+    """
+    RoutePlanner answers fastest-route, ETA and detour queries on a RoadGraph and
+    keeps recent origin/destination results in an LRU cache.
+    """
+
+    def __init__(self, graph, cache_size=4096):
+        """
+        Initialize the RoutePlanner.
+        """
+        self.graph = graph
+        self.max_speed = graph.max_straight_line_speed()
+        self.cache = LRUCache(maxsize=cache_size)
+        self.lock = threading.Lock()
+
+    def _cached(self, source, target):
+        with self.lock:
+            return self.cache.get((source, target))
+
+    def _store(self, source, target, result):
+        with self.lock:
+            self.cache[(source, target)] = result
+
+    def _search(self, source, target=None):
+        """
+        Fastest-path search from ``source``. With a target it runs A* and stops at the
+        target; without one it is a plain Dijkstra over the whole graph.
+
+        Returns (duration, distance, parent) dictionaries keyed by node.
+        """
+        graph = self.graph
+        speed = self.max_speed
+
+        def heuristic(node):
+            """
+            Lower bound on the remaining travel time to the target.
+            """
+            if target is None or not speed:
+                return 0.0
+            return graph.straight_line(node, target) / speed
+
+        duration = {source: 0.0}
+        distance = {source: 0.0}
+        parent = {source: None}
+        settled = set()
+        heap = [(heuristic(source), source)]
+
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == target:
+                break
+
+            for slot in range(graph.offsets[node], graph.offsets[node + 1]):
+                neighbor = graph.targets[slot]
+                candidate = duration[node] + graph.durations[slot]
+                if candidate < duration.get(neighbor, math.inf):
+                    duration[neighbor] = candidate
+                    distance[neighbor] = distance[node] + graph.distances[slot]
+                    parent[neighbor] = node
+                    heapq.heappush(heap, (candidate + heuristic(neighbor), neighbor))
+
+        return duration, distance, parent
+
+    def _result(self, target, search):
+        """
+        Route summary for ``target`` from a finished search, or None if unreachable.
+        """
+        duration, distance, parent = search
+        if target not in duration:
+            return None
+
+        path = []
+        node = target
+        while node is not None:
+            path.append(self.graph.names[node])
+            node = parent[node]
+        path.reverse()
+
+        return {
+            "durationSeconds": round(duration[target]),
+            "distanceMeters": round(distance[target]),
+            "path": path,
+        }
+
+    def route(self, source, target):
+        """
+        Fastest route between two nodes as a dict with ``durationSeconds``,
+        ``distanceMeters`` and the ``path`` of place names, or None if unreachable.
+        """
+        cached = self._cached(source, target)
+        if cached is not None:
+            return cached
+
+        result = self._result(target, self._search(source, target))
+        if result is not None:
+            self._store(source, target, result)
+        return result
+
+    def eta_matrix(self, sources, targets):
+        """
+        Fastest routes from every source to every target. Runs one Dijkstra per source
+        with uncached pairs and stores every result it produces in the cache.
+
+        Returns a list of rows; unreachable pairs are None.
+        """
+        matrix = []
+        for source in sources:
+            row = [self._cached(source, target) for target in targets]
+            if any(cell is None for cell in row):
+                search = self._search(source)
+                row = [self._result(target, search) for target in targets]
+                for target, result in zip(targets, row):
+                    if result is not None:
+                        self._store(source, target, result)
+            matrix.append(row)
+        return matrix
+
+    def detour(self, start, end, pickup):
+        """
+        Extra time and distance for a driver going ``start`` -> ``end`` to go through
+        ``pickup`` instead. Returns None if any leg is unreachable.
+        """
+        direct = self.route(start, end)
+        to_pickup = self.route(start, pickup)
+        from_pickup = self.route(pickup, end)
+        if direct is None or to_pickup is None or from_pickup is None:
+            return None
+
+        return {
+            "extraSeconds": (
+                to_pickup["durationSeconds"] + from_pickup["durationSeconds"]
+                - direct["durationSeconds"]
+            ),
+            "extraMeters": (
+                to_pickup["distanceMeters"] + from_pickup["distanceMeters"]
+                - direct["distanceMeters"]
+            ),
+        }
+
+    @staticmethod
+    def suggest_fare(distance_meters):
+        """
+        Suggested per-seat fare for a trip, rounded to the nearest 50 cents.
+        """
+        fare = FARE_BASE + FARE_PER_KM * distance_meters / 1000
+        return round(fare * 2) / 2
+
+    def estimate(self, start_place, end_place, pickup_place=None):
+        """
+        Route, suggested fare and optional pickup detour between two place names.
+        """
+        start = self.graph.resolve(start_place)
+        end = self.graph.resolve(end_place)
+        if start is None or end is None:
+            return {"error": "Unknown place for routing."}, 404
+
+        route = self.route(start, end)
+        if route is None:
+            return {"error": "No route between these places."}, 404
+
+        estimate = dict(route, suggestedFare=self.suggest_fare(route["distanceMeters"]))
+
+        if pickup_place:
+            pickup = self.graph.resolve(pickup_place)
+            if pickup is None:
+                return {"error": "Unknown pickup place for routing."}, 404
+            estimate["detour"] = self.detour(start, end, pickup)
+
+        return estimate, 200
@@ -0,0 +1,90 @@
+class SegmentTree:
+    """
+    Segment tree over a list of integers supporting range add and range max with lazy
+    propagation. Ranges are half-open: [lo, hi).
+
+    The leaf count is padded to a power of two so a node's span can be derived from
+    its index instead of being passed down the recursion.
+    """
+
+    def __init__(self, values):
+        """
+        Build the tree in O(n) from the initial values.
+        """
+        self.size = len(values)
+        self.leaves = 1
+        while self.leaves < self.size:
+            self.leaves *= 2
+
+        self.maximum = [0] * (2 * self.leaves)
+        self.pending = [0] * (2 * self.leaves)
+        self.maximum[self.leaves:self.leaves + self.size] = values
+        for node in range(self.leaves - 1, 0, -1):
+            self.maximum[node] = max(self.maximum[2 * node], self.maximum[2 * node + 1])
+
+    def _span(self, node):
+        depth = node.bit_length() - 1
+        width = self.leaves >> depth
+        lo = (node - (1 << depth)) * width
+        return lo, lo + width
+
+    def _push(self, node):
+        delta = self.pending[node]
+        if delta:
+            for child in (2 * node, 2 * node + 1):
+                self.maximum[child] += delta
+                self.pending[child] += delta
+            self.pending[node] = 0
+
+    def _check_range(self, lo, hi):
+        if not 0 <= lo < hi <= self.size:
+            raise IndexError(f"Invalid range [{lo}, {hi}) for {self.size} segments")
+
+    def range_max(self, lo, hi):
+        """
+        Largest value in [lo, hi), in O(log n).
+        """
+        self._check_range(lo, hi)
+        return self._query(1, lo, hi)
+
+    def _query(self, node, lo, hi):
+        node_lo, node_hi = self._span(node)
+        if lo <= node_lo and node_hi <= hi:
+            return self.maximum[node]
+        self._push(node)
+        mid = (node_lo + node_hi) // 2
+        result = float("-inf")
+        if lo < mid:
+            result = self._query(2 * node, lo, hi)
+        if hi > mid:
+            result = max(result, self._query(2 * node + 1, lo, hi))
+        return result
+
+    def range_add(self, lo, hi, delta):
+        """
+        Add ``delta`` to every value in [lo, hi), in O(log n).
+        """
+        self._check_range(lo, hi)
+        self._update(1, lo, hi, delta)
+
+    def _update(self, node, lo, hi, delta):
+        node_lo, node_hi = self._span(node)
+        if lo <= node_lo and node_hi <= hi:
+            self.maximum[node] += delta
+            self.pending[node] += delta
+            return
+        self._push(node)
+        mid = (node_lo + node_hi) // 2
+        if lo < mid:
+            self._update(2 * node, lo, hi, delta)
+        if hi > mid:
+            self._update(2 * node + 1, lo, hi, delta)
+        self.maximum[node] = max(self.maximum[2 * node], self.maximum[2 * node + 1])
+
+    def to_list(self):
+        """
+        Current values of every position, in O(n).
+        """
+        for node in range(1, self.leaves):
+            self._push(node)
+        return self.maximum[self.leaves:self.leaves + self.size]
@@ -0,0 +1,131 @@
+import time
+from datetime import datetime
+import msgpack
+import pytz
+from flask import Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from tracing import record, span
+
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, "application/x-msgpack")
+
+PACIFIC_TZ = pytz.timezone("America/Los_Angeles")
+
+
+class DisplayTime:
+    """
+    A timestamp together with the text the app shows for it. JSON responses carry the
+    text, as they always have; MessagePack responses carry milliseconds since the epoch.
+    """
+    __slots__ = ("moment", "text")
+
+    def __init__(self, moment, text):
+        """
+        Initialize the DisplayTime.
+        """
+        self.moment = moment
+        self.text = text
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, DisplayTime)
+            and (self.moment, self.text) == (other.moment, other.text)
+        )
+
+    def __hash__(self):
+        return hash((self.moment, self.text))
+
+    def __repr__(self):
+        return f"DisplayTime({self.moment!r}, {self.text!r})"
+
+
+def pacific_time(moment, fmt):
+    """
+    DisplayTime for a UTC timestamp, formatted with ``fmt`` in Pacific time. Naive
+    timestamps are taken to be UTC.
+    """
+    started = time.perf_counter()
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=pytz.utc)
+    display_time = DisplayTime(moment, moment.astimezone(PACIFIC_TZ).strftime(fmt))
+    record("format_time", time.perf_counter() - started)
+    return display_time
+
+
+def epoch_millis(moment):
+    """
+    Milliseconds since the epoch for a datetime. Naive datetimes are taken to be UTC.
+    """
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=pytz.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def json_default(value):
+    """
+    Encode the values the JSON encoder does not know: DisplayTime as its text, and
+    anything else the way Flask's jsonify does (datetimes as HTTP dates).
+    """
+    if isinstance(value, DisplayTime):
+        return value.text
+    return DefaultJSONProvider.default(value)
+
+
+def msgpack_default(value):
+    """
+    Encode the values MessagePack does not know. Timestamps become integer
+    milliseconds since the epoch.
+    """
+    if isinstance(value, DisplayTime):
+        return epoch_millis(value.moment)
+    if isinstance(value, datetime):
+        return epoch_millis(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider, extended to encode DisplayTime.
+    """
+    default = staticmethod(json_default)
+
+
+def wants_msgpack():
+    """
+    True if the request's Accept header prefers MessagePack over JSON.
+    """
+    best = request.accept_mimetypes.best_match(("application/json",) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+
+def packb(body):
+    """
+    Encode a response body as MessagePack bytes.
+    """
+    return msgpack.packb(body, default=msgpack_default, use_bin_type=True)
+
+
+def respond(body, status=200):
+    """
+    Response for ``body`` in the format the client asked for: MessagePack if its
+    Accept header prefers it, JSON otherwise.
+    """
+    with span("encode"):
+        if wants_msgpack():
+            response = Response(packb(body), status=status, mimetype=MSGPACK_MIMETYPE)
+        else:
+            response = jsonify(body)
+            response.status_code = status
+    response.vary.add("Accept")
+    return response
+
+
+def conditional_json(body, etag):
+    """
+    Response (JSON or MessagePack) tagged with a strong ETag, or an empty 304 if the
+    request's If-None-Match already names that ETag.
+    """
+    response = respond(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
@@ -1,7 +1,9 @@
 from flask import jsonify
 from firebase_admin.exceptions import FirebaseError
 from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
 
+@traced
 class CarManager:
     """
     CarManager is responsible for handling car-related operations for a user.
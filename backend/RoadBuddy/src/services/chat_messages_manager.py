@@ -1,8 +1,12 @@
 from google.cloud import firestore
 from firebase_admin.exceptions import FirebaseError
-import pytz
+from concurrency import submit
+from serialization import pacific_time
+from streaming import prefetch
 from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
 
+@traced
 class ChatMessagesManager:
     """
     ChatMessagesManager is responsible for handling messages-related operation for a ride chat room
@@ -20,9 +24,11 @@ class ChatMessagesManager:
             db.collection("ride_chats").document(ride_id).collection("messages")
         )
 
-    def send_message(self, text, time, is_owner):
+    def send_message(self, text, time, is_owner, stage_tasks=None):
         """
-        Sends a message in a ride chat.
+        Sends a message in a ride chat. The chat document itself is not written, so a
+        busy chat does not run into Firestore's per-document write rate.
+        ``stage_tasks(batch)`` can add writes that must commit together with the message.
         """
         try:
             message_data = {
@@ -33,7 +39,11 @@ class ChatMessagesManager:
                 "isOwner": is_owner
             }
 
-            self.messages_ref.document().set(message_data)
+            batch = self.db.batch()
+            batch.set(self.messages_ref.document(), message_data)
+            if stage_tasks:
+                stage_tasks(batch)
+            batch.commit()
 
             return {
                 "message": "Message has been sent"
@@ -45,6 +55,33 @@ class ChatMessagesManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
+    def get_message_version(self):
+        """
+        Version of the chat's message list: the id of its newest message, or "0" if
+        it has none. Every message sent changes it.
+        """
+        try:
+            newest_query = (
+                self.messages_ref
+                .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                .limit(1)
+            )
+            newest = [doc.id for doc in newest_query.stream()]
+
+            return {"messageVersion": newest[0] if newest else "0"}, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch message version.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def get_message_version_async(self):
+        """
+        Like get_message_version, but runs on the shared I/O pool and returns a Future.
+        """
+        return submit(self.get_message_version)
+
     def delete_all_messages(self):
         """
         Fetch all messages for a ride chat, sorted by timestamp.
@@ -68,30 +105,41 @@ class ChatMessagesManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def get_messages_sorted_by_timestamp_asc(self):
-        """
-        Fetches all messages in a chat room.
-        """
-        try:
-            pacific_tz = pytz.timezone("America/Los_Angeles")
+    def _iter_messages(self):
+        messages_query = (
+            self.messages_ref.order_by("timestamp", direction=firestore.Query.ASCENDING)
+        )
+        messages_docs = messages_query.stream()
+
+        for index, doc in enumerate(messages_docs, start=1):
+            message_data = doc.to_dict()
+            message_data["id"] = doc.id
 
-            messages_query = (
-                self.messages_ref.order_by("timestamp", direction=firestore.Query.ASCENDING)
+            message_data["timestamp"] = pacific_time(
+                message_data["timestamp"], "%Y-%m-%d %I:%M %p PT"
             )
-            messages_docs = messages_query.stream()
+            yield index, message_data
 
-            sorted_messages = {}
-            for index, doc in enumerate(messages_docs, start=1):
-                message_data = doc.to_dict()
-                message_data["id"] = doc.id
+    def stream_messages_sorted_by_timestamp_asc(self):
+        """
+        Like get_messages_sorted_by_timestamp_asc, but ``messages`` is an iterator of
+        (index, message) pairs read from Firestore as it is consumed.
+        """
+        try:
+            return {"messages": prefetch(self._iter_messages())}, 200
 
-                utc_dt = message_data["timestamp"].replace(tzinfo=pytz.utc)
-                pacific_dt = utc_dt.astimezone(pacific_tz)
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch messages.")
 
-                message_data["timestamp"] = pacific_dt.strftime("%Y-%m-%d %I:%M %p PT")
-                sorted_messages[index] = message_data
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
 
-            return {"messages": sorted_messages}, 200
+    def get_messages_sorted_by_timestamp_asc(self):
+        """
+        Fetches all messages in a chat room.
+        """
+        try:
+            return {"messages": dict(self._iter_messages())}, 200
 
         except FirebaseError as e:
             return handle_firestore_error(e, "Failed to fetch messages.")
@@ -0,0 +1,85 @@
+from firebase_admin.exceptions import FirebaseError
+from concurrency import submit
+from services.car_manager import CarManager
+from services.ride_chat_manager import RideChatManager
+from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
+
+HOME_FEED_SECTIONS = ("unread_count", "rides", "ride_chats", "cars")
+
+
+@traced
+class HomeFeedManager:
+    """
+    HomeFeedManager builds the data the app shows on launch in one call.
+    """
+
+    def __init__(self, db, user_id):
+        """
+        Initialize the HomeFeedManager.
+        """
+        self.db = db
+        self.user_id = user_id
+        self.user_ref = db.collection("users").document(user_id)
+
+    def get_home_feed(self, sections=HOME_FEED_SECTIONS):
+        """
+        Fetch the requested sections of the home feed: the unread notification count,
+        the user's rides, their ride chats and their cars.
+
+        The user document is read once, and the rides and ride chats are loaded with a
+        single get_all. The cars query does not depend on the user document, so it runs
+        alongside the other reads.
+        """
+        try:
+            cars_future = None
+            if "cars" in sections:
+                cars_future = submit(CarManager(self.db, self.user_id).get_cars_for_user)
+
+            user_doc = self.user_ref.get()
+            if not user_doc.exists:
+                return {"error": "User not found"}, 404
+
+            user_data = user_doc.to_dict()
+            ride_ids = user_data.get("ridesJoined", []) + user_data.get("ridesPosted", [])
+
+            feed = {}
+            if "unread_count" in sections:
+                feed["unread_count"] = user_data.get("unread_notification_count")
+
+            refs = []
+            if "rides" in sections:
+                refs += [self.db.collection("rides").document(ride_id) for ride_id in ride_ids]
+            if "ride_chats" in sections:
+                refs += [
+                    self.db.collection("ride_chats").document(ride_id) for ride_id in ride_ids
+                ]
+
+            docs = list(self.db.get_all(refs)) if refs else []
+            ride_docs = [doc for doc in docs if doc.reference.parent.id == "rides"]
+            ride_chat_docs = [doc for doc in docs if doc.reference.parent.id == "ride_chats"]
+
+            if "rides" in sections:
+                ride_order = {ride_id: index for index, ride_id in enumerate(ride_ids)}
+                feed["rides"] = [
+                    dict(doc.to_dict(), id=doc.id)
+                    for doc in sorted(ride_docs, key=lambda doc: ride_order[doc.id])
+                    if doc.exists
+                ]
+
+            if "ride_chats" in sections:
+                feed["ride_chats"] = RideChatManager.format_ride_chats(ride_chat_docs)
+
+            if cars_future is not None:
+                cars_response_message, cars_response_status_code = cars_future.result()
+                if cars_response_status_code >= 500:
+                    return cars_response_message, cars_response_status_code
+                feed["cars"] = cars_response_message.get("cars", [])
+
+            return feed, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch home feed.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
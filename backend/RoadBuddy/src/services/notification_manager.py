@@ -1,12 +1,12 @@
 
-from datetime import datetime
-
 import google.cloud
-import pytz
 from firebase_admin.exceptions import FirebaseError
 from google.cloud import firestore
+from serialization import pacific_time
 from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
 
+@traced
 class NotificationManager:
     """
     otificationManager handles storing and managing notifications in Firestore.
@@ -19,22 +19,30 @@ class NotificationManager:
         self.db = db
         self.users_ref = db.collection("users")
 
+    @staticmethod
+    def stage_notification(db, writer, user_id, ride_id, message):
+        """
+        Add a notification for ``user_id`` and its unread count increment to ``writer``
+        (a batch or transaction).
+        """
+        user_ref = db.collection("users").document(user_id)
+        writer.set(user_ref.collection("notifications").document(), {
+            "message": message,
+            "rideId": ride_id,
+            "read": False,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+        writer.set(user_ref, {"unread_notification_count": firestore.Increment(1)}, merge=True)
+
     def store_notification(self, ride_owner_id, ride_id, message):
         """
         Stores a notification inside the user's document and increments unread count.
         """
         try:
-            user_ref = self.users_ref.document(ride_owner_id)
-            notification_ref = user_ref.collection("notifications").document()
-
-            notification_ref.set({
-                "message": message,
-                "rideId": ride_id,
-                "read": False,
-                "createdAt": firestore.SERVER_TIMESTAMP
-            })
-
-            user_ref.set({"unread_notification_count": firestore.Increment(1)}, merge=True)
+            batch = self.db.batch()
+            self.stage_notification(self.db, batch, ride_owner_id, ride_id, message)
+            batch.commit()
 
             return {"message": "Notification stored successfully"}, 201
 
@@ -55,21 +63,7 @@ class NotificationManager:
             batch = self.db.batch()
 
             for user_id in user_ids:
-                user_ref = self.users_ref.document(user_id)
-                notification_ref = user_ref.collection("notifications").document()
-
-                batch.set(notification_ref, {
-                    "message": message,
-                    "rideId": ride_id,
-                    "read": False,
-                    "createdAt": firestore.SERVER_TIMESTAMP
-                })
-
-                batch.set(
-                    user_ref,
-                    {"unread_notification_count": firestore.Increment(1)},
-                    merge=True
-                )
+                self.stage_notification(self.db, batch, user_id, ride_id, message)
 
             batch.commit()
 
@@ -83,6 +77,48 @@ class NotificationManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
+    def store_notifications(self, notifications):
+        """
+        Stores different notifications for different users in one batch.
+        ``notifications`` is a list of (user_id, ride_id, message) tuples.
+        """
+        try:
+            if not notifications:
+                return {"error": "No notifications provided."}, 400
+
+            batch = self.db.batch()
+
+            for user_id, ride_id, message in notifications:
+                self.stage_notification(self.db, batch, user_id, ride_id, message)
+
+            batch.commit()
+
+            return {
+                "message": "Notifications stored successfully."
+            }, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to store notification")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    @staticmethod
+    def format_notification(notification):
+        """
+        A notification document as returned to the app, with its creation time shown
+        in Pacific time.
+        """
+        data = notification.to_dict()
+
+        return {
+            "id": notification.id,
+            "message": data.get("message"),
+            "read": data.get("read"),
+            "rideId": data.get("rideId"),
+            "createdAt": pacific_time(data.get("createdAt"), "%m-%d-%Y %I:%M %p PT")
+        }
+
     def get_all_notifications_for_user(self, user_id):
         """
         Fetches all notifications for a user, marks them as read, and resets the unread count.
@@ -97,30 +133,18 @@ class NotificationManager:
                 .stream()
             )
 
-            pacific_tz = pytz.timezone("America/Los_Angeles")
             notifications_list = []
             batch = self.db.batch()
 
             for notification in notifications:
                 data = notification.to_dict()
-
-                created_at = data.get("createdAt")
-                utc_dt = (
-                    datetime.utcfromtimestamp(created_at.timestamp()).replace(tzinfo=pytz.utc)
-                )
-                pacific_dt = utc_dt.astimezone(pacific_tz)
-                formatted_date = pacific_dt.strftime("%m-%d-%Y %I:%M %p PT")
-
-                notifications_list.append({
-                    "id": notification.id,
-                    "message": data.get("message"),
-                    "read": data.get("read"),
-                    "rideId": data.get("rideId"),
-                    "createdAt": formatted_date
-                })
+                notifications_list.append(self.format_notification(notification))
 
                 if not data.get("read", False):
-                    batch.update(notification.reference, {"read": True})
+                    batch.update(notification.reference, {
+                        "read": True,
+                        "updatedAt": firestore.SERVER_TIMESTAMP,
+                    })
 
             batch.commit()
 
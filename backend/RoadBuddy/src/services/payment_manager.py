@@ -1,5 +1,8 @@
 import stripe
+from concurrency import submit
+from resilience import call_stripe, configure_stripe
 from utils import handle_generic_error
+from tracing import traced
 
 stripe_keys = {
     "secret_key": (
@@ -10,7 +13,12 @@ stripe_keys = {
     ),
 }
 stripe.api_key = stripe_keys["secret_key"]
+configure_stripe()
 
+# Riders pay the ride cost plus a 20% service fee; refunds use the same rate.
+SERVICE_FEE_RATE = 1.20
+
+@traced
 class PaymentManager:
     """
     PaymentManager handles Stripe payment operations.
@@ -26,6 +34,55 @@ class PaymentManager:
         """
         Create a Stripe Payment Sheet for booking a ride.
         """
+        return self._create_payment_sheet(
+            amount,
+            stripe_customer_id,
+            f"Customer for user {self.user_id} (Ride: {ride_id})",
+            "Payment for ride request"
+        )
+
+    def find_customer(self):
+        """
+        Look up the Stripe customer created for this user by an earlier payment sheet.
+        Stripe's search index can lag new customers by up to a minute.
+        """
+        try:
+            customers = call_stripe(
+                stripe.Customer.search,
+                query=f"metadata['user_id']:'{self.user_id}'",
+                limit=1
+            )
+            return {"customer": customers.data[0].id if customers.data else None}, 200
+
+        except stripe.error.StripeError as e:
+            return handle_generic_error(e, "Stripe payment processing failed.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def find_customer_async(self):
+        """
+        Like find_customer, but runs on the shared I/O pool and returns a Future.
+        """
+        return submit(self.find_customer)
+
+    def create_batch_payment_sheet(self, ride_ids, amount, stripe_customer_id=None):
+        """
+        Create one Stripe Payment Sheet covering seats on several rides.
+        """
+        return self._create_payment_sheet(
+            amount,
+            stripe_customer_id,
+            f"Customer for user {self.user_id} (Rides: {', '.join(ride_ids)})",
+            f"Payment for {len(ride_ids)} ride request(s)",
+            metadata={"ride_ids": ",".join(ride_ids)}
+        )
+
+    def _create_payment_sheet(self, amount, stripe_customer_id, customer_description,
+                              payment_description, metadata=None):
+        """
+        Create the Stripe customer (if needed), ephemeral key and payment intent.
+        """
         try:
             amount_cents = int(float(amount) * 100)
         except ValueError:
@@ -33,23 +90,27 @@ class PaymentManager:
 
         try:
             if not stripe_customer_id:
-                customer = stripe.Customer.create(
-                    description=f"Customer for user {self.user_id} (Ride: {ride_id})",
+                customer = call_stripe(
+                    stripe.Customer.create,
+                    description=customer_description,
                     metadata={'user_id': self.user_id}
                 )
                 stripe_customer_id = customer.id
 
-            ephemeral_key = stripe.EphemeralKey.create(
+            ephemeral_key = call_stripe(
+                stripe.EphemeralKey.create,
                 customer=stripe_customer_id,
                 stripe_version='2020-08-27'
             )
 
-            payment_intent = stripe.PaymentIntent.create(
+            payment_intent = call_stripe(
+                stripe.PaymentIntent.create,
                 amount=amount_cents,
                 currency="usd",
                 customer=stripe_customer_id,
                 payment_method_types=["card"],
-                description="Payment for ride request"
+                description=payment_description,
+                metadata=metadata or {}
             )
 
             return {
@@ -59,10 +120,7 @@ class PaymentManager:
             }, 200
 
         except stripe.error.StripeError as e:
-            return {
-                "error": "Stripe payment processing failed.",
-                "details": str(e)
-            }, 500
+            return handle_generic_error(e, "Stripe payment processing failed.")
 
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
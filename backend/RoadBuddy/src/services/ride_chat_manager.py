@@ -1,9 +1,20 @@
 import google.cloud
 from firebase_admin.exceptions import FirebaseError
-import pytz
-from utils import handle_firestore_error, handle_generic_error
+from concurrency import submit
+from serialization import pacific_time
+from single_flight import ride_chat_reads
+from utils import handle_firestore_error, handle_generic_error, select_fields
+from tracing import traced
+from write_coalescer import last_message_writes
 
+# Fields of a ride chat document that list endpoints can be asked to return.
+RIDE_CHAT_FIELDS = (
+    "rideId", "participants", "lastMessage", "from", "to", "owner", "ownerName", "date",
+    "departureTime", "lastMessageTimestamp", "UsernameLastMessage", "updatedAt",
+)
 
+
+@traced
 class RideChatManager:
     """
     RideChatManger is responsible for handling chat-related operation.
@@ -36,9 +47,11 @@ class RideChatManager:
                 'departureTime': data.get('departureTime'),
                 "lastMessageTimestamp": google.cloud.firestore.SERVER_TIMESTAMP,
                 "UsernameLastMessage": "",
+                "updatedAt": google.cloud.firestore.SERVER_TIMESTAMP,
             }
 
             chat_room_doc.set(room_data)
+            ride_chat_reads.forget(ride_id)
 
             return {
                 "message": "Ride chat created successfully",
@@ -53,10 +66,13 @@ class RideChatManager:
 
     def get_ride_chat_details(self, ride_id):
         """
-        Fetches the ride chat details.
+        Fetches the ride chat details. Concurrent fetches of the same chat share one
+        read.
         """
         try:
-            ride_chat_doc = self.ride_chat_ref.document(ride_id).get()
+            ride_chat_doc = ride_chat_reads.do(
+                ride_id, self.ride_chat_ref.document(ride_id).get
+            )
 
             if not ride_chat_doc.exists:
                 return {"error": "Chat ride not found."}, 404
@@ -71,6 +87,7 @@ class RideChatManager:
 
             return {
                 "rideChat": ride_chat_data,
+                "version": ride_chat_doc.update_time.isoformat(),
             }, 200
 
         except FirebaseError as e:
@@ -79,38 +96,53 @@ class RideChatManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def get_all_user_ride_chats(self, ride_chat_ids):
+    def get_ride_chat_details_async(self, ride_id):
         """
-        Fetches all ride chats for the user using a Firestore batch read.
+        Like get_ride_chat_details, but runs on the shared I/O pool and returns a Future.
         """
-        pacific_tz = pytz.timezone("America/Los_Angeles")
+        return submit(self.get_ride_chat_details, ride_id)
 
-        try:
-            if not ride_chat_ids:
-                return {"ride_chats": []}, 200
+    @staticmethod
+    def format_ride_chats(ride_chat_docs, fields=None):
+        """
+        Ride chats from their documents, newest message first, with the last message
+        time shown in Pacific time. Only ``fields`` are kept if given.
+        """
+        ride_chats = []
+        for chat_doc in ride_chat_docs:
+            if chat_doc.exists:
+                chat_data = chat_doc.to_dict()
+                chat_data["id"] = chat_doc.id
 
-            ride_chat_refs = [self.ride_chat_ref.document(ride_id) for ride_id in ride_chat_ids]
-            ride_chat_docs = self.db.get_all(ride_chat_refs)
+                timestamp = chat_data.get("lastMessageTimestamp")
+                chat_data["lastMessageTimestamp"] = pacific_time(
+                    timestamp, "%Y-%m-%d %I:%M %p PT"
+                )
 
-            ride_chats = []
-            for chat_doc in ride_chat_docs:
-                if chat_doc.exists:
-                    chat_data = chat_doc.to_dict()
-                    chat_data["id"] = chat_doc.id
+                chat_data["sort_timestamp"] = timestamp
+                ride_chats.append(chat_data)
 
-                    timestamp = chat_data.get("lastMessageTimestamp")
-                    utc_dt = timestamp.astimezone(pytz.utc)
-                    pacific_dt = utc_dt.astimezone(pacific_tz)
-                    chat_data["lastMessageTimestamp"] = (
-                        pacific_dt.strftime("%Y-%m-%d %I:%M %p PT")
-                    )
+        ride_chats.sort(key=lambda x: x["sort_timestamp"], reverse=True)
+        return [select_fields(chat_data, fields) for chat_data in ride_chats]
 
-                    chat_data["sort_timestamp"] = timestamp
-                    ride_chats.append(chat_data)
+    def get_all_user_ride_chats(self, ride_chat_ids, fields=None):
+        """
+        Fetches all ride chats for the user using a Firestore batch read, reading only
+        ``fields`` if given.
+        """
+        try:
+            if not ride_chat_ids:
+                return {"ride_chats": []}, 200
 
-            ride_chats.sort(key=lambda x: x["sort_timestamp"], reverse=True)
+            field_paths = None
+            if fields is not None:
+                # The last message time orders the chats, even if it is not returned.
+                field_paths = sorted({*fields, "lastMessageTimestamp"})
 
-            return {"ride_chats": ride_chats}, 200
+            ride_chat_refs = [self.ride_chat_ref.document(ride_id) for ride_id in ride_chat_ids]
+            ride_chat_docs = self.db.get_all(ride_chat_refs, field_paths=field_paths)
+
+            return {"ride_chats": self.format_ride_chats(ride_chat_docs, fields)}, 200
 
         except FirebaseError as e:
             return handle_firestore_error(e, "Failed to fetch user ride chats.")
@@ -154,8 +186,10 @@ class RideChatManager:
                     "message": "User is already a participant of this ride chat."
                 }, 200
 
-            participants.append(self.user_id)
-            self.ride_chat_ref.document(ride_id).update({"participants": participants})
+            self.ride_chat_ref.document(ride_id).update({
+                "participants": google.cloud.firestore.ArrayUnion([self.user_id]),
+                "updatedAt": google.cloud.firestore.SERVER_TIMESTAMP,
+            })
 
             return {
                 "message": "User successfully added as a participant of this chat.",
@@ -185,8 +219,10 @@ class RideChatManager:
                     "message": "User is not a particpant of this ride chat."
                 }, 400
 
-            participants.remove(ride_id)
-            self.ride_chat_ref.document(ride_id).update({"participants": participants})
+            self.ride_chat_ref.document(ride_id).update({
+                "participants": google.cloud.firestore.ArrayRemove([self.user_id]),
+                "updatedAt": google.cloud.firestore.SERVER_TIMESTAMP,
+            })
 
             return {
                 "message": "User successfully removed as a participant of this chat.",
@@ -201,9 +237,13 @@ class RideChatManager:
     def update_last_message(self, ride_id, text, time):
         """
         Fetches the ride chat document, extracts metadata, and updates last message info.
+        The update is buffered and written at most once per LAST_MESSAGE_FLUSH_SECONDS
+        per chat, so a busy chat's document is not rewritten for every message.
         """
         try:
-            ride_chat_doc = self.ride_chat_ref.document(ride_id).get()
+            ride_chat_doc = ride_chat_reads.do(
+                ride_id, self.ride_chat_ref.document(ride_id).get
+            )
 
             if not ride_chat_doc.exists:
                 return {"error": "Ride chat not found."}, 404
@@ -217,10 +257,11 @@ class RideChatManager:
             if self.user_id not in participants:
                 return {"error": "User is not a participant of this chat."}, 400
 
-            self.ride_chat_ref.document(ride_id).update({
+            last_message_writes.update(self.ride_chat_ref.document(ride_id), {
                 "lastMessageTimestamp": time,
                 "lastMessage": text,
-                "UsernameLastMessage": self.user_name
+                "UsernameLastMessage": self.user_name,
+                "updatedAt": google.cloud.firestore.SERVER_TIMESTAMP,
             })
 
             return {
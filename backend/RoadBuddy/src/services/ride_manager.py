@@ -1,8 +1,30 @@
 from datetime import datetime
 import pytz
 from firebase_admin.exceptions import FirebaseError
-from utils import handle_firestore_error, handle_generic_error
-
+from google.api_core.exceptions import GoogleAPICallError
+from google.cloud import firestore
+from concurrency import submit
+import booking
+from segment_tree import SegmentTree
+from single_flight import ride_reads
+from services.sync_manager import SyncManager
+from streaming import prefetch
+from utils import handle_firestore_error, handle_generic_error, select_fields
+from tracing import traced
+
+# Fields of a ride document that list endpoints can be asked to return.
+RIDE_FIELDS = (
+    "ownerID", "ownerName", "from", "to", "date", "departureTime", "maxPassengers",
+    "cost", "currentPassengers", "stops", "segmentSeats", "legBookings", "car",
+    "licensePlate", "status", "createdAt", "updatedAt",
+)
+
+# Firestore rejects batches with more than 500 writes. Deleting a ride takes two: the
+# ride itself and its sync tombstone.
+MAX_BATCH_WRITES = 500
+WRITES_PER_DELETED_RIDE = 2
+
+@traced
 class RideManager:
     """
     RideManager is responsible for handling ride-related operation for a user.
@@ -37,10 +59,10 @@ class RideManager:
 
     def get_ride(self, ride_id):
         """
-        Fetch a ride.
+        Fetch a ride. Concurrent fetches of the same ride share one read.
         """
         try:
-            ride_doc = self.ride_ref.document(ride_id).get()
+            ride_doc = ride_reads.do(ride_id, self.ride_ref.document(ride_id).get)
 
             if not ride_doc.exists:
                 return {"error": "Ride not found"}, 404
@@ -48,6 +70,7 @@ class RideManager:
             ride_data = ride_doc.to_dict()
             return {
                 "ride": ride_data,
+                "version": ride_doc.update_time.isoformat(),
             }, 200
 
         except FirebaseError as e:
@@ -56,14 +79,20 @@ class RideManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def get_rides_by_ids(self, ride_ids):
+    def get_ride_async(self, ride_id):
+        """
+        Like get_ride, but runs on the shared I/O pool and returns a Future.
+        """
+        return submit(self.get_ride, ride_id)
+
+    def get_rides_by_ids(self, ride_ids, fields=None):
         """
-        Fetch multiple rides based on a list of ride IDs.
+        Fetch multiple rides based on a list of ride IDs, reading only ``fields`` if given.
         """
         try:
             # Convert ride IDs to document references
             ride_refs = [self.ride_ref.document(ride_id) for ride_id in ride_ids]
-            ride_docs = self.db.get_all(ride_refs)
+            ride_docs = self.db.get_all(ride_refs, field_paths=fields)
 
             rides = []
             for ride_doc in ride_docs:
@@ -92,6 +121,14 @@ class RideManager:
             if self.is_duplicate_ride(rides_posted, data):
                 return {"error": "Duplicate ride post detected"}, 400
 
+            intermediate_stops = data.get('stops') or []
+            if not isinstance(intermediate_stops, list) or not all(
+                isinstance(stop, str) and stop.strip() for stop in intermediate_stops
+            ):
+                return {"error": "Stops must be a list of place names."}, 400
+
+            stops = [data.get('from'), *intermediate_stops, data.get('to')]
+
             ride_data = {
                 "ownerID": self.user_id,
                 "ownerName": self.user_name,
@@ -102,12 +139,19 @@ class RideManager:
                 "maxPassengers": data.get('max_passengers'),
                 "cost": data.get('cost'),
                 "currentPassengers": [],
+                "stops": stops,
+                "segmentSeats": [0] * (len(stops) - 1),
+                "legBookings": {},
                 "car": data.get('car_select'),
                 "licensePlate": data.get('license_plate'),
                 "status": "open",
+                "createdAt": firestore.SERVER_TIMESTAMP,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
             }
 
             ride_ref.set(ride_data)
+            del ride_data["createdAt"]
+            del ride_data["updatedAt"]
 
             return {
                 "message": "Ride posted successfully",
@@ -121,9 +165,43 @@ class RideManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def delete_ride(self, ride_id):
+    def get_rides_created_after(self, created_after=None, fields=None):
         """
-        Delete a ride.
+        Fetch rides created after a timestamp (or every ride), reading only ``fields``.
+        Returns (ride_id, ride_data) pairs and the newest creation time seen.
+        """
+        try:
+            query = self.ride_ref
+            if created_after is not None:
+                query = query.where("createdAt", ">", created_after)
+            if fields is not None:
+                query = query.select(sorted({*fields, "createdAt"}))
+
+            rides = []
+            latest = created_after
+            for ride_doc in query.stream():
+                ride_data = ride_doc.to_dict()
+                rides.append((ride_doc.id, ride_data))
+
+                created_at = ride_data.get("createdAt")
+                if created_at is not None and (latest is None or created_at > latest):
+                    latest = created_at
+
+            return {
+                "rides": rides,
+                "latest": latest
+            }, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch new rides.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def delete_ride(self, ride_id, stage_tasks=None):
+        """
+        Delete a ride. ``stage_tasks(batch, ride_data)`` can add writes that must commit
+        together with the deletion.
         """
         try:
             ride_doc = self.ride_ref.document(ride_id).get()
@@ -139,7 +217,17 @@ class RideManager:
                     "error": "Only the owner of this ride can delete it."
                 }, 400
 
-            self.ride_ref.document(ride_id).delete()
+            batch = self.db.batch()
+            batch.delete(
+                self.ride_ref.document(ride_id),
+                option=self.db.write_option(last_update_time=ride_doc.update_time)
+            )
+            SyncManager.stage_tombstone(
+                self.db, batch, ride_id, [ride_owner_id] + ride_data.get("currentPassengers", [])
+            )
+            if stage_tasks:
+                stage_tasks(batch, ride_data)
+            batch.commit()
 
             return {
                 "message": "Ride successfully deleted",
@@ -152,49 +240,236 @@ class RideManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def add_passenger(self, ride_id):
+    def check_booking(self, ride_data, item, seat_tree=None):
+        """
+        Check that the user can book ``item`` on the ride.
+        Returns (leg, None) or (None, error message).
+        """
+        if ride_data.get("ownerID") == self.user_id:
+            return None, "User cannot book its own ride."
+
+        if self.user_id in (ride_data.get("currentPassengers") or []):
+            return None, "User already a passenger of this ride."
+
+        if booking.has_departed(ride_data):
+            return None, "This ride is no longer available."
+
+        leg = booking.resolve_leg(ride_data, item.get("fromStop"), item.get("toStop"))
+        if leg is None:
+            return None, "Invalid stops for this ride."
+
+        if not booking.has_free_seat(ride_data, *leg, seat_tree=seat_tree, seats=item["seats"]):
+            return None, "Not enough seats left on this ride."
+
+        return leg, None
+
+    def validate_booking_items(self, items):
+        """
+        Check every booking item against its ride with a single batched read.
+        Returns the rides keyed by ID and the total fare for all seats.
+        """
+        try:
+            ride_refs = [self.ride_ref.document(item["rideId"]) for item in items]
+            rides = {}
+            for ride_doc in self.db.get_all(ride_refs):
+                if ride_doc.exists:
+                    rides[ride_doc.id] = ride_doc.to_dict()
+
+            total = 0.0
+            for item in items:
+                ride_data = rides.get(item["rideId"])
+                if ride_data is None:
+                    return {"error": "Ride not found", "rideId": item["rideId"]}, 404
+
+                _, error = self.check_booking(ride_data, item)
+                if error:
+                    return {"error": error, "rideId": item["rideId"]}, 400
+
+                total += float(ride_data.get("cost") or 0) * item["seats"]
+
+            return {
+                "rides": rides,
+                "total": total
+            }, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch rides.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def get_seat_availability(self, ride_id, from_stop=None, to_stop=None):
         """
-        Add a user to the ride as a passenger.
+        Check whether a seat is free between two stops of a ride.
         """
         try:
             ride_doc = self.ride_ref.document(ride_id).get()
 
+            if not ride_doc.exists:
+                return {"error": "Ride not found"}, 404
+
+            ride_data = ride_doc.to_dict()
+            leg = booking.resolve_leg(ride_data, from_stop, to_stop)
+            if leg is None:
+                return {"error": "Invalid stops for this ride."}, 400
+
+            seat_tree = SegmentTree(booking.get_segment_seats(ride_data))
+            max_passengers = int(ride_data.get("maxPassengers", 0))
+
+            return {
+                "stops": booking.get_stops(ride_data),
+                "fromStop": leg[0],
+                "toStop": leg[1],
+                "available": seat_tree.range_max(*leg) < max_passengers,
+                "seatsLeft": max_passengers - seat_tree.range_max(*leg),
+            }, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch seat availability.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def add_passenger(self, ride_id, from_stop=None, to_stop=None):
+        """
+        Add a user to the ride as a passenger, optionally for a leg between two stops.
+        The seat check and the seat update run in one transaction.
+        """
+        ride_doc_ref = self.ride_ref.document(ride_id)
+
+        @firestore.transactional
+        def book_seat(transaction):
+            """
+            Reserve a seat on every segment of the leg if none of them is full.
+            """
+            ride_doc = ride_doc_ref.get(transaction=transaction)
+
             if not ride_doc.exists:
                 return {"error": "Ride not found"}, 404
 
             ride_data = ride_doc.to_dict()
             current_passengers = ride_data.get("currentPassengers", [])
-            max_passengers = ride_data.get("maxPassengers", 0)
+            max_passengers = int(ride_data.get("maxPassengers", 0))
 
             if self.user_id in current_passengers:
                 return {"message": "User is already a passenger"}, 200
 
-            if len(current_passengers) >= max_passengers:
+            leg = booking.resolve_leg(ride_data, from_stop, to_stop)
+            if leg is None:
+                return {"error": "Invalid stops for this ride."}, 400
+
+            seat_tree = SegmentTree(booking.get_segment_seats(ride_data))
+            if not booking.has_free_seat(ride_data, *leg, seat_tree=seat_tree):
                 return {"error": "Ride is full"}, 400
 
+            seat_tree.range_add(*leg, 1)
+            segment_seats = seat_tree.to_list()
             current_passengers.append(self.user_id)
 
-            if len(current_passengers) == max_passengers:
-                self.ride_ref.document(ride_id).update({"status": "closed"})
-
-            self.ride_ref.document(ride_id).update({"currentPassengers": current_passengers})
+            transaction.update(ride_doc_ref, {
+                "currentPassengers": current_passengers,
+                "segmentSeats": segment_seats,
+                f"legBookings.{self.user_id}": list(leg),
+                "status": "closed" if min(segment_seats) >= max_passengers else "open",
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
 
             return {
                 "message": "User successfully booked this ride.",
             }, 200
 
+        try:
+            return book_seat(self.db.transaction())
+
         except FirebaseError as e:
             return handle_firestore_error(e, "Failed to add user to this ride, please try again.")
 
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def remove_passenger(self, ride_id):
+    def add_passenger_to_rides(self, items):
         """
-        Remove a passenger from a ride.
+        Book seats on several rides in one transaction. The seat counts of every ride,
+        the user's joined rides and the ride chat participants either all change or
+        none do.
         """
+        ride_refs = [self.ride_ref.document(item["rideId"]) for item in items]
+        user_ref = self.db.collection("users").document(self.user_id)
+        ride_chat_ref = self.db.collection("ride_chats")
+
+        @firestore.transactional
+        def book_seats(transaction):
+            """
+            Re-check every item against the current ride data and reserve its seats.
+            """
+            rides = {}
+            for ride_doc in self.db.get_all(ride_refs, transaction=transaction):
+                if ride_doc.exists:
+                    rides[ride_doc.id] = ride_doc.to_dict()
+
+            updates = []
+            for item, ride_doc_ref in zip(items, ride_refs):
+                ride_data = rides.get(item["rideId"])
+                if ride_data is None:
+                    return {"error": "Ride not found", "rideId": item["rideId"]}, 404
+
+                seat_tree = SegmentTree(booking.get_segment_seats(ride_data))
+                leg, error = self.check_booking(ride_data, item, seat_tree)
+                if error:
+                    return {"error": error, "rideId": item["rideId"]}, 400
+
+                seat_tree.range_add(*leg, item["seats"])
+                segment_seats = seat_tree.to_list()
+                max_passengers = int(ride_data.get("maxPassengers", 0))
+
+                updates.append((ride_doc_ref, {
+                    "currentPassengers": firestore.ArrayUnion([self.user_id]),
+                    "segmentSeats": segment_seats,
+                    f"legBookings.{self.user_id}": list(leg),
+                    f"seatCounts.{self.user_id}": item["seats"],
+                    "status": "closed" if min(segment_seats) >= max_passengers else "open",
+                    "updatedAt": firestore.SERVER_TIMESTAMP,
+                }))
+
+            for ride_doc_ref, update in updates:
+                transaction.update(ride_doc_ref, update)
+                transaction.update(ride_chat_ref.document(ride_doc_ref.id), {
+                    "participants": firestore.ArrayUnion([self.user_id]),
+                    "updatedAt": firestore.SERVER_TIMESTAMP,
+                })
+
+            transaction.update(user_ref, {
+                "ridesJoined": firestore.ArrayUnion([item["rideId"] for item in items])
+            })
+
+            return {
+                "message": "User successfully booked these rides.",
+                "rides": rides,
+            }, 200
+
         try:
-            ride_doc = self.ride_ref.document(ride_id).get()
+            return book_seats(self.db.transaction())
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to book these rides, please try again.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def remove_passenger(self, ride_id, stage_tasks=None):
+        """
+        Remove a passenger from a ride and free their seat on the segments they booked.
+        ``stage_tasks(transaction, ride_data)`` can add writes that must commit together
+        with the removal. It is called again each time the transaction is retried.
+        """
+        ride_doc_ref = self.ride_ref.document(ride_id)
+
+        @firestore.transactional
+        def release_seat(transaction):
+            """
+            Release the passenger's seat on every segment of their leg.
+            """
+            ride_doc = ride_doc_ref.get(transaction=transaction)
 
             if not ride_doc.exists:
                 return {"error": "Ride not found"}, 404
@@ -213,55 +488,150 @@ class RideManager:
                     "error": "User is not a passenger of the ride."
                 }, 400
 
+            leg_bookings = ride_data.get("legBookings") or {}
+            leg = booking.resolve_leg(ride_data, *leg_bookings.get(self.user_id, (None, None)))
+            seats = (ride_data.get("seatCounts") or {}).get(self.user_id, 1)
+
+            seat_tree = SegmentTree(booking.get_segment_seats(ride_data))
+            seat_tree.range_add(*leg, -seats)
             current_passengers.remove(self.user_id)
-            self.ride_ref.document(ride_id).update({"currentPassengers": current_passengers})
 
-            if ride_data.get("status") == "closed":
-                self.ride_ref.document(ride_id).update({"status": "open"})
+            transaction.update(ride_doc_ref, {
+                "currentPassengers": current_passengers,
+                "segmentSeats": [max(count, 0) for count in seat_tree.to_list()],
+                f"legBookings.{self.user_id}": firestore.DELETE_FIELD,
+                f"seatCounts.{self.user_id}": firestore.DELETE_FIELD,
+                "status": "open",
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+            SyncManager.stage_tombstone(self.db, transaction, ride_id, [self.user_id])
+            if stage_tasks:
+                stage_tasks(transaction, ride_data)
 
             return {
                 "message": "User successfully removed from the ride.",
             }, 200
 
+        try:
+            return release_seat(self.db.transaction())
+
         except FirebaseError as e:
             return handle_firestore_error(e, "Failed to remove user from this ride.")
 
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
-    def get_avaiable_rides(self, excluded_rides):
+    def _iter_avaiable_rides(self, excluded_rides, fields=None):
+        pacific_zone = pytz.timezone("America/Los_Angeles")
+        available_rides_query = self.ride_ref.where("status", "==", "open")
+        if fields is not None:
+            # The departure time is needed to drop past rides, even if it is not returned.
+            available_rides_query = available_rides_query.select(
+                sorted({*fields, "date", "departureTime"})
+            )
+
+        for ride_doc in available_rides_query.stream():
+            ride_data = ride_doc.to_dict()
+            ride_id = ride_doc.id
+
+            ride_date = ride_data["date"]
+            ride_time = ride_data["departureTime"]
+            ride_datetime = datetime.strptime(f"{ride_date} {ride_time}", "%Y-%m-%d %I:%M %p")
+            ride_datetime = pacific_zone.localize(ride_datetime)
+
+            if ride_datetime >= datetime.now(pacific_zone):
+                if ride_id not in excluded_rides:
+                    ride_data["id"] = ride_id
+                    yield select_fields(ride_data, fields)
+
+    def stream_avaiable_rides(self, excluded_rides, fields=None):
+        """
+        Like get_avaiable_rides, but ``rides`` is an iterator that reads the rides from
+        Firestore as it is consumed.
+        """
+        try:
+            return {
+                "rides": prefetch(self._iter_avaiable_rides(excluded_rides, fields))
+            }, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch all available rides.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def get_avaiable_rides(self, excluded_rides, fields=None):
         """
         Fetch all available rides with status 'open', excluding rides the user has joined or posted.
+        Only ``fields`` are read and returned if given.
         """
-        pacific_zone = pytz.timezone("America/Los_Angeles")
         try:
-            available_rides_query = (
-                self.ride_ref
-                .where("status", "==", "open")
-                .stream()
-            )
+            return {
+                "rides": list(self._iter_avaiable_rides(excluded_rides, fields))
+            }, 200
 
-            available_rides = []
-            for ride_doc in available_rides_query:
-                ride_data = ride_doc.to_dict()
-                ride_id = ride_doc.id
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to fetch all available rides.")
 
-                ride_date = ride_data["date"]
-                ride_time = ride_data["departureTime"]
-                ride_datetime = datetime.strptime(f"{ride_date} {ride_time}", "%Y-%m-%d %I:%M %p")
-                ride_datetime = pacific_zone.localize(ride_datetime)
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def _commit_ride_deletions(self, rides):
+        """
+        Delete ``rides`` and record their tombstones, in batches that stay under
+        Firestore's write limit. A failed batch does not stop the others.
+
+        Returns the rides that were deleted and the IDs of those that were not.
+        """
+        deleted_rides, failed_ride_ids = [], []
+        chunk_size = MAX_BATCH_WRITES // WRITES_PER_DELETED_RIDE
 
-                if ride_datetime >= datetime.now(pacific_zone):
-                    if ride_id not in excluded_rides:
-                        ride_data["id"] = ride_id
-                        available_rides.append(ride_data)
+        for start in range(0, len(rides), chunk_size):
+            chunk = rides[start:start + chunk_size]
+            batch = self.db.batch()
+            for ride_data in chunk:
+                batch.delete(self.ride_ref.document(ride_data["id"]))
+                SyncManager.stage_tombstone(
+                    self.db, batch, ride_data["id"],
+                    [ride_data.get("ownerID")] + ride_data.get("currentPassengers", [])
+                )
+            try:
+                batch.commit()
+            except (FirebaseError, GoogleAPICallError) as e:
+                print(f"Failed to delete {len(chunk)} rides: {e}")
+                failed_ride_ids.extend(ride_data["id"] for ride_data in chunk)
+                continue
+            deleted_rides.extend(chunk)
+
+        return deleted_rides, failed_ride_ids
+
+    def delete_expired_rides(self, ride_ids):
+        """
+        Deletes the given rides if their departure time has passed. Only the listed
+        rides are read, so the cost follows the number of rides that expired.
+        """
+        try:
+            expired_rides = []
+
+            ride_refs = [self.ride_ref.document(ride_id) for ride_id in ride_ids]
+            for ride_doc in self.db.get_all(ride_refs):
+                if not ride_doc.exists:
+                    continue
+
+                ride_data = ride_doc.to_dict()
+                if booking.has_departed(ride_data):
+                    ride_data["id"] = ride_doc.id
+                    expired_rides.append(ride_data)
+
+            deleted_rides, failed_ride_ids = self._commit_ride_deletions(expired_rides)
 
             return {
-                "rides": available_rides
+                "deletedRides": deleted_rides,
+                "failedRideIds": failed_ride_ids
             }, 200
 
         except FirebaseError as e:
-            return handle_firestore_error(e, "Failed to fetch all available rides.")
+            return handle_firestore_error(e, "Failed to delete expired rides")
 
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
@@ -275,8 +645,7 @@ class RideManager:
         today_date = now_pacific.strftime("%Y-%m-%d")
 
         try:
-            deleted_rides = []
-            batch = self.db.batch()
+            past_rides = []
 
             rides_query = (
                 self.ride_ref
@@ -296,10 +665,10 @@ class RideManager:
                 ride_datetime = pacific_zone.localize(ride_datetime)
 
                 if ride_datetime < datetime.now(pacific_zone):
-                    deleted_rides.append(ride_data)
-                    batch.delete(self.ride_ref.document(ride_id))
+                    past_rides.append(ride_data)
 
-            batch.commit()
+            # Rides that fail to delete are picked up again by the next sweep.
+            deleted_rides, _ = self._commit_ride_deletions(past_rides)
 
             return {
                 "deletedRides": deleted_rides
@@ -0,0 +1,331 @@
+from datetime import datetime
+import google.cloud
+import pytz
+from firebase_admin.exceptions import FirebaseError
+from google.api_core.exceptions import GoogleAPICallError
+from matching import solve_assignment
+from services.notification_manager import NotificationManager
+import booking
+from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
+
+# Firestore rejects batches with more than 500 writes.
+MAX_BATCH_WRITES = 500
+
+@traced
+class RideRequestManager:
+    """
+    RideRequestManager handles pending ride requests and the batch job that matches
+    them to posted rides.
+    """
+
+    def __init__(self, db, user_id=None, user_name=None):
+        """
+        Initialize the RideRequestManager.
+        """
+        self.db = db
+        self.user_id = user_id
+        self.user_name = user_name
+        self.ride_request_ref = db.collection("ride_requests")
+        self.ride_ref = db.collection("rides")
+
+    def create_ride_request(self, data):
+        """
+        Queue a request for a seat from one place to another at a given time.
+        """
+        try:
+            request_ref = self.ride_request_ref.document()
+            request_data = {
+                "riderID": self.user_id,
+                "riderName": self.user_name,
+                "from": data.get("from"),
+                "to": data.get("to"),
+                "date": data.get("date"),
+                "departureTime": data.get("departure_time"),
+                "status": "pending",
+                "createdAt": google.cloud.firestore.SERVER_TIMESTAMP,
+            }
+
+            batch = self.db.batch()
+            batch.set(request_ref, request_data)
+            batch.update(
+                self.db.collection("users").document(self.user_id),
+                {"ridesRequested": google.cloud.firestore.ArrayUnion([request_ref.id])}
+            )
+            batch.commit()
+
+            return {
+                "message": "Ride request queued successfully",
+                "requestId": request_ref.id
+            }, 201
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to queue ride request.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    @staticmethod
+    def match_key(data):
+        """
+        Key that two documents must share to be matched: same route, same day.
+        """
+        return (
+            (data.get("from") or "").strip().lower(),
+            (data.get("to") or "").strip().lower(),
+            data.get("date"),
+        )
+
+    @staticmethod
+    def departure_minutes(data):
+        """
+        Departure time of a ride or request as minutes since midnight, or None.
+        """
+        try:
+            departure = datetime.strptime(data.get("departureTime") or "", "%I:%M %p")
+        except ValueError:
+            return None
+        return departure.hour * 60 + departure.minute
+
+    @staticmethod
+    def build_candidates(requests, rides, max_wait_minutes=60, max_candidates=10):
+        """
+        Build the sparse rider x ride cost matrix.
+
+        A rider can only take a ride on the same route and day that leaves within
+        ``max_wait_minutes`` of the requested time, is not their own, and that they have
+        not already joined. A rider gets at most one ride per route and day: only their
+        first request for it is matched, and none if they already ride on that route
+        that day. Their other requests get no candidates and stay pending. The cost is
+        the gap in minutes plus the fare in whole dollars, and only the
+        ``max_candidates`` cheapest rides are kept per rider. Matched riders travel the
+        whole route, so a ride's free seats are limited by its busiest segment.
+
+        Returns (candidates, seats) in the format expected by ``solve_assignment``.
+        """
+        seats = []
+        rides_by_key = {}
+        for index, ride in enumerate(rides):
+            booked = max(booking.get_segment_seats(ride), default=0)
+            seats.append(max(int(ride.get("maxPassengers") or 0) - booked, 0))
+            minutes = RideRequestManager.departure_minutes(ride)
+            if seats[index] and minutes is not None:
+                rides_by_key.setdefault(RideRequestManager.match_key(ride), []).append(
+                    (index, minutes)
+                )
+
+        riding = {
+            (rider_id, RideRequestManager.match_key(ride))
+            for ride in rides
+            for rider_id in ride.get("currentPassengers") or []
+        }
+
+        candidates = []
+        for request in requests:
+            options = []
+            wanted = RideRequestManager.departure_minutes(request)
+            rider_id = request.get("riderID")
+            key = RideRequestManager.match_key(request)
+
+            if (rider_id, key) in riding:
+                candidates.append(options)
+                continue
+            riding.add((rider_id, key))
+
+            for index, minutes in rides_by_key.get(key, []):
+                ride = rides[index]
+                gap = abs(minutes - wanted) if wanted is not None else max_wait_minutes
+                if gap > max_wait_minutes:
+                    continue
+                if rider_id == ride.get("ownerID"):
+                    continue
+                options.append((index, gap + int(float(ride.get("cost") or 0))))
+
+            if len(options) > max_candidates:
+                options.sort(key=lambda option: option[1])
+                options = options[:max_candidates]
+            candidates.append(options)
+
+        return candidates, seats
+
+    def get_pending_requests(self):
+        """
+        Fetch every pending ride request.
+        """
+        query = self.ride_request_ref.where("status", "==", "pending").stream()
+
+        requests = []
+        for request_doc in query:
+            request_data = request_doc.to_dict()
+            request_data["id"] = request_doc.id
+            requests.append(request_data)
+
+        return requests
+
+    def get_open_rides(self, dates):
+        """
+        Fetch open rides on the given dates that have not departed yet.
+        """
+        pacific_zone = pytz.timezone("America/Los_Angeles")
+        now_pacific = datetime.now(pacific_zone)
+
+        rides = []
+        for date in sorted(dates):
+            query = (
+                self.ride_ref
+                .where("status", "==", "open")
+                .where("date", "==", date)
+                .stream()
+            )
+            for ride_doc in query:
+                ride_data = ride_doc.to_dict()
+                ride_datetime = datetime.strptime(
+                    f"{ride_data['date']} {ride_data['departureTime']}", "%Y-%m-%d %I:%M %p"
+                )
+                if pacific_zone.localize(ride_datetime) <= now_pacific:
+                    continue
+                ride_data["id"] = ride_doc.id
+                ride_data["updateTime"] = ride_doc.update_time
+                rides.append(ride_data)
+
+        return rides
+
+    def _booking_writes(self, batch, ride, requests):
+        """
+        Stage every write needed to book ``requests`` onto ``ride``.
+        The ride update is conditional on the ride not having changed since it was read.
+        """
+        ride_id = ride["id"]
+        rider_ids = [request["riderID"] for request in requests]
+        users_ref = self.db.collection("users")
+        firestore = google.cloud.firestore
+
+        segment_seats = [
+            seats + len(rider_ids) for seats in booking.get_segment_seats(ride)
+        ]
+        ride_update = {
+            "currentPassengers": firestore.ArrayUnion(rider_ids),
+            "segmentSeats": segment_seats,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+        if min(segment_seats) >= int(ride["maxPassengers"]):
+            ride_update["status"] = "closed"
+        batch.update(
+            self.ride_ref.document(ride_id),
+            ride_update,
+            option=self.db.write_option(last_update_time=ride["updateTime"])
+        )
+
+        batch.update(
+            self.db.collection("ride_chats").document(ride_id),
+            {
+                "participants": firestore.ArrayUnion(rider_ids),
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            }
+        )
+
+        for request in requests:
+            batch.update(self.ride_request_ref.document(request["id"]), {
+                "status": "matched",
+                "rideId": ride_id,
+                "matchedAt": firestore.SERVER_TIMESTAMP,
+            })
+            batch.update(users_ref.document(request["riderID"]), {
+                "ridesJoined": firestore.ArrayUnion([ride_id]),
+                "ridesRequested": firestore.ArrayRemove([request["id"]]),
+            })
+
+            NotificationManager.stage_notification(
+                self.db, batch, request["riderID"], ride_id,
+                f"You have been matched with {ride.get('ownerName')}'s ride.\n"
+                f"From: {ride['from']}\n"
+                f"To: {ride['to']}"
+            )
+
+        NotificationManager.stage_notification(
+            self.db, batch, ride["ownerID"], ride_id,
+            f"{len(rider_ids)} rider(s) have been matched to your ride.\n"
+            f"From: {ride['from']}\n"
+            f"To: {ride['to']}"
+        )
+
+    @staticmethod
+    def _writes_per_ride(rider_count):
+        """
+        Number of writes ``_booking_writes`` stages for a ride with ``rider_count`` riders.
+        """
+        return 4 + 4 * rider_count
+
+    def commit_bookings(self, bookings):
+        """
+        Commit proposed bookings, packing several rides into each write batch.
+
+        ``bookings`` is a list of (ride, requests) pairs. If a batch fails - usually
+        because one of its rides was booked or edited since it was read - its rides are
+        retried one batch each so only the stale rides are skipped. Skipped requests stay
+        pending for the next run.
+
+        Returns the number of requests that were booked.
+        """
+        groups = []
+        current, size = [], 0
+        for ride, requests in bookings:
+            writes = self._writes_per_ride(len(requests))
+            if current and size + writes > MAX_BATCH_WRITES:
+                groups.append(current)
+                current, size = [], 0
+            current.append((ride, requests))
+            size += writes
+        if current:
+            groups.append(current)
+
+        booked = 0
+        for group in groups:
+            attempts = [group] if len(group) == 1 else [group, *([item] for item in group)]
+            for attempt in attempts:
+                batch = self.db.batch()
+                for ride, requests in attempt:
+                    self._booking_writes(batch, ride, requests)
+                try:
+                    batch.commit()
+                except (FirebaseError, GoogleAPICallError) as e:
+                    print(f"Ride matching batch skipped: {e}")
+                    continue
+                booked += sum(len(requests) for _, requests in attempt)
+                if attempt is group:
+                    break
+
+        return booked
+
+    def match_pending_requests(self, max_wait_minutes=60):
+        """
+        Assign pending ride requests to open rides and book the assignments in bulk.
+        """
+        try:
+            requests = self.get_pending_requests()
+            if not requests:
+                return {"matched": 0, "pending": 0}, 200
+
+            rides = self.get_open_rides({request.get("date") for request in requests})
+            candidates, seats = self.build_candidates(requests, rides, max_wait_minutes)
+            assignment = solve_assignment(candidates, seats)
+
+            requests_by_ride = {}
+            for request_index, ride_index in assignment.items():
+                requests_by_ride.setdefault(ride_index, []).append(requests[request_index])
+
+            booked = self.commit_bookings([
+                (rides[ride_index], ride_requests)
+                for ride_index, ride_requests in requests_by_ride.items()
+            ])
+
+            return {
+                "matched": booked,
+                "pending": len(requests) - booked
+            }, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to match ride requests.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
@@ -0,0 +1,253 @@
+from datetime import datetime, timedelta, timezone
+from firebase_admin.exceptions import FirebaseError
+from google.cloud import firestore
+from services.notification_manager import NotificationManager
+from services.ride_chat_manager import RideChatManager
+from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
+
+SYNC_COLLECTIONS = ("rides", "ride_chats", "notifications")
+
+# Tombstones older than this are purged; clients whose token is older do a full sync.
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@traced
+class SyncManager:
+    """
+    SyncManager returns what changed in a user's rides, ride chats and notifications
+    since the client's last sync.
+
+    Every write to these documents sets ``updatedAt`` to the server time, and removing a
+    ride from a user leaves a tombstone in ``tombstones``. A sync token is the largest
+    ``updatedAt`` or ``deletedAt`` the client has seen, so a delta sync is one range
+    query per collection and only reads documents that changed. All reads of a sync run
+    in one read-only transaction, so they see the same snapshot and no write can fall
+    between two queries.
+    """
+
+    def __init__(self, db, user_id):
+        """
+        Initialize the SyncManager.
+        """
+        self.db = db
+        self.user_id = user_id
+        self.user_ref = db.collection("users").document(user_id)
+        self.tombstones_ref = db.collection("tombstones")
+
+    @staticmethod
+    def stage_tombstone(db, writer, ride_id, user_ids):
+        """
+        Record in ``writer`` (a batch or transaction) that a ride and its chat are gone
+        for ``user_ids``.
+        """
+        writer.set(db.collection("tombstones").document(), {
+            "rideId": ride_id,
+            "userIds": list(user_ids),
+            "deletedAt": firestore.SERVER_TIMESTAMP,
+        })
+
+    @staticmethod
+    def parse_token(token):
+        """
+        Timestamp of a sync token, or None for a full sync. Raises ValueError if the
+        token is malformed.
+        """
+        if not token:
+            return None
+        since = datetime.fromisoformat(token)
+        if since.tzinfo is None:
+            raise ValueError("Sync token has no timezone")
+        return since
+
+    @staticmethod
+    def _token(since, timestamps):
+        latest = max((t for t in timestamps if t is not None), default=None)
+        if latest is None or (since is not None and latest <= since):
+            latest = since or EPOCH
+        return latest.isoformat()
+
+    def _ride_ids(self, transaction):
+        user_data = self.user_ref.get(transaction=transaction).to_dict() or {}
+        return user_data.get("ridesJoined", []) + user_data.get("ridesPosted", [])
+
+    def _deleted_since(self, since, transaction):
+        tombstones = (
+            self.tombstones_ref
+            .where("userIds", "array_contains", self.user_id)
+            .where("deletedAt", ">", since)
+            .stream(transaction=transaction)
+        )
+        return [tombstone.to_dict() for tombstone in tombstones]
+
+    def _changed_since(self, transaction, collection, condition, since):
+        return list(
+            self.db.collection(collection)
+            .where(*condition)
+            .where("updatedAt", ">", since)
+            .stream(transaction=transaction)
+        )
+
+    def sync_rides(self, transaction, since, ride_ids):
+        """
+        Rides that changed or were removed from the user since ``since``.
+        """
+        if since is None:
+            docs = [
+                doc for doc in self.db.get_all(
+                    [self.db.collection("rides").document(ride_id) for ride_id in ride_ids],
+                    transaction=transaction
+                )
+                if doc.exists
+            ]
+            tombstones = []
+        else:
+            docs = {
+                doc.id: doc
+                for doc in self._changed_since(
+                    transaction, "rides", ("ownerID", "==", self.user_id), since
+                ) + self._changed_since(
+                    transaction, "rides", ("currentPassengers", "array_contains", self.user_id),
+                    since
+                )
+            }.values()
+            tombstones = self._deleted_since(since, transaction)
+
+        return {
+            "changed": [dict(doc.to_dict(), id=doc.id) for doc in docs],
+            "deleted": sorted({tombstone.get("rideId") for tombstone in tombstones}),
+            "token": self._token(since, [doc.to_dict().get("updatedAt") for doc in docs] + [
+                tombstone.get("deletedAt") for tombstone in tombstones
+            ]),
+        }
+
+    def sync_ride_chats(self, transaction, since, ride_ids):
+        """
+        Ride chats that changed or were removed from the user since ``since``.
+        """
+        if since is None:
+            docs = [
+                doc for doc in self.db.get_all(
+                    [self.db.collection("ride_chats").document(ride_id) for ride_id in ride_ids],
+                    transaction=transaction
+                )
+                if doc.exists
+            ]
+            tombstones = []
+        else:
+            docs = self._changed_since(
+                transaction, "ride_chats", ("participants", "array_contains", self.user_id), since
+            )
+            tombstones = self._deleted_since(since, transaction)
+
+        return {
+            "changed": RideChatManager.format_ride_chats(docs),
+            "deleted": sorted({tombstone.get("rideId") for tombstone in tombstones}),
+            "token": self._token(since, [doc.to_dict().get("updatedAt") for doc in docs] + [
+                tombstone.get("deletedAt") for tombstone in tombstones
+            ]),
+        }
+
+    def sync_notifications(self, transaction, since):
+        """
+        Notifications created or changed since ``since``. Notifications are never
+        deleted, so there are no tombstones.
+        """
+        notifications_ref = self.user_ref.collection("notifications")
+        if since is None:
+            docs = list(notifications_ref.stream(transaction=transaction))
+        else:
+            docs = list(
+                notifications_ref.where("updatedAt", ">", since).stream(transaction=transaction)
+            )
+
+        return {
+            "changed": [NotificationManager.format_notification(doc) for doc in docs],
+            "deleted": [],
+            "token": self._token(since, [doc.to_dict().get("updatedAt") for doc in docs]),
+        }
+
+    def sync(self, tokens):
+        """
+        Changes for every collection in ``tokens``, a dict of collection name to the
+        token from the previous sync (None for a full sync).
+        """
+        try:
+            since = {}
+            for collection, token in tokens.items():
+                try:
+                    since[collection] = self.parse_token(token)
+                except ValueError:
+                    return {"error": f"Invalid sync token for {collection}."}, 400
+
+            oldest = datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+            for collection in ("rides", "ride_chats"):
+                if since.get(collection) is not None and since[collection] < oldest:
+                    since[collection] = None
+
+            needs_ride_ids = any(
+                collection in since and since[collection] is None
+                for collection in ("rides", "ride_chats")
+            )
+
+            @firestore.transactional
+            def read_changes(transaction):
+                """
+                Read every requested collection from one snapshot.
+                """
+                ride_ids = self._ride_ids(transaction) if needs_ride_ids else []
+
+                response = {}
+                if "rides" in since:
+                    response["rides"] = self.sync_rides(transaction, since["rides"], ride_ids)
+                if "ride_chats" in since:
+                    response["ride_chats"] = self.sync_ride_chats(
+                        transaction, since["ride_chats"], ride_ids
+                    )
+                if "notifications" in since:
+                    response["notifications"] = self.sync_notifications(
+                        transaction, since["notifications"]
+                    )
+                return response
+
+            response = read_changes(self.db.transaction(read_only=True))
+            for collection, result in response.items():
+                result["full"] = since[collection] is None
+
+            return response, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to sync.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
+
+    def purge_tombstones(self):
+        """
+        Delete tombstones older than the retention period.
+        """
+        try:
+            cutoff = datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+            batch = self.db.batch()
+            purged = 0
+            for tombstone in (
+                self.tombstones_ref
+                .where("deletedAt", "<", cutoff)
+                .limit(500)
+                .stream()
+            ):
+                batch.delete(tombstone.reference)
+                purged += 1
+
+            if purged:
+                batch.commit()
+
+            return {"purged": purged}, 200
+
+        except FirebaseError as e:
+            return handle_firestore_error(e, "Failed to purge tombstones.")
+
+        except Exception as e:
+            return handle_generic_error(e, "An unexpected error occurred")
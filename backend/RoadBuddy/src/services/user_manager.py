@@ -1,6 +1,10 @@
+from google.cloud import firestore
 from firebase_admin.exceptions import FirebaseError
+from concurrency import submit
 from utils import handle_firestore_error, handle_generic_error
+from tracing import traced
 
+@traced
 class UserManager:
     """
     UserManager handles user-related operations in Firestore.
@@ -50,6 +54,12 @@ class UserManager:
         except Exception as e:
             return handle_generic_error(e, "An unexpected error occurred")
 
+    def get_user_ride_async(self):
+        """
+        Like get_user_ride, but runs on the shared I/O pool and returns a Future.
+        """
+        return submit(self.get_user_ride)
+
     def add_posted_ride(self, ride_id):
         """
         Add a ride to the user's "ridesPosted" list in Firestore.
@@ -115,10 +125,7 @@ class UserManager:
             if not user_doc.exists:
                 return {"error": "User not found"}, 404
 
-            user_data = user_doc.to_dict()
-            rides_joined = user_data.get("ridesJoined", [])
-            rides_joined.remove(ride_id)
-            self.user_ref.update({"ridesJoined": rides_joined})
+            self.user_ref.update({"ridesJoined": firestore.ArrayRemove([ride_id])})
 
             return {
                 "message": "Ride successfully removed from user's joined rides"
@@ -139,10 +146,7 @@ class UserManager:
             if not user_doc.exists:
                 return {"error": "User not found"}, 404
 
-            user_data = user_doc.to_dict()
-            rides_joined = user_data.get("ridesPosted", [])
-            rides_joined.remove(ride_id)
-            self.user_ref.update({"ridesPosted": rides_joined})
+            self.user_ref.update({"ridesPosted": firestore.ArrayRemove([ride_id])})
 
             return {
                 "message": "Ride successfully removed from user's posted rides"
@@ -0,0 +1,29 @@
+from functools import wraps
+from flask import session, jsonify
+
+
+def get_user_id():
+    """
+    Retrieve user's ID
+    """
+    return session.get('user', {}).get('uid')
+
+
+def get_user_name():
+    """
+    Retrieve user's name
+    """
+    return session.get('user').get('name')
+
+
+def auth_required(f):
+    """
+    Decorator to enforce user authentication for a route.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user' not in session:
+            return jsonify({"error": "User is not logged in"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from metrics import Counter
+from resilience import RequestDeadlineExceeded, remaining
+
+# How long a read that found no document is reused for, in seconds.
+NEGATIVE_CACHE_SECONDS = float(os.getenv("NEGATIVE_CACHE_SECONDS", "2"))
+
+# Expired negative cache entries are swept once there are this many.
+NEGATIVE_CACHE_SWEEP_SIZE = 10_000
+
+_registry_lock = threading.Lock()
+_calls = Counter(
+    "single_flight_calls_total",
+    "Reads served by running them, by joining an identical read in flight, or from "
+    "the negative cache.",
+    ("name", "outcome"),
+)
+
+
+class _Flight:
+    """
+    A read in flight and, once it finishes, its result or error.
+    """
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    SingleFlight merges concurrent identical reads: while a read of ``key`` is in
+    flight, later reads of the same key wait for it and share its result (or its
+    error) instead of making their own call. Nothing is cached once the read is done,
+    except results for which ``is_missing(result)`` is true, which are reused for
+    ``negative_ttl`` seconds so a burst of requests for a missing document costs one
+    read. Call ``forget(key)`` when the document is created.
+
+    A read that joins one in flight sees the document as it was when that read
+    started, as it could have if the two had simply raced.
+    """
+
+    def __init__(self, name, is_missing=None, negative_ttl=NEGATIVE_CACHE_SECONDS,
+                 clock=time.monotonic):
+        """
+        Initialize the SingleFlight.
+        """
+        self.name = name
+        self.is_missing = is_missing
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.missing = {}
+
+    def do(self, key, fn):
+        """
+        Return ``fn()``, or the result of the identical read already in flight.
+        """
+        with self.lock:
+            cached = self.missing.get(key)
+            if cached is not None:
+                if cached[0] > self.clock():
+                    _count(self.name, "negative_cache")
+                    return cached[1]
+                del self.missing[key]
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if not leader:
+            _count(self.name, "coalesced")
+            return self._wait(flight)
+
+        _count(self.name, "executed")
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if (
+                    flight.error is None and self.negative_ttl > 0
+                    and self.is_missing is not None and self.is_missing(flight.result)
+                ):
+                    self._remember_missing(key, flight.result)
+            flight.done.set()
+        return flight.result
+
+    def _remember_missing(self, key, result):
+        # Callers hold the lock.
+        now = self.clock()
+        if len(self.missing) >= NEGATIVE_CACHE_SWEEP_SIZE:
+            self.missing = {k: v for k, v in self.missing.items() if v[0] > now}
+        self.missing[key] = (now + self.negative_ttl, result)
+
+    def forget(self, key):
+        """
+        Drop a cached missing result, e.g. because the document was just created.
+        """
+        with self.lock:
+            self.missing.pop(key, None)
+
+    @staticmethod
+    def _wait(flight):
+        # Waiting for another request's read must not outlast this request's deadline.
+        if not flight.done.wait(remaining()):
+            raise RequestDeadlineExceeded("Request deadline exceeded waiting for a read")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+def _count(name, outcome):
+    with _registry_lock:
+        _calls.inc((name, outcome))
+
+
+def expose():
+    """
+    The single-flight counters in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        return "\n".join(_calls.expose()) + "\n"
+
+
+def document_missing(snapshot):
+    """
+    True for the snapshot of a document that does not exist.
+    """
+    return not snapshot.exists
+
+
+ride_reads = SingleFlight("ride", is_missing=document_missing)
+ride_chat_reads = SingleFlight("ride_chat", is_missing=document_missing)
@@ -0,0 +1,131 @@
+import itertools
+import json
+import zlib
+from flask import Response, request, stream_with_context
+from serialization import MSGPACK_MIMETYPE, json_default, packb, wants_msgpack
+from tracing import span, timed_iter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encoded JSON is handed to the compressor and the socket in chunks of about this size.
+CHUNK_SIZE = 16 * 1024
+
+
+def dumps(value):
+    """
+    Encode a value as compact JSON bytes, with orjson when it is installed. Values
+    are written the same as Flask's jsonify would write them.
+    """
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS  # pylint: disable=no-member
+        return orjson.dumps(value, default=json_default, option=option)  # pylint: disable=no-member
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode()
+
+
+def prefetch(items):
+    """
+    Start an iterator and return an equivalent one. Errors raised while fetching the
+    first item (such as a failed query) surface here instead of mid-response.
+    """
+    iterator = iter(items)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], iterator)
+
+
+def _encode(key, items, as_object):
+    opening, closing = (b"{", b"}") if as_object else (b"[", b"]")
+    yield b"{" + dumps(key) + b":" + opening
+    separator = b""
+    for item in items:
+        if as_object:
+            item_key, value = item
+            yield separator + dumps(str(item_key)) + b":" + dumps(value)
+        else:
+            yield separator + dumps(item)
+        separator = b","
+    yield closing + b"}"
+
+
+def _chunk(pieces):
+    buffer = []
+    size = 0
+    first = True
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        # The first item goes out on its own so the client gets its first byte early.
+        if first or size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+            first = False
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _compress(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            output = compressor.process(chunk) + compressor.flush()
+            if output:
+                yield output
+        yield compressor.finish()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            output = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if output:
+                yield output
+        yield compressor.flush()
+    else:
+        yield from chunks
+
+
+def negotiate_encoding():
+    """
+    Best content encoding both the client and this server support, or None.
+    """
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(supported)
+
+
+def stream_json_response(key, items, as_object=False):
+    """
+    Stream ``{key: [items...]}`` (or ``{key: {k: v...}}`` for (k, v) pairs when
+    ``as_object``) as it is encoded, compressed with gzip or brotli if the client
+    accepts it. Only one chunk is held in memory at a time, however many items there are.
+    """
+    encoding = negotiate_encoding()
+    body = timed_iter(_compress(_chunk(_encode(key, items, as_object)), encoding), "stream")
+
+    response = Response(stream_with_context(body), mimetype="application/json")
+    response.vary.update(("Accept", "Accept-Encoding"))
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def stream_response(key, items, as_object=False):
+    """
+    Like stream_json_response, but answers in MessagePack when the client prefers it.
+    A MessagePack body states its length up front, so the items are collected first.
+    """
+    if wants_msgpack():
+        body = {key: dict(items) if as_object else list(items)}
+        with span("encode"):
+            response = Response(packb(body), mimetype=MSGPACK_MIMETYPE)
+        response.vary.add("Accept")
+        return response
+    return stream_json_response(key, items, as_object)
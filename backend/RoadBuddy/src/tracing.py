@@ -0,0 +1,217 @@
+import contextvars
+import cProfile
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+# Requests slower than this are logged with their span breakdown.
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+# Directory profiles are written to. Profiling is off unless it is set.
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+# If set, the X-Profile header must carry this value to turn profiling on.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Spans recorded while handling one request, aggregated by name.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize an empty Trace.
+        """
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.profiler = None
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """
+        Add one span of ``seconds`` under ``name``.
+        """
+        with self.lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def breakdown(self):
+        """
+        The spans, slowest first, as "name xcount total_ms" entries. Span times are
+        inclusive, so a manager call's span also contains its Firestore calls.
+        """
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda item: item[1][1], reverse=True)
+        return ", ".join(
+            f"{name} x{count} {seconds * 1000:.1f}ms" for name, (count, seconds) in spans
+        )
+
+
+def record(name, seconds):
+    """
+    Add a span that has already been timed to the current trace, if there is one.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block as a span of the current trace, if there is one.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def measure_iter(iterator, on_finish, elapsed=0.0):
+    """
+    Wrap an iterator to measure it. When it is exhausted or closed,
+    ``on_finish(count, seconds)`` gets the number of items produced and the time spent
+    producing them (plus ``elapsed``), not counting the consumer's time.
+    """
+    count = 0
+    iterator = iter(iterator)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
+            count += 1
+            yield item
+    finally:
+        on_finish(count, elapsed)
+
+
+def timed_iter(iterator, name):
+    """
+    Wrap an iterator so the time spent producing its items is one span of the trace
+    current when it was wrapped, however late the items are consumed.
+    """
+    trace = _current.get()
+    if trace is None:
+        return iterator
+    return measure_iter(iterator, lambda count, seconds: trace.add(name, seconds))
+
+
+def traced(cls):
+    """
+    Class decorator that times every public method of a service manager as a span
+    named "Class.method". Static methods and ``*_async`` launchers are left alone.
+    """
+    for name, value in list(vars(cls).items()):
+        if name.startswith("_") or name.endswith("_async") or not callable(value):
+            continue
+        if isinstance(value, (staticmethod, classmethod, type)):
+            continue
+        setattr(cls, name, _traced_method(value, f"{cls.__name__}.{name}"))
+    return cls
+
+
+def _traced_method(method, name):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return method(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            trace.add(name, time.perf_counter() - started)
+
+    return wrapper
+
+
+class Tracer:
+    """
+    Tracer keeps a Trace for each request, logs requests slower than
+    ``slow_seconds`` with their span breakdown, and profiles requests that ask for it.
+
+    A request is profiled with cProfile when ``profile_dir`` is set and the request
+    sends an X-Profile header (equal to ``profile_token``, if one is set). The
+    profile is written to ``profile_dir`` and can be read with pstats or snakeviz.
+    Only the request's own thread is profiled, not calls it runs on the I/O pool.
+    """
+
+    def __init__(self, slow_seconds=SLOW_REQUEST_SECONDS, profile_dir=PROFILE_DIR,
+                 profile_token=PROFILE_TOKEN):
+        """
+        Initialize the Tracer.
+        """
+        self.slow_seconds = slow_seconds
+        self.profile_dir = profile_dir
+        self.profile_token = profile_token
+
+    def wants_profile(self, header):
+        """
+        True if a request sending ``header`` as its X-Profile value should be profiled.
+        """
+        if not self.profile_dir or not header:
+            return False
+        return self.profile_token is None or header == self.profile_token
+
+    def start_request(self, name, profile_header=None):
+        """
+        Start the trace of a request, and its profile if it asked for one.
+        """
+        trace = Trace(name)
+        if self.wants_profile(profile_header):
+            trace.profiler = cProfile.Profile()
+            try:
+                trace.profiler.enable()
+            except ValueError as e:
+                print(f"Could not profile {name}: {e}")
+                trace.profiler = None
+        _current.set(trace)
+
+    def finish_request(self):
+        """
+        End the current request's trace. Logs it if it was slow and writes its profile.
+        """
+        trace = _current.get()
+        if trace is None:
+            return
+        _current.set(None)
+
+        duration = time.perf_counter() - trace.started
+        if trace.profiler is not None:
+            trace.profiler.disable()
+            path = self.write_profile(trace)
+            print(f"Profiled {trace.name} in {duration * 1000:.1f}ms: {path}")
+
+        if duration >= self.slow_seconds:
+            print(f"Slow request {trace.name} took {duration * 1000:.1f}ms: {trace.breakdown()}")
+
+    def write_profile(self, trace):
+        """
+        Write a trace's profile to the profile directory and return its path.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        label = "".join(c if c.isalnum() else "_" for c in trace.name).strip("_")
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}.prof"
+        path = os.path.join(self.profile_dir, filename)
+        trace.profiler.dump_stats(path)
+        return path
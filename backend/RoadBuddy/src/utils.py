@@ -1,18 +1,25 @@
 import json
+from resilience import is_unavailable
+
+UNAVAILABLE_MESSAGE = "Service temporarily unavailable, please try again."
 
 def handle_firestore_error(error, message="Firestore operation failed"):
     """
     Handles errors related to Firestore operations.
     """
-    return {
-        "error": message,
-        "details": str(error)
-    }, 500
+    return handle_generic_error(error, message)
 
 def handle_generic_error(error, message="An unexpected error occurred"):
     """
-    Handles generic exceptions not specific to Firestore.
+    Handles generic exceptions not specific to Firestore. Errors caused by an
+    unavailable or overloaded backend are a 503, so clients retry later.
     """
+    if is_unavailable(error):
+        return {
+            "error": UNAVAILABLE_MESSAGE,
+            "details": str(error)
+        }, 503
+
     return {
         "error": message,
         "details": str(error)
@@ -40,3 +47,26 @@ def check_required_fields(data, required_fields):
     if missing_fields:
         return {"error": f"Missing or empty required field(s): {', '.join(missing_fields)}"}, 400
     return None
+
+def parse_fields(fields, allowed_fields):
+    """
+    Parse a comma-separated ``fields`` query parameter into a list of field names, or
+    None if it is empty. Returns the list and an error response if a field is unknown.
+    """
+    if not fields:
+        return None, None
+
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field != "id" and field not in allowed_fields]
+    if unknown:
+        return None, ({"error": f"Unknown field(s): {', '.join(unknown)}"}, 400)
+    return [field for field in fields if field != "id"], None
+
+def select_fields(data, fields):
+    """
+    Keep only ``fields`` (and the document ``id``) of a document's data. With no
+    fields, the data is returned unchanged.
+    """
+    if fields is None:
+        return data
+    return {key: data[key] for key in ("id", *fields) if key in data}
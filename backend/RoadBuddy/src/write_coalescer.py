@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from google.api_core import exceptions as api_exceptions
+from metrics import Counter
+from resilience import is_unavailable
+
+# Least time between two coalesced writes to the same document, in seconds.
+LAST_MESSAGE_FLUSH_SECONDS = float(os.getenv("LAST_MESSAGE_FLUSH_SECONDS", "1.0"))
+
+_registry_lock = threading.Lock()
+_updates = Counter(
+    "write_coalescer_updates_total",
+    "Field updates handed to a write coalescer, by whether they were merged into a "
+    "write already pending.",
+    ("name", "outcome"),
+)
+_writes = Counter(
+    "write_coalescer_writes_total",
+    "Writes made by a write coalescer, by result.",
+    ("name", "result"),
+)
+
+
+def _count(counter, labels):
+    with _registry_lock:
+        counter.inc(labels)
+
+
+def expose():
+    """
+    The write coalescer counters in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        return "\n".join(_updates.expose() + _writes.expose()) + "\n"
+
+
+class WriteCoalescer:
+    """
+    WriteCoalescer is a write-behind buffer for field updates to hot documents.
+
+    ``update(ref, fields)`` returns at once. Updates to the same document are merged
+    (later values win) and written by a background thread, at most once every
+    ``interval`` seconds per document, so a busy document is written about once per
+    interval however many updates it gets. A document's first update after a quiet
+    spell is written straight away.
+
+    The buffered fields reach Firestore up to ``interval`` seconds late, and
+    SERVER_TIMESTAMP values are stamped when they are written. A write that fails
+    because Firestore is unavailable is retried once an interval later, unless newer
+    values replaced it; other failures (such as a deleted document) drop it. ``stop``
+    writes whatever is still pending.
+    """
+
+    def __init__(self, name, interval=LAST_MESSAGE_FLUSH_SECONDS):
+        """
+        Initialize the WriteCoalescer. Its thread starts on the first update.
+        """
+        self.name = name
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.last_write = {}
+        self.thread = None
+        self.stopping = False
+
+    def update(self, ref, fields):
+        """
+        Buffer ``fields`` to be written to the document ``ref``.
+        """
+        with self.condition:
+            entry = self.pending.get(ref.path)
+            if entry is not None:
+                entry[1].update(fields)
+                _count(_updates, (self.name, "merged"))
+                return
+
+            now = time.monotonic()
+            due = max(now, self.last_write.get(ref.path, now - self.interval) + self.interval)
+            self.pending[ref.path] = [ref, dict(fields), due]
+            _count(_updates, (self.name, "buffered"))
+            self.condition.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name=f"write-coalescer-{self.name}", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self):
+        """
+        Write everything pending and stop the thread.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                due = self._wait_for_due()
+                if due is None:
+                    return
+            for ref, fields in due:
+                self._write(ref, fields)
+
+    def _wait_for_due(self):
+        # Callers hold the condition. Returns the writes that are due, or None once
+        # stopping with nothing left to write.
+        while True:
+            now = time.monotonic()
+            paths = [
+                path for path, entry in self.pending.items()
+                if self.stopping or entry[2] <= now
+            ]
+            if paths:
+                for path in paths:
+                    self.last_write[path] = now
+                self.last_write = {
+                    path: written for path, written in self.last_write.items()
+                    if written > now - self.interval
+                }
+                return [self.pending.pop(path)[:2] for path in paths]
+            if self.stopping:
+                return None
+            earliest = min((entry[2] for entry in self.pending.values()), default=None)
+            self.condition.wait(None if earliest is None else earliest - now)
+
+    def _write(self, ref, fields):
+        try:
+            ref.update(fields)
+            _count(_writes, (self.name, "written"))
+        except Exception as e:
+            if isinstance(e, api_exceptions.NotFound) or not is_unavailable(e):
+                print(f"Dropped coalesced write to {ref.path}: {e}")
+                _count(_writes, (self.name, "dropped"))
+                return
+            print(f"Coalesced write to {ref.path} failed, retrying: {e}")
+            _count(_writes, (self.name, "retried"))
+            with self.condition:
+                entry = self.pending.get(ref.path)
+                if entry is None:
+                    self.pending[ref.path] = [ref, fields, time.monotonic() + self.interval]
+                else:
+                    entry[1] = {**fields, **entry[1]}
+                self.condition.notify()
+
+
+# Last message of each ride chat, shown in the chat list.
+last_message_writes = WriteCoalescer("ride_chat_last_message")
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from flask import Flask, jsonify, request
+
+from fake_firestore import FakeFirestoreClient
+from idempotency import Idempotency
+
+
+@pytest.fixture(name="service")
+def fixture_service():
+    """
+    A Flask app with one idempotent endpoint whose status, runs and admission the
+    test controls.
+    """
+    app = Flask(__name__)
+    state = {"runs": 0, "status": 201, "admitted": 0, "reject": False}
+
+    def admit():
+        state["admitted"] += 1
+        if state["reject"]:
+            return jsonify({"error": "Too many requests, please slow down."}), 429
+        return None
+
+    db = FakeFirestoreClient()
+    idempotent = Idempotency(db, lambda: "u1", admit=admit)
+
+    @app.route("/rides", methods=["POST"])
+    @idempotent
+    def post_ride():
+        state["runs"] += 1
+        return jsonify({"run": state["runs"], "body": request.get_json()}), state["status"]
+
+    state["client"] = app.test_client()
+    state["idempotency"] = idempotent
+    return state
+
+
+def post(service, body, key="key-1"):
+    """
+    POST ``body`` with an Idempotency-Key.
+    """
+    return service["client"].post("/rides", json=body, headers={"Idempotency-Key": key})
+
+
+def test_retry_replays_the_stored_response_without_being_admitted_again(service):
+    """
+    A retry gets the first response back, and neither runs nor spends its rate limit.
+    """
+    first = post(service, {"from": "A"})
+    service["reject"] = True
+    retry = post(service, {"from": "A"})
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert service["runs"] == 1
+    assert service["admitted"] == 1
+
+    # A new key is a new request, and is rate limited.
+    assert post(service, {"from": "A"}, key="key-2").status_code == 429
+
+
+def test_replay_survives_a_restart(service):
+    """
+    A worker without the response in memory replays it from Firestore.
+    """
+    post(service, {"from": "A"})
+    service["idempotency"].memory.responses.clear()
+
+    retry = post(service, {"from": "A"})
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert service["runs"] == 1
+
+
+def test_key_reused_with_a_different_body_is_rejected(service):
+    """
+    The same key with another body gets 422 and does not run.
+    """
+    post(service, {"from": "A"})
+    response = post(service, {"from": "B"})
+
+    assert response.status_code == 422
+    assert service["runs"] == 1
+
+
+def test_key_claimed_elsewhere_is_in_progress(service):
+    """
+    A key another worker has claimed and not finished gets 409 with a Retry-After.
+    """
+    post(service, {"from": "A"})
+    service["idempotency"].memory.responses.clear()
+    for document in service["idempotency"].key_ref.stream():
+        document.reference.set({
+            "status": "in_progress",
+            "fingerprint": "other",
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=30),
+        })
+
+    response = post(service, {"from": "A"})
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+    assert service["runs"] == 1
+
+
+def test_server_errors_release_the_key(service):
+    """
+    A 5xx response is not stored, so retrying the key runs the request again.
+    """
+    service["status"] = 500
+    assert post(service, {"from": "A"}).status_code == 500
+    assert not list(service["idempotency"].key_ref.stream())
+
+    service["status"] = 201
+    retry = post(service, {"from": "A"})
+    assert retry.status_code == 201
+    assert "Idempotent-Replayed" not in retry.headers
+    assert service["runs"] == 2
+
+
+def test_rejected_requests_release_the_key(service):
+    """
+    A request refused by ``admit`` is not stored, so it can be retried later.
+    """
+    service["reject"] = True
+    assert post(service, {"from": "A"}).status_code == 429
+    assert not list(service["idempotency"].key_ref.stream())
+
+    service["reject"] = False
+    assert post(service, {"from": "A"}).status_code == 201
+    assert service["runs"] == 1
@@ -0,0 +1,17 @@
+from location_index import LocationIndex
+
+
+def test_suggest_ranks_every_match_of_a_short_prefix():
+    """
+    A popular place sorting after hundreds of rarer ones is still suggested first.
+    """
+    index = LocationIndex()
+    index.apply_refresh(
+        [(f"ride{n}", [f"Sacramento Stop {n:04d}"]) for n in range(1000)], None
+    )
+    index.apply_refresh([(f"popular{n}", ["Santa Cruz"]) for n in range(5)], None)
+    index.apply_refresh([(f"second{n}", ["Salinas"]) for n in range(3)], None)
+
+    assert index.suggest("s", limit=3) == ["Santa Cruz", "Salinas", "Sacramento Stop 0000"]
+    assert index.suggest("san") == ["Santa Cruz"]
+    assert index.suggest("x") == []
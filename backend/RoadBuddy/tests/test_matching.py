@@ -0,0 +1,158 @@
+import itertools
+import random
+
+import pytest
+
+from fake_firestore import FakeFirestoreClient
+from matching import solve_assignment
+from services.ride_request_manager import RideRequestManager
+
+
+def brute_force(candidates, seats):
+    """
+    Most riders seated, then lowest total cost, over every possible assignment.
+    """
+    best = (0, 0)
+    choices = [[None, *options] for options in candidates]
+    for picks in itertools.product(*choices):
+        taken = [ride for ride, _ in filter(None, picks)]
+        if any(taken.count(ride) > seats[ride] for ride in set(taken)):
+            continue
+        score = (-len(taken), sum(cost for _, cost in filter(None, picks)))
+        best = min(best, score)
+    return best
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_solve_assignment_matches_brute_force(seed):
+    """
+    The flow solution seats as many riders as possible at the lowest total cost.
+    """
+    rng = random.Random(seed)
+    ride_count = rng.randint(1, 4)
+    seats = [rng.randint(0, 2) for _ in range(ride_count)]
+    candidates = []
+    for _ in range(rng.randint(0, 6)):
+        rides = rng.sample(range(ride_count), rng.randint(0, ride_count))
+        candidates.append([(ride, rng.randint(0, 9)) for ride in rides])
+
+    assignment = solve_assignment(candidates, seats)
+
+    for rider, ride in assignment.items():
+        assert ride in dict(candidates[rider])
+    for ride, free in enumerate(seats):
+        assert list(assignment.values()).count(ride) <= free
+    cost = sum(dict(candidates[rider])[ride] for rider, ride in assignment.items())
+    assert (-len(assignment), cost) == brute_force(candidates, seats)
+
+
+def make_ride(**fields):
+    """
+    An open ride from A to B with two free seats, overridden by ``fields``.
+    """
+    ride = {
+        "ownerID": "driver", "from": "A", "to": "B", "date": "2031-01-01",
+        "departureTime": "9:00 AM", "maxPassengers": 2, "cost": 10,
+        "currentPassengers": [],
+    }
+    ride.update(fields)
+    return ride
+
+
+def make_request(rider_id, **fields):
+    """
+    A pending request from A to B for ``rider_id``, overridden by ``fields``.
+    """
+    request = {
+        "riderID": rider_id, "from": "a ", "to": "B", "date": "2031-01-01",
+        "departureTime": "9:30 AM",
+    }
+    request.update(fields)
+    return request
+
+
+def test_build_candidates_costs_and_window():
+    """
+    Cost is the gap in minutes plus the fare; rides outside the window are skipped.
+    """
+    rides = [
+        make_ride(),
+        make_ride(departureTime="11:00 AM"),
+        make_ride(to="C"),
+        make_ride(date="2031-01-02"),
+    ]
+    candidates, seats = RideRequestManager.build_candidates([make_request("u1")], rides)
+    assert candidates == [[(0, 40)]]
+    assert seats == [2, 2, 2, 2]
+
+
+def test_build_candidates_free_seats_follow_the_busiest_segment():
+    """
+    A ride's free seats are what its fullest segment has left.
+    """
+    rides = [
+        make_ride(stops=["A", "M", "B"], segmentSeats=[1, 2], maxPassengers=3),
+        make_ride(stops=["A", "M", "B"], segmentSeats=[2, 2], maxPassengers=2),
+    ]
+    candidates, seats = RideRequestManager.build_candidates([make_request("u1")], rides)
+    assert seats == [1, 0]
+    assert candidates == [[(0, 40)]]
+
+
+def test_build_candidates_excludes_own_and_joined_rides():
+    """
+    Riders are never offered their own ride, or any ride on a route and day they
+    already ride on.
+    """
+    rides = [
+        make_ride(ownerID="u1"),
+        make_ride(currentPassengers=["u2"]),
+        make_ride(departureTime="9:15 AM"),
+    ]
+    requests = [make_request("u1"), make_request("u2"), make_request("u3")]
+    candidates, _ = RideRequestManager.build_candidates(requests, rides)
+    assert candidates == [[(1, 40), (2, 25)], [], [(0, 40), (1, 40), (2, 25)]]
+
+
+def test_build_candidates_keeps_one_request_per_rider_route_and_day():
+    """
+    Only a rider's first request for a route and day is matched, so duplicates can
+    neither take a second seat on one ride nor book a second ride.
+    """
+    rides = [make_ride(), make_ride(departureTime="9:45 AM")]
+    requests = [
+        make_request("u1"),
+        make_request("u1", departureTime="9:45 AM"),
+        make_request("u1", date="2031-01-02"),
+        make_request("u2"),
+    ]
+    candidates, seats = RideRequestManager.build_candidates(requests, rides)
+    assert candidates[1] == []
+    assert candidates[2] == []
+
+    assignment = solve_assignment(candidates, seats)
+    assert sorted(assignment) == [0, 3]
+
+
+def test_duplicate_requests_book_one_seat():
+    """
+    Two pending requests from one rider on the same route and day book one seat.
+    """
+    db = FakeFirestoreClient()
+    db.collection("rides").document("ride1").set(make_ride(
+        stops=["A", "B"], segmentSeats=[0], status="open", ownerName="Driver"
+    ))
+    db.collection("ride_chats").document("ride1").set({"participants": ["driver"]})
+    for user_id in ("driver", "u1"):
+        db.collection("users").document(user_id).set({"ridesJoined": []})
+    for request_id in ("req1", "req2"):
+        db.collection("ride_requests").document(request_id).set(
+            {**make_request("u1"), "status": "pending"}
+        )
+
+    response = RideRequestManager(db).match_pending_requests()
+
+    assert response == ({"matched": 1, "pending": 1}, 200)
+    ride = db.collection("rides").document("ride1").get().to_dict()
+    assert ride["currentPassengers"] == ["u1"]
+    assert ride["segmentSeats"] == [1]
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import outbox as outbox_module
+from fake_firestore import FakeFirestoreClient
+from outbox import Outbox
+
+
+@pytest.fixture(name="outbox")
+def fixture_outbox():
+    """
+    An Outbox on an in-memory Firestore whose "send" handler fails while
+    ``outbox.failing`` is set, recording every payload it is given.
+    """
+    sent = []
+
+    def send(payload):
+        sent.append(payload)
+        if outbox.failing:
+            raise RuntimeError("unavailable")
+
+    outbox = Outbox(FakeFirestoreClient(), {"send": send}, max_attempts=3)
+    outbox.failing = False
+    outbox.sent = sent
+    return outbox
+
+
+def stage(outbox, payload):
+    """
+    Commit one "send" task and return its id.
+    """
+    batch = outbox.db.batch()
+    task_id = outbox.stage(batch, "send", payload)
+    batch.commit()
+    return task_id
+
+
+def task(outbox, task_id):
+    """
+    The task document, or None once it is gone.
+    """
+    return outbox.tasks_ref.document(task_id).get().to_dict()
+
+
+def make_due(outbox, task_id):
+    """
+    Move a rescheduled task's retry time into the past.
+    """
+    outbox.tasks_ref.document(task_id).update(
+        {"runAfter": datetime.now(timezone.utc) - timedelta(seconds=1)}
+    )
+
+
+def test_successful_task_runs_once_and_is_deleted(outbox):
+    """
+    A task is claimed, handed its payload and deleted; running it again does nothing.
+    """
+    task_id = stage(outbox, {"rideId": "ride1"})
+
+    outbox.run(task_id)
+    outbox.run(task_id)
+
+    assert outbox.sent == [{"rideId": "ride1"}]
+    assert task(outbox, task_id) is None
+
+
+def test_claimed_or_future_tasks_are_not_run(outbox):
+    """
+    A task another worker holds, or one not due yet, is left alone.
+    """
+    task_id = stage(outbox, {"rideId": "ride1"})
+    assert outbox.claim(task_id)["attempts"] == 1
+
+    outbox.run(task_id)
+    assert not outbox.sent
+
+    outbox.tasks_ref.document(task_id).update({
+        "claimedUntil": None,
+        "runAfter": datetime.now(timezone.utc) + timedelta(minutes=1),
+    })
+    outbox.run(task_id)
+    assert not outbox.sent
+    assert task(outbox, task_id)["attempts"] == 1
+
+
+def test_failed_task_backs_off_then_dead_letters(outbox):
+    """
+    Failures are retried with a doubling delay, and the task is dead-lettered after
+    ``max_attempts``.
+    """
+    outbox.failing = True
+    task_id = stage(outbox, {"rideId": "ride1"})
+
+    delays = []
+    for _ in range(outbox.max_attempts - 1):
+        before = datetime.now(timezone.utc)
+        outbox.run(task_id)
+        data = task(outbox, task_id)
+        assert data["claimedUntil"] is None
+        assert data["lastError"] == "unavailable"
+        delays.append(round((data["runAfter"] - before).total_seconds()))
+        make_due(outbox, task_id)
+
+    assert delays == [outbox_module.RETRY_BASE_DELAY, 2 * outbox_module.RETRY_BASE_DELAY]
+
+    outbox.run(task_id)
+    assert task(outbox, task_id) is None
+    dead_letter = outbox.dead_letters_ref.document(task_id).get().to_dict()
+    assert dead_letter["attempts"] == outbox.max_attempts
+    assert dead_letter["lastError"] == "unavailable"
+    assert dead_letter["payload"] == {"rideId": "ride1"}
+    assert len(outbox.sent) == outbox.max_attempts
+
+
+def test_task_succeeds_on_retry(outbox):
+    """
+    A task that fails once and then succeeds is deleted, not dead-lettered.
+    """
+    outbox.failing = True
+    task_id = stage(outbox, {"rideId": "ride1"})
+    outbox.run(task_id)
+
+    outbox.failing = False
+    make_due(outbox, task_id)
+    outbox.run(task_id)
+
+    assert task(outbox, task_id) is None
+    assert not outbox.dead_letters_ref.document(task_id).get().exists
+    assert len(outbox.sent) == 2
@@ -0,0 +1,48 @@
+from rate_limit import Limit, MemoryBucketStore, RateLimiter
+
+LIMITS = {
+    "send": Limit(rate=1.0, burst=2, priority="low"),
+    "pay": Limit(rate=1.0, burst=2, priority="critical"),
+}
+
+
+def make_limiter(global_burst):
+    """
+    A RateLimiter whose buckets never refill, so every token spent is visible.
+    """
+    limiter = RateLimiter(
+        MemoryBucketStore(clock=lambda: 0.0), LIMITS, global_rate=1.0,
+        global_burst=global_burst
+    )
+    limiter.global_store = MemoryBucketStore(clock=lambda: 0.0)
+    return limiter
+
+
+def test_shed_requests_do_not_spend_the_users_tokens():
+    """
+    Requests refused with 503 leave the user's bucket untouched.
+    """
+    limiter = make_limiter(global_burst=10)
+    # Low priority requests must leave 40% of the global bucket: six get through.
+    assert [limiter.check("send", f"user{n}") for n in range(6)] == [None] * 6
+    assert limiter.check("send", "late")[0] == 503
+    assert limiter.check("send", "late")[0] == 503
+
+    # Critical requests may use the reserve, and "late" still has both its tokens.
+    assert limiter.check("pay", "late") is None
+    assert limiter.store.buckets.get("send:late") is None
+
+
+def test_requests_over_the_user_limit_give_back_their_global_token():
+    """
+    Requests refused with 429 do not drain the bucket shared by every user.
+    """
+    limiter = make_limiter(global_burst=5)
+    assert limiter.check("pay", "spammer") is None
+    assert limiter.check("pay", "spammer") is None
+    for _ in range(20):
+        assert limiter.check("pay", "spammer")[0] == 429
+
+    assert limiter.global_store.buckets["global"][0] == 3
+    assert [limiter.check("pay", f"user{n}") for n in range(3)] == [None] * 3
+    assert limiter.check("pay", "user3")[0] == 503
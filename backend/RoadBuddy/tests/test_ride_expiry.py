@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+import expiry_scheduler
+from expiry_scheduler import ExpiryScheduler
+from fake_firestore import FakeFirestoreClient
+from services.ride_manager import MAX_BATCH_WRITES, RideManager
+
+
+@pytest.fixture(name="db")
+def fixture_db():
+    """
+    An in-memory Firestore whose batches record their size when committed.
+    """
+    db = FakeFirestoreClient()
+    db.batch_sizes = []
+    new_batch = db.batch
+
+    def batch():
+        created = new_batch()
+        commit = created.commit
+
+        def recorded_commit():
+            db.batch_sizes.append(len(created))
+            return commit()
+
+        created.commit = recorded_commit
+        return created
+
+    db.batch = batch
+    return db
+
+
+def add_departed_rides(db, count):
+    """
+    Store ``count`` rides that left yesterday and return their IDs.
+    """
+    ride_ids = [f"ride{index}" for index in range(count)]
+    for ride_id in ride_ids:
+        db.collection("rides").document(ride_id).set({
+            "ownerID": "driver",
+            "currentPassengers": ["rider"],
+            "date": "2000-01-01",
+            "departureTime": "09:00 AM",
+        })
+    return ride_ids
+
+
+def test_expired_rides_are_deleted_in_batches_under_the_write_limit(db):
+    """
+    Expiring 600 rides commits 1200 writes in three batches.
+    """
+    ride_ids = add_departed_rides(db, 600)
+
+    response_message, status = RideManager(db, None, None).delete_expired_rides(ride_ids)
+
+    assert status == 200
+    assert len(response_message["deletedRides"]) == 600
+    assert response_message["failedRideIds"] == []
+    assert db.batch_sizes == [500, 500, 200]
+    assert not list(db.collection("rides").stream())
+    assert len(list(db.collection("tombstones").stream())) == 600
+
+
+def test_past_ride_sweep_is_deleted_in_batches_under_the_write_limit(db):
+    """
+    The hourly sweep splits its deletions the same way.
+    """
+    add_departed_rides(db, 300)
+
+    response_message, status = RideManager(db, None, None).delete_past_rides()
+
+    assert status == 200
+    assert len(response_message["deletedRides"]) == 300
+    assert max(db.batch_sizes) <= MAX_BATCH_WRITES
+    assert not list(db.collection("rides").stream())
+
+
+def test_failed_keys_back_off_and_are_dropped_after_max_retries():
+    """
+    Each failure doubles a key's retry delay until it is dropped.
+    """
+    scheduler = ExpiryScheduler(lambda keys: None)
+    error = RuntimeError("unavailable")
+
+    delays = []
+    for _ in range(expiry_scheduler.MAX_RETRIES):
+        before = time.time()
+        scheduler.retry_later(["ride1"], error)
+        delays.append(round(scheduler.deadlines["ride1"] - before))
+        scheduler.deadlines.clear()
+
+    assert delays == [
+        expiry_scheduler.RETRY_DELAY * 2 ** attempt
+        for attempt in range(expiry_scheduler.MAX_RETRIES)
+    ]
+
+    scheduler.retry_later(["ride1"], error)
+    assert "ride1" not in scheduler.deadlines
+    assert not scheduler.failures
+
+
+def test_worker_retries_failed_callbacks(monkeypatch):
+    """
+    The worker thread retries a failing key until its callback succeeds.
+    """
+    monkeypatch.setattr(expiry_scheduler, "RETRY_DELAY", 0.05)
+    calls = []
+
+    def on_expire(keys):
+        calls.append(list(keys))
+        if len(calls) < 3:
+            raise RuntimeError("unavailable")
+
+    scheduler = ExpiryScheduler(on_expire)
+    scheduler.schedule("ride1", time.time())
+    scheduler.start()
+    deadline = time.time() + 5
+    while len(calls) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+
+    assert calls == [["ride1"]] * 3
+    assert not scheduler.failures
+    assert len(scheduler) == 0
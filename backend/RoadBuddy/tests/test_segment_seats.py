@@ -0,0 +1,167 @@
+import random
+
+import pytest
+
+from fake_firestore import FakeFirestoreClient
+from segment_tree import SegmentTree
+from services.ride_manager import RideManager
+
+STOPS = ["San Jose", "Palo Alto", "San Mateo", "Daly City", "San Francisco"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_segment_tree_matches_brute_force(seed):
+    """
+    Random range adds and maxima agree with a plain list.
+    """
+    rng = random.Random(seed)
+    size = rng.randint(1, 40)
+    values = [rng.randint(0, 5) for _ in range(size)]
+    tree = SegmentTree(values)
+
+    for _ in range(300):
+        lo = rng.randrange(size)
+        hi = rng.randint(lo + 1, size)
+        if rng.random() < 0.5:
+            delta = rng.randint(-3, 3)
+            tree.range_add(lo, hi, delta)
+            for index in range(lo, hi):
+                values[index] += delta
+        else:
+            assert tree.range_max(lo, hi) == max(values[lo:hi])
+
+    assert tree.to_list() == values
+
+
+@pytest.mark.parametrize("lo, hi", [(0, 0), (2, 1), (-1, 2), (0, 5)])
+def test_segment_tree_rejects_invalid_ranges(lo, hi):
+    """
+    Empty, reversed and out-of-bounds ranges raise IndexError.
+    """
+    tree = SegmentTree([0, 0, 0, 0])
+    with pytest.raises(IndexError):
+        tree.range_max(lo, hi)
+    with pytest.raises(IndexError):
+        tree.range_add(lo, hi, 1)
+
+
+@pytest.fixture(name="db")
+def fixture_db():
+    """
+    An in-memory Firestore holding one ride with four segments and two seats.
+    """
+    db = FakeFirestoreClient()
+    db.collection("rides").document("ride1").set({
+        "ownerID": "driver",
+        "from": STOPS[0],
+        "to": STOPS[-1],
+        "stops": STOPS,
+        "maxPassengers": 2,
+        "currentPassengers": [],
+        "segmentSeats": [0, 0, 0, 0],
+        "status": "open",
+    })
+    return db
+
+
+def book(db, user_id, from_stop, to_stop):
+    """
+    Book ``user_id`` on the ride from ``from_stop`` to ``to_stop``.
+    """
+    return RideManager(db, user_id, user_id).add_passenger("ride1", from_stop, to_stop)
+
+
+def ride(db):
+    """
+    The ride document as currently stored.
+    """
+    return db.collection("rides").document("ride1").get().to_dict()
+
+
+def test_overlapping_legs_fill_shared_segments(db):
+    """
+    Overlapping legs share seats on the segments they both cover.
+    """
+    assert book(db, "a", 0, 3)[1] == 200
+    assert book(db, "b", 1, 4)[1] == 200
+    assert ride(db)["segmentSeats"] == [1, 2, 2, 1]
+
+    # Segments 1 and 2 are full, so any leg crossing them is refused.
+    assert book(db, "c", 2, 3) == ({"error": "Ride is full"}, 400)
+    assert book(db, "c", 0, 2) == ({"error": "Ride is full"}, 400)
+    assert ride(db)["segmentSeats"] == [1, 2, 2, 1]
+    assert "c" not in ride(db)["currentPassengers"]
+
+
+def test_touching_legs_share_a_seat(db):
+    """
+    A leg ending at a stop and one starting there use the same seat.
+    """
+    # Legs that meet at a stop do not overlap, so a full car can take both.
+    assert book(db, "a", 0, 2)[1] == 200
+    assert book(db, "b", 0, 2)[1] == 200
+    assert book(db, "c", 2, 4)[1] == 200
+    assert book(db, "d", 2, 4)[1] == 200
+    assert ride(db)["segmentSeats"] == [2, 2, 2, 2]
+    assert ride(db)["status"] == "closed"
+
+    assert book(db, "e", 1, 3) == ({"error": "Ride is full"}, 400)
+
+
+def test_remove_passenger_frees_only_their_leg(db):
+    """
+    Leaving a ride frees the seat on the leaver's segments only.
+    """
+    book(db, "a", 0, 3)
+    book(db, "b", 1, 4)
+
+    assert RideManager(db, "a", "a").remove_passenger("ride1")[1] == 200
+    data = ride(db)
+    assert data["segmentSeats"] == [0, 1, 1, 1]
+    assert data["currentPassengers"] == ["b"]
+    assert "a" not in data["legBookings"]
+    assert data["status"] == "open"
+
+    # The freed segments can be booked again.
+    assert book(db, "c", 0, 2)[1] == 200
+    assert ride(db)["segmentSeats"] == [1, 2, 1, 1]
+
+
+def test_many_overlapping_legs_match_brute_force(db):
+    """
+    Random joins and leaves keep the seat counts in line with a plain list.
+    """
+    rng = random.Random(7)
+    seats = [0, 0, 0, 0]
+    legs = {}
+
+    for index in range(200):
+        user_id = f"rider{index % 12}"
+        if user_id in legs:
+            assert RideManager(db, user_id, user_id).remove_passenger("ride1")[1] == 200
+            from_stop, to_stop = legs.pop(user_id)
+            for segment in range(from_stop, to_stop):
+                seats[segment] -= 1
+        else:
+            from_stop = rng.randrange(len(STOPS) - 1)
+            to_stop = rng.randint(from_stop + 1, len(STOPS) - 1)
+            fits = max(seats[from_stop:to_stop]) < 2
+            response = book(db, user_id, from_stop, to_stop)
+            assert response[1] == (200 if fits else 400)
+            if fits:
+                legs[user_id] = (from_stop, to_stop)
+                for segment in range(from_stop, to_stop):
+                    seats[segment] += 1
+
+        assert ride(db)["segmentSeats"] == seats
+        assert sorted(ride(db)["currentPassengers"]) == sorted(legs)
+
+
+@pytest.mark.parametrize("from_stop, to_stop", [(2, 2), (3, 1), (0, 5), ("x", 2)])
+def test_invalid_legs_are_rejected(db, from_stop, to_stop):
+    """
+    Legs that are empty, reversed or off the route are refused.
+    """
+    assert book(db, "a", from_stop, to_stop) == (
+        {"error": "Invalid stops for this ride."}, 400
+    )